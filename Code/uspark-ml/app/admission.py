@@ -0,0 +1,268 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+
+from app.metrics import ADMISSION_WAIT_SECONDS, ADMISSION_REQUESTS, ADMISSION_QUEUED, ADMISSION_RUNNING
+
+# -------------------------------
+# ADMISSION CONTROL
+# -------------------------------
+# Requests are admitted into lanes before any inference runs:
+#   chat    /chat/message turns (highest priority)
+#   medseg  single /medseg uploads
+#   bulk    /medseg/batch and /medseg/volume streams (lowest priority)
+# Each lane has its own concurrency limit and a bounded wait queue, and all
+# lanes share USPARK_ADMISSION_SLOTS. When a slot frees up, waiting requests are
+# started lane by lane in priority order, earliest deadline first within a lane;
+# the per-lane limits keep a busy high-priority lane from starving the others.
+#
+# Every request has a deadline: the lane default, or the X-Deadline-Ms header
+# (milliseconds from arrival). A request is refused right away when its lane
+# queue is full (429) or when the estimated queue wait plus the lane's typical
+# service time (moving average) would miss the deadline (503). Requests whose
+# deadline can no longer be met are also shed from the queue (503). Both carry
+# Retry-After with the estimated wait. Imaging requests that are still queued
+# for inference when their deadline passes are dropped from the micro-batch.
+#
+# Queue depth, running requests and wait times are exported on /metrics
+# (uspark_admission_*) and per lane on /admission.
+#
+# USPARK_ADMISSION                   1 = enforce limits, 0 = only measure
+# USPARK_ADMISSION_SLOTS             admitted requests across all lanes
+# USPARK_ADMIT_<LANE>_LIMIT          concurrent requests in the lane
+# USPARK_ADMIT_<LANE>_QUEUE          requests allowed to wait in the lane
+# USPARK_ADMIT_<LANE>_DEADLINE_MS    default deadline (0 = none)
+
+ADMISSION = os.environ.get("USPARK_ADMISSION", "1") == "1"
+ADMISSION_SLOTS = int(os.environ.get("USPARK_ADMISSION_SLOTS", "12"))
+
+DEADLINE_HEADER = "x-deadline-ms"
+SERVICE_SMOOTHING = 0.2
+
+# name -> (priority, limit, queue size, deadline ms)
+DEFAULT_LANES = {
+    "chat": (0, 8, 64, 5000),
+    "medseg": (1, 8, 32, 30000),
+    "bulk": (2, 1, 2, 0),
+}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, lane, status_code, retry_after, reason):
+        super().__init__(f"{lane} is overloaded: {reason}")
+        self.lane = lane
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Lane:
+    def __init__(self, name, priority, limit, queue_size, deadline_ms):
+        self.name = name
+        self.priority = priority
+        self.limit = max(1, limit)
+        self.queue_size = max(0, queue_size)
+        self.deadline_ms = deadline_ms
+        self.running = 0
+        self.waiting = []     # heap of (deadline, sequence, enqueued, future)
+        self.service = None   # moving average of seconds per request
+        self.admitted = 0
+        self.rejected = 0
+        self.shed = 0
+        self.expired = 0
+        self.wait_seconds = 0.0
+
+    def estimated_wait(self):
+        # Seconds until a request queued now would start: the requests ahead of
+        # it run limit at a time, and the running ones are half done on average
+        if self.service is None or (not self.waiting and self.running < self.limit):
+            return 0.0
+        return (len(self.waiting) / self.limit + 0.5) * self.service
+
+
+class Ticket:
+    __slots__ = ("controller", "lane", "deadline", "started", "_loop", "_released")
+
+    def __init__(self, controller, lane, deadline, loop):
+        self.controller = controller
+        self.lane = lane
+        self.deadline = deadline
+        self.started = time.monotonic()
+        self._loop = loop
+        self._released = False
+
+    def remaining(self):
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    async def wait(self, awaitable):
+        # Awaits the rest of the request's work within its deadline
+        if not self.controller.enabled:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            self.lane.expired += 1
+            ADMISSION_REQUESTS.inc(lane=self.lane.name, outcome="expired")
+            raise AdmissionRejected(self.lane.name, 503, self.lane.estimated_wait(), "deadline expired")
+
+    def release(self):
+        # Safe to call more than once, and from other threads (e.g. background tasks)
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._finish()
+        else:
+            self._loop.call_soon_threadsafe(self._finish)
+
+    def _finish(self):
+        if not self._released:
+            self._released = True
+            self.controller._finish(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    def __init__(self, lanes, slots=ADMISSION_SLOTS, enabled=ADMISSION):
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.order = sorted(lanes, key=lambda lane: lane.priority)
+        self.slots = max(1, slots)
+        self.enabled = enabled
+        self.running = 0
+        self._sequence = itertools.count()
+
+    def _has_room(self, lane):
+        return not self.enabled or (lane.running < lane.limit and self.running < self.slots)
+
+    def _reject(self, lane, status_code, reason):
+        if status_code == 429:
+            lane.rejected += 1
+            ADMISSION_REQUESTS.inc(lane=lane.name, outcome="rejected")
+        else:
+            lane.shed += 1
+            ADMISSION_REQUESTS.inc(lane=lane.name, outcome="shed")
+        return AdmissionRejected(lane.name, status_code, lane.estimated_wait(), reason)
+
+    def _publish(self, lane):
+        ADMISSION_QUEUED.set(len(lane.waiting), lane=lane.name)
+        ADMISSION_RUNNING.set(lane.running, lane=lane.name)
+
+    def _start(self, lane, deadline, waited, loop):
+        lane.running += 1
+        self.running += 1
+        lane.admitted += 1
+        lane.wait_seconds += waited
+        ADMISSION_WAIT_SECONDS.observe(waited, lane=lane.name)
+        ADMISSION_REQUESTS.inc(lane=lane.name, outcome="admitted")
+        self._publish(lane)
+        return Ticket(self, lane, deadline, loop)
+
+    async def admit(self, name, budget_ms=None) -> Ticket:
+        # Waits for a slot in the lane; raises AdmissionRejected instead of queueing hopelessly
+        lane = self.lanes[name]
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        budget_ms = lane.deadline_ms if budget_ms is None else budget_ms
+        deadline = now + budget_ms / 1000.0 if budget_ms and budget_ms > 0 else None
+        if self._has_room(lane) and not lane.waiting:
+            return self._start(lane, deadline, 0.0, loop)
+        if len(lane.waiting) >= lane.queue_size:
+            raise self._reject(lane, 429, "queue is full")
+        if deadline is not None and lane.service is not None and \
+                now + lane.estimated_wait() + lane.service > deadline:
+            raise self._reject(lane, 503, "deadline cannot be met")
+
+        future = loop.create_future()
+        entry = (math.inf if deadline is None else deadline, next(self._sequence), now, future)
+        heapq.heappush(lane.waiting, entry)
+        self._publish(lane)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), None if deadline is None else deadline - now)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted at the same moment the wait ended
+                future.result().release()
+            else:
+                future.cancel()
+                if entry in lane.waiting:
+                    lane.waiting.remove(entry)
+                    heapq.heapify(lane.waiting)
+                    self._publish(lane)
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            lane.expired += 1
+            ADMISSION_REQUESTS.inc(lane=lane.name, outcome="expired")
+            raise AdmissionRejected(lane.name, 503, lane.estimated_wait(), "deadline expired in queue")
+
+    def _finish(self, ticket):
+        lane = ticket.lane
+        elapsed = time.monotonic() - ticket.started
+        lane.service = elapsed if lane.service is None else lane.service + SERVICE_SMOOTHING * (elapsed - lane.service)
+        lane.running -= 1
+        self.running -= 1
+        self._publish(lane)
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        for lane in self.order:
+            while lane.waiting and self._has_room(lane):
+                deadline, _, enqueued, future = heapq.heappop(lane.waiting)
+                if future.done():
+                    continue
+                if lane.service is not None and now + lane.service > deadline:
+                    # Would finish too late anyway; fail fast and keep the slot for someone else
+                    future.set_exception(self._reject(lane, 503, "deadline cannot be met"))
+                    continue
+                loop = future.get_loop()
+                future.set_result(self._start(lane, None if deadline == math.inf else deadline,
+                                              now - enqueued, loop))
+            self._publish(lane)
+
+    def stats(self):
+        lanes = {}
+        for lane in self.order:
+            lanes[lane.name] = {
+                "priority": lane.priority,
+                "limit": lane.limit,
+                "queue_size": lane.queue_size,
+                "deadline_ms": lane.deadline_ms,
+                "running": lane.running,
+                "queued": len(lane.waiting),
+                "admitted": lane.admitted,
+                "rejected": lane.rejected,
+                "shed": lane.shed,
+                "expired": lane.expired,
+                "mean_wait_ms": lane.wait_seconds / lane.admitted * 1000 if lane.admitted else 0.0,
+                "service_ms": lane.service * 1000 if lane.service is not None else None,
+                "estimated_wait_ms": lane.estimated_wait() * 1000,
+            }
+        return {"enabled": self.enabled, "slots": self.slots, "running": self.running, "lanes": lanes}
+
+
+def create_admission():
+    lanes = []
+    for name, (priority, limit, queue_size, deadline_ms) in DEFAULT_LANES.items():
+        prefix = f"USPARK_ADMIT_{name.upper()}_"
+        lanes.append(Lane(name, priority,
+                          int(os.environ.get(prefix + "LIMIT", limit)),
+                          int(os.environ.get(prefix + "QUEUE", queue_size)),
+                          float(os.environ.get(prefix + "DEADLINE_MS", deadline_ms))))
+    return AdmissionController(lanes)
+
+
+def deadline_budget(headers):
+    # X-Deadline-Ms from the request, or None for the lane default
+    value = headers.get(DEADLINE_HEADER)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
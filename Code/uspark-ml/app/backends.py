@@ -0,0 +1,247 @@
+import os
+import sys
+import time
+import copy
+import argparse
+import torch
+import torch.nn as nn
+
+from app.preprocess import batch_tensor
+
+# -------------------------------
+# INFERENCE BACKENDS
+# -------------------------------
+# A loaded eager model can be swapped for an optimized variant before it is
+# shared through the registry:
+#   eager         plain PyTorch (default)
+#   torchscript   traced + frozen TorchScript
+#   compile       torch.compile
+#   onnx          exported once next to the checkpoint, run with ONNX Runtime
+#   int8-dynamic  dynamic int8 quantization of Linear layers (models without
+#                 Linear layers, such as the UNets, stay eager)
+#   int8-static   FX graph-mode static int8 quantization (CPU only)
+#
+# Static quantization is calibrated, and the parity check run, on the images in
+# USPARK_BACKEND_CALIBRATION_DIR, preprocessed the way requests are; without it
+# both fall back to random inputs of the serving shape.
+#
+# USPARK_BACKEND                default backend for every model
+# USPARK_BACKEND_<MODEL>        per-model override, e.g. USPARK_BACKEND_BRAIN_TUMOR=onnx
+# USPARK_CHANNELS_LAST          1 to run convolutions in channels_last layout
+# USPARK_BACKEND_PARITY         1 to compare every optimized model with eager at load time
+# USPARK_BACKEND_CALIBRATION_DIR  representative images for calibration and parity
+# USPARK_INTRA_OP_THREADS / USPARK_INTER_OP_THREADS   torch + ONNX Runtime thread pools
+
+BACKENDS = ("eager", "torchscript", "compile", "onnx", "int8-dynamic", "int8-static")
+DEFAULT_BACKEND = os.environ.get("USPARK_BACKEND", "eager").lower()
+CHANNELS_LAST = os.environ.get("USPARK_CHANNELS_LAST", "0") in ("1", "true", "yes")
+PARITY_CHECK = os.environ.get("USPARK_BACKEND_PARITY", "0") in ("1", "true", "yes")
+CALIBRATION_DIR = os.environ.get("USPARK_BACKEND_CALIBRATION_DIR")
+INTRA_OP_THREADS = int(os.environ.get("USPARK_INTRA_OP_THREADS", "0"))
+INTER_OP_THREADS = int(os.environ.get("USPARK_INTER_OP_THREADS", "0"))
+
+
+def configure_threads(intra_op=INTRA_OP_THREADS, inter_op=INTER_OP_THREADS):
+    if intra_op > 0:
+        torch.set_num_threads(intra_op)
+    if inter_op > 0:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            # Can only be set before the first inter-op parallel work runs
+            pass
+
+
+def backend_for(name):
+    backend = os.environ.get(f"USPARK_BACKEND_{name.upper()}", DEFAULT_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend for {name}: {backend}")
+    return backend
+
+
+def supports_backend(model, backend):
+    # Dynamic quantization only replaces nn.Linear; on a conv-only model it changes nothing
+    return backend != "int8-dynamic" or any(isinstance(module, nn.Linear) for module in model.modules())
+
+
+def calibration_inputs(shape, device, directory=CALIBRATION_DIR, batches=8):
+    # Up to `batches` input batches of shape (N, C, H, W): RGB images from directory,
+    # decoded and resized like uploads, or random inputs when there are none
+    from app.ingest import decode_image, UploadRejected
+    images = []
+    if directory and shape[1] == 3:
+        for name in sorted(os.listdir(directory)):
+            if len(images) >= shape[0] * batches:
+                break
+            try:
+                with open(os.path.join(directory, name), "rb") as f:
+                    images.append(decode_image(f))
+            except (OSError, UploadRejected):
+                continue
+    if not images:
+        return [torch.rand(shape, device=device) for _ in range(batches)]
+    return [batch_tensor(images[i:i + shape[0]], tuple(shape[2:])).to(device)
+            for i in range(0, len(images), shape[0])]
+
+
+class ChannelsLast(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+class OnnxModule:
+    # Callable stand-in for an nn.Module backed by an ONNX Runtime session
+    def __init__(self, onnx_path, device):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("The onnx backend requires the onnxruntime package")
+        options = ort.SessionOptions()
+        if INTRA_OP_THREADS > 0:
+            options.intra_op_num_threads = INTRA_OP_THREADS
+        if INTER_OP_THREADS > 0:
+            options.inter_op_num_threads = INTER_OP_THREADS
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        if device.type == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(onnx_path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self.device = device
+
+    def __call__(self, x):
+        output = self.session.run(None, {self.input_name: x.detach().cpu().numpy()})[0]
+        return torch.from_numpy(output).to(x.device)
+
+    def eval(self):
+        return self
+
+
+def export_onnx(model, example, checkpoint_path):
+    # Exported once per checkpoint version; the file name carries the mtime
+    stamp = int(os.path.getmtime(checkpoint_path))
+    onnx_path = f"{os.path.splitext(checkpoint_path)[0]}.{stamp}.onnx"
+    if not os.path.exists(onnx_path):
+        tmp_path = f"{onnx_path}.{os.getpid()}.tmp"
+        torch.onnx.export(
+            model, example, tmp_path,
+            input_names=["input"], output_names=["output"],
+            dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+            opset_version=17,
+        )
+        os.replace(tmp_path, onnx_path)
+    return onnx_path
+
+
+def quantize_static(model, example, calibration=None):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    prepared = prepare_fx(model, get_default_qconfig_mapping("fbgemm"), (example,))
+    # Real preprocessed images give tighter activation ranges than random inputs
+    if calibration is None:
+        calibration = calibration_inputs(tuple(example.shape), example.device)
+    with torch.no_grad():
+        for batch in calibration:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def optimize_model(model, backend, example, checkpoint_path=None, calibration=None):
+    if backend == "eager":
+        optimized = model
+    elif backend == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example)
+        optimized = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+    elif backend == "compile":
+        optimized = torch.compile(model)
+    elif backend == "onnx":
+        optimized = OnnxModule(export_onnx(model, example, checkpoint_path), example.device)
+    elif backend in ("int8-dynamic", "int8-static"):
+        if example.device.type != "cpu":
+            raise RuntimeError(f"The {backend} backend only runs on CPU")
+        if backend == "int8-dynamic":
+            if not supports_backend(model, backend):
+                raise ValueError("The int8-dynamic backend needs Linear layers to quantize")
+            optimized = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        else:
+            optimized = quantize_static(copy.deepcopy(model), example, calibration)
+    else:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    if CHANNELS_LAST and isinstance(optimized, nn.Module) and backend in ("eager", "compile"):
+        optimized = ChannelsLast(optimized)
+    return optimized
+
+
+def parity_check(reference, candidate, inputs):
+    # Max/mean absolute difference of raw outputs and agreement of the argmax
+    # over the class/channel dimension, which is what the pipeline consumes
+    max_diff, total_diff, count, agree, total = 0.0, 0.0, 0, 0, 0
+    with torch.no_grad():
+        for x in inputs:
+            expected = reference(x).float()
+            actual = candidate(x).float()
+            diff = (expected - actual).abs()
+            max_diff = max(max_diff, diff.max().item())
+            total_diff += diff.sum().item()
+            count += diff.numel()
+            if expected.shape[1] > 1:
+                matches = expected.argmax(dim=1) == actual.argmax(dim=1)
+            else:
+                matches = (expected > 0) == (actual > 0)
+            agree += matches.sum().item()
+            total += matches.numel()
+    return {
+        "max_abs_diff": max_diff,
+        "mean_abs_diff": total_diff / count if count else 0.0,
+        "argmax_agreement": agree / total if total else 1.0,
+    }
+
+
+def benchmark(model, example, runs=10):
+    with torch.no_grad():
+        model(example)
+        start = time.perf_counter()
+        for _ in range(runs):
+            model(example)
+    return (time.perf_counter() - start) / runs
+
+
+def main(argv=None):
+    # Compare every backend for one registered model against eager:
+    #   python -m app.backends --model brain_tumor --batch 4
+    parser = argparse.ArgumentParser(description="Accuracy/latency comparison of inference backends")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--calibration", default=CALIBRATION_DIR,
+                        help="directory of representative images (default: random inputs)")
+    args = parser.parse_args(argv)
+
+    configure_threads()
+    from app.mediseg import registry
+    entry = registry._entries[args.model]
+    reference = registry.load_eager(args.model)
+    example = registry.example_input(args.model, args.batch)
+    inputs = calibration_inputs(tuple(example.shape), example.device, args.calibration, batches=4)
+    print(f"{'backend':<14}{'latency_ms':>12}{'max_abs_diff':>15}{'argmax_agree':>14}")
+    for backend in args.backends.split(","):
+        try:
+            candidate = optimize_model(reference, backend, example, entry.path, inputs)
+            parity = parity_check(reference, candidate, inputs)
+            latency = benchmark(candidate, example, args.runs)
+        except Exception as exc:
+            print(f"{backend:<14}failed: {exc}")
+            continue
+        print(f"{backend:<14}{latency * 1000:>12.1f}{parity['max_abs_diff']:>15.2e}{parity['argmax_agreement']:>14.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
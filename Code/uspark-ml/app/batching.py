@@ -0,0 +1,100 @@
+import asyncio
+import os
+
+# -------------------------------
+# DYNAMIC MICRO-BATCHING
+# -------------------------------
+# Concurrent requests are collected until either max_batch_size items are
+# waiting or max_wait_ms has passed since the first one arrived. The batch is
+# then handed to process_batch (a blocking function mapping a list of items to
+# a list of results) on a worker thread, so the event loop keeps accepting
+# uploads while inference runs. Requests that arrive during inference form the
+# next batch. With concurrency > 1 (one per inference worker process) that many
+# batches can be in flight at once.
+
+MAX_BATCH_SIZE = int(os.environ.get("USPARK_BATCH_MAX_SIZE", "8"))
+MAX_WAIT_MS = float(os.environ.get("USPARK_BATCH_WINDOW_MS", "10"))
+
+
+class MicroBatcher:
+    def __init__(self, process_batch, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, executor=None,
+                 concurrency=1):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.executor = executor
+        self.concurrency = max(1, concurrency)
+        self._queue = None
+        self._slots = None
+        self._in_flight = set()
+        self._worker = None
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._slots = self._slots or asyncio.Semaphore(self.concurrency)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # A free slot is taken before collecting, so requests keep accumulating
+            # into the next batch while every slot is busy
+            await self._slots.acquire()
+            batch = await self._collect()
+            task = loop.create_task(self._process(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _process(self, batch):
+        try:
+            # Callers that gave up (e.g. client disconnects) are dropped before inference
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                return
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(self.executor, self.process_batch, [item for item, _ in batch])
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                return
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "concurrency": self.concurrency,
+        }
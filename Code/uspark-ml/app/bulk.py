@@ -0,0 +1,307 @@
+import io
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import zipfile
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from app.ingest import decode_image, UploadRejected, MAX_UPLOAD_MB
+
+# -------------------------------
+# BULK PROCESSING (study folders, zip archives, /medseg/batch)
+# -------------------------------
+# Images are decoded on a thread pool one batch ahead of inference, and each
+# batch is classified and segmented together (one forward pass per model), the
+# same way as the /medseg micro-batches. The CLI writes one consolidated
+# results.jsonl (plus rendered images / mask files next to it) that doubles as
+# the resume manifest: re-running the same command skips every image already
+# recorded in it.
+#
+#   python -m app.bulk /data/studies archive.zip --out backfill --output mask
+#
+# Zip archives are checked against their directory before anything is
+# decompressed: too many images or too large a total uncompressed size rejects
+# the archive (413), and a member that would expand past USPARK_MAX_UPLOAD_MB is
+# reported as an error for that image, so a small zip bomb cannot inflate to
+# gigabytes in memory. Zipped DICOM series on /medseg/volume go through the
+# same checks.
+#
+# USPARK_BULK_BATCH_SIZE   images per inference batch
+# USPARK_DECODE_WORKERS    threads decoding images ahead of inference
+# USPARK_ZIP_MAX_MEMBERS   images per zip archive
+# USPARK_ZIP_MAX_TOTAL_MB  total uncompressed size of the images in one archive
+
+BULK_BATCH_SIZE = int(os.environ.get("USPARK_BULK_BATCH_SIZE", "16"))
+DECODE_WORKERS = int(os.environ.get("USPARK_DECODE_WORKERS", "4"))
+ZIP_MAX_MEMBERS = int(os.environ.get("USPARK_ZIP_MAX_MEMBERS", "10000"))
+ZIP_MAX_TOTAL_MB = float(os.environ.get("USPARK_ZIP_MAX_TOTAL_MB", "4096"))
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+_decode_executor = None
+
+
+def get_decode_executor():
+    global _decode_executor
+    if _decode_executor is None:
+        _decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+    return _decode_executor
+
+
+def is_image_name(name):
+    return (name or "").lower().endswith(IMAGE_SUFFIXES)
+
+
+def read_member(archive, info, limit):
+    if info.file_size > limit:
+        raise UploadRejected(f"{info.filename} expands to {info.file_size} bytes, limit is {limit}", 413)
+    with archive.open(info) as f:
+        data = f.read(limit + 1)
+    if len(data) > limit:
+        raise UploadRejected(f"{info.filename} expands past {limit} bytes", 413)
+    return data
+
+
+def zip_sources(archive, prefix, max_members=ZIP_MAX_MEMBERS, max_total_mb=ZIP_MAX_TOTAL_MB,
+                max_member_mb=MAX_UPLOAD_MB, accept=is_image_name):
+    # accept: which member names to read (images by default; DICOM series take every file)
+    members = sorted((info for info in archive.infolist() if not info.is_dir() and accept(info.filename)
+                      and not info.filename.startswith("__MACOSX/")), key=lambda info: info.filename)
+    if len(members) > max_members:
+        raise UploadRejected(f"{prefix} has {len(members)} files, limit is {max_members}", 413)
+    total = sum(info.file_size for info in members)
+    if total > max_total_mb * 2 ** 20:
+        raise UploadRejected(f"{prefix} expands to {total} bytes, limit is {int(max_total_mb * 2 ** 20)}", 413)
+    limit = int(max_member_mb * 2 ** 20)
+    for info in members:
+        yield f"{prefix}!{info.filename}", lambda info=info: read_member(archive, info, limit)
+
+
+def iter_path_sources(paths):
+    # (source id, reader returning the encoded bytes) for every image under paths
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    if name.lower().endswith(".zip"):
+                        yield from zip_sources(zipfile.ZipFile(full), full)
+                    elif is_image_name(name):
+                        yield full, lambda full=full: open(full, "rb").read()
+        elif path.lower().endswith(".zip"):
+            yield from zip_sources(zipfile.ZipFile(path), path)
+        else:
+            yield path, lambda path=path: open(path, "rb").read()
+
+
+def upload_sources(files):
+    # files: list of (filename, file object) from a multipart upload
+    sources = []
+    for name, fileobj in files:
+        if (name or "").lower().endswith(".zip"):
+            sources.extend(zip_sources(zipfile.ZipFile(fileobj), name))
+        else:
+            sources.append((name, lambda fileobj=fileobj: (fileobj.seek(0), fileobj.read())[1]))
+    return sources
+
+
+def decode_source(source):
+    source_id, read = source
+    try:
+        return source_id, decode_image(io.BytesIO(read())), None
+    except Exception as exc:
+        return source_id, None, f"{type(exc).__name__}: {exc}"
+
+
+def iter_decoded_batches(sources, batch_size=BULK_BATCH_SIZE, executor=None):
+    # Decoding of batch k+1 is submitted before batch k is handed out
+    executor = executor or get_decode_executor()
+    pending, chunk = None, []
+    for source in sources:
+        chunk.append(source)
+        if len(chunk) == batch_size:
+            futures = [executor.submit(decode_source, item) for item in chunk]
+            if pending is not None:
+                yield [future.result() for future in pending]
+            pending, chunk = futures, []
+    if chunk:
+        futures = [executor.submit(decode_source, item) for item in chunk]
+        if pending is not None:
+            yield [future.result() for future in pending]
+        pending = futures
+    if pending is not None:
+        yield [future.result() for future in pending]
+
+
+def run_decoded_batch(decoded, output, run_batch):
+    # Returns (source id, result or None, error or None) in input order. If the
+    # batch fails as a whole, its images are retried one at a time so a single
+    # bad image (or a worker restart) only costs the images that really fail.
+    ok = [(source_id, image) for source_id, image, error in decoded if error is None]
+    errors = {source_id: error for source_id, _, error in decoded if error is not None}
+    results = {}
+    if ok:
+        try:
+            results = dict(zip([source_id for source_id, _ in ok], run_batch([(image, output) for _, image in ok])))
+        except Exception:
+            for source_id, image in ok:
+                try:
+                    results[source_id] = run_batch([(image, output)])[0]
+                except Exception as exc:
+                    errors[source_id] = f"{type(exc).__name__}: {exc}"
+    return [(source_id, results.get(source_id), errors.get(source_id)) for source_id, _, _ in decoded]
+
+
+def next_bulk_results(batches, output, run_batch):
+    # Pulls the next decoded batch and runs it; None when the input is exhausted
+    decoded = next(batches, None)
+    if decoded is None:
+        return None
+    return run_decoded_batch(decoded, output, run_batch)
+
+
+# -------------------------------
+# Consolidated output + resume manifest
+# -------------------------------
+class BulkOutput:
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.results_path = os.path.join(out_dir, "results.jsonl")
+        os.makedirs(out_dir, exist_ok=True)
+        self.done = self._load_done()
+        self._file = open(self.results_path, "a", encoding="utf-8")
+        self.written = 0
+        self.errors = 0
+
+    def _load_done(self):
+        if not os.path.exists(self.results_path):
+            return set()
+        with open(self.results_path, "rb+") as f:
+            data = f.read()
+            # A line cut short by a crash is dropped so appends start on a fresh line
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+        done = set()
+        for line in data[:end].splitlines():
+            done.add(json.loads(line)["id"])
+        return done
+
+    def _artifact(self, source_id, folder, suffix, data):
+        stem = os.path.splitext(os.path.basename(source_id.split("!")[-1]))[0]
+        name = f"{hashlib.sha1(source_id.encode('utf-8')).hexdigest()[:12]}-{stem}.{suffix}"
+        os.makedirs(os.path.join(self.out_dir, folder), exist_ok=True)
+        with open(os.path.join(self.out_dir, folder, name), "wb") as f:
+            f.write(data)
+        return f"{folder}/{name}"
+
+    def write(self, source_id, result, error):
+        record = {"id": source_id}
+        if error is not None:
+            record.update(status="error", error=error)
+            self.errors += 1
+        else:
+            record.update(status="ok", predicted_modality=result["predicted_modality"])
+            if "segmentation_result" in result:
+                record["image_file"] = self._artifact(source_id, "images", result["segmentation_format"],
+                                                      base64.b64decode(result["segmentation_result"]))
+            if result.get("mask_bytes") is not None:
+                record["mask_file"] = self._artifact(source_id, "masks", "bin", result["mask_bytes"])
+            if "mask" in result:
+                record["mask"] = result["mask"]
+        # Artifacts are written before their record, so a recorded image is complete
+        self._file.write(json.dumps(record) + "\n")
+        self.done.add(source_id)
+        self.written += 1
+
+    def commit(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.commit()
+        self._file.close()
+
+
+def write_parquet(results_path, parquet_path):
+    import pandas as pd
+
+    frame = pd.read_json(results_path, lines=True)
+    # Nested mask payloads are kept as JSON text
+    for column in frame.columns:
+        if frame[column].map(lambda value: isinstance(value, (dict, list))).any():
+            frame[column] = frame[column].map(lambda value: json.dumps(value) if isinstance(value, (dict, list)) else value)
+    frame.to_parquet(parquet_path, index=False)
+
+
+def run_bulk(paths, out_dir, output="mask", batch_size=BULK_BATCH_SIZE, inference=None, progress=True):
+    from app.workers import create_inference
+
+    inference = inference or create_inference()
+    out = BulkOutput(out_dir)
+    skipped = 0
+
+    def pending_sources():
+        nonlocal skipped
+        for source in iter_path_sources(paths):
+            if source[0] in out.done:
+                skipped += 1
+            else:
+                yield source
+
+    # One batch in flight per inference worker process
+    concurrency = max(1, getattr(inference, "workers", 0))
+    started = time.perf_counter()
+    inflight = deque()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk") as pool:
+        def drain_one():
+            for source_id, result, error in inflight.popleft().result():
+                out.write(source_id, result, error)
+            out.commit()
+            if progress:
+                elapsed = time.perf_counter() - started
+                print(f"{out.written} images ({out.errors} errors, {skipped} already done) "
+                      f"{out.written / elapsed:.1f} img/s", file=sys.stderr)
+
+        for decoded in iter_decoded_batches(pending_sources(), batch_size):
+            inflight.append(pool.submit(run_decoded_batch, decoded, output, inference.run_batch))
+            if len(inflight) >= concurrency:
+                drain_one()
+        while inflight:
+            drain_one()
+    out.close()
+    summary = {
+        "processed": out.written,
+        "errors": out.errors,
+        "skipped": skipped,
+        "total": len(out.done),
+        "seconds": time.perf_counter() - started,
+        "output": output,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify and segment every image in folders or zip archives")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or zip archives")
+    parser.add_argument("--out", required=True, help="output directory (results.jsonl, images/, masks/)")
+    parser.add_argument("--output", default="mask", choices=("composite", "mask", "binary"))
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument("--parquet", action="store_true", help="also write results.parquet (needs pyarrow)")
+    args = parser.parse_args(argv)
+
+    summary = run_bulk(args.inputs, args.out, args.output, args.batch_size)
+    if args.parquet:
+        write_parquet(os.path.join(args.out, "results.jsonl"), os.path.join(args.out, "results.parquet"))
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
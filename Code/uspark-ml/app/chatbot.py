@@ -1,67 +1,68 @@
-import pandas as pd
-import json
-import numpy as np
-import faiss
-from sklearn.feature_extraction.text import TfidfVectorizer
-from transformers import pipeline
+import os
 
-# -------------------------------
-# Load disease data and preprocess
-# -------------------------------
-def load_disease_data(csv_path):
-    df = pd.read_csv(csv_path)
-    df.columns = df.columns.str.strip().str.lower()
-    df = df.fillna("")
-    disease_symptoms = {}
-    disease_precautions = {}
-    for _, row in df.iterrows():
-        disease = row["disease"].strip()
-        symptoms = [s.strip().lower() for s in row["symptoms"].split(",") if s.strip()]
-        precautions = [p.strip() for p in row["precautions"].split(",") if p.strip()]
-        disease_symptoms[disease] = symptoms
-        disease_precautions[disease] = precautions
-    return disease_symptoms, disease_precautions
-
-# Load CSV data (ensure this CSV file is in the repository root)
-disease_symptoms, disease_precautions = load_disease_data("disease_sympts_prec_full.csv")
-known_symptoms = set()
-for syms in disease_symptoms.values():
-    known_symptoms.update(syms)
+from app.knowledge_base import load_or_build_knowledge_base
+from app.ner import NERService
+from app.diagnosis import DiagnosisEngine
+from app.metrics import stage
 
 # -------------------------------
-# Build symptom vectorizer and FAISS index
+# Load the precomputed disease knowledge base
 # -------------------------------
-vectorizer = TfidfVectorizer()
-symptom_texts = [" ".join(symptoms) for symptoms in disease_symptoms.values()]
-tfidf_matrix = vectorizer.fit_transform(symptom_texts).toarray()
-index = faiss.IndexFlatL2(tfidf_matrix.shape[1])
-index.add(np.array(tfidf_matrix, dtype=np.float32))
-disease_list = list(disease_symptoms.keys())
+# Built offline by `python -m app.knowledge_base` and memory-mapped here; if the
+# artifact is missing or older than the CSV it is rebuilt in-process.
+KB_PATH = os.environ.get("USPARK_KB_PATH", "kb")
+DISEASE_CSV = os.environ.get("USPARK_DISEASE_CSV", "disease_sympts_prec_full.csv")
+# USPARK_RETRIEVAL_SCORING selects cosine (TF-IDF) or bm25 ranking
+RETRIEVAL_SCORING = os.environ.get("USPARK_RETRIEVAL_SCORING", "cosine").lower()
 
-def find_closest_disease(user_symptoms):
+kb = load_or_build_knowledge_base(KB_PATH, DISEASE_CSV)
+disease_symptoms = kb.disease_symptoms()
+disease_precautions = kb.disease_precautions()
+known_symptoms = set(kb.symptoms)
+
+vectorizer = kb.vectorizer
+index = kb.index(RETRIEVAL_SCORING)
+disease_list = kb.diseases
+
+# Full index search over all reported symptoms; sessions use the incremental
+# engine below, which ranks the same way (benchmarks/micro.py, tests/test_diagnosis.py)
+def find_closest_diseases(user_symptoms, k=5):
     if not user_symptoms:
-        return None
-    user_vector = vectorizer.transform([" ".join(user_symptoms)]).toarray().astype("float32")
-    distances, indices = index.search(user_vector, k=1)
-    return disease_list[indices[0][0]]
+        return []
+    user_vector = vectorizer.transform([" ".join(user_symptoms)])
+    return [(disease_list[doc], score) for doc, score in index.search_vector(user_vector, k=k)]
+
+def find_closest_disease(user_symptoms):
+    matches = find_closest_diseases(user_symptoms, k=1)
+    return matches[0][0] if matches else None
+
+# Per-session running disease scores and follow-up selection (see app/diagnosis.py)
+diagnosis = DiagnosisEngine(kb, index, vectorizer)
 
 # -------------------------------
 # Load Medical NER model for symptom extraction
 # -------------------------------
-medical_ner = pipeline(
-    "ner",
-    model="blaze999/Medical-NER",
-    tokenizer="blaze999/Medical-NER",
-    aggregation_strategy="simple"
-)
+# The transformer is loaded on first use and sits behind the NER service's
+# cache, dictionary matcher and batcher
+def load_medical_ner():
+    # transformers (and torch) are imported here so importing the chatbot stays cheap
+    from transformers import pipeline
+    from app.weights import WEIGHTS_FORMAT, NER_WEIGHTS, map_module_weights
+    ner = pipeline(
+        "ner",
+        model="blaze999/Medical-NER",
+        tokenizer="blaze999/Medical-NER",
+        aggregation_strategy="simple"
+    )
+    # Share the transformer weights between worker processes (see app/weights.py)
+    if WEIGHTS_FORMAT == "mmap":
+        map_module_weights(ner.model, NER_WEIGHTS)
+    return ner
+
+ner_service = NERService(load_medical_ner, known_symptoms)
 
 def extract_symptoms_ner(text):
-    results = medical_ner(text)
-    extracted = []
-    for r in results:
-        if "SIGN_SYMPTOM" in r["entity_group"]:
-            extracted.append(r["word"].lower())
-    return list(set(extracted))
+    return ner_service.extract(text)
 
 def is_affirmative(answer):
     answer_lower = answer.lower()
@@ -71,6 +72,14 @@ def is_affirmative(answer):
 # Chatbot session class
 # -------------------------------
 class ChatbotSession:
+    # Fixed slots keep per-session memory small and make the state explicit for
+    # to_state/from_state, which the shared session stores serialize. The disease
+    # scores are derived from reported/denied symptoms and rebuilt after a load.
+    __slots__ = ("conversation_history", "reported_symptoms", "asked_missing", "awaiting_followup",
+                 "state", "finished", "pain_level", "medications", "_scores")
+
+    STATE_VERSION = 1
+
     def __init__(self):
         self.conversation_history = []
         self.reported_symptoms = set()
@@ -81,6 +90,21 @@ class ChatbotSession:
         greeting = "Doctor: Hello, I am your virtual doctor. What brought you in today?"
         self.conversation_history.append(greeting)
         self.finished = False
+        self.pain_level = None
+        self.medications = None
+        self._scores = None
+
+    @property
+    def scores(self):
+        if self._scores is None:
+            self._scores = diagnosis.rebuild(self.reported_symptoms, self.asked_missing - self.reported_symptoms)
+        return self._scores
+
+    def confirm_symptom(self, symptom):
+        if symptom not in self.reported_symptoms:
+            scores = self.scores
+            self.reported_symptoms.add(symptom)
+            diagnosis.confirm(scores, symptom)
 
     def process_message(self, message: str) -> str:
         # State: collecting symptoms
@@ -93,28 +117,25 @@ class ChatbotSession:
             # If we are waiting on a follow-up about a specific symptom
             if self.awaiting_followup:
                 if is_affirmative(message):
-                    self.reported_symptoms.add(self.awaiting_followup)
+                    self.confirm_symptom(self.awaiting_followup)
+                else:
+                    diagnosis.deny(self.scores, self.awaiting_followup)
                 self.asked_missing.add(self.awaiting_followup)
                 self.awaiting_followup = None
             else:
                 # Extract symptoms from message text
-                ner_results = extract_symptoms_ner(message)
+                with stage("chat", "ner"):
+                    ner_results = extract_symptoms_ner(message)
                 for sym in ner_results:
-                    if sym not in self.reported_symptoms:
-                        self.reported_symptoms.add(sym)
-            # Update predicted disease
-            predicted_disease = find_closest_disease(list(self.reported_symptoms)) if self.reported_symptoms else None
-            # Check for missing symptoms if a disease is predicted
-            if predicted_disease:
-                expected = set(disease_symptoms.get(predicted_disease, []))
-                missing = expected - self.reported_symptoms
-                not_asked = missing - self.asked_missing
-                if not_asked:
-                    symptom_to_ask = list(not_asked)[0]
-                    followup = f"Are you also experiencing {symptom_to_ask}?"
-                    self.conversation_history.append("Doctor: " + followup)
-                    self.awaiting_followup = symptom_to_ask
-                    return followup
+                    self.confirm_symptom(sym)
+            # Pick the follow-up that best separates the current top candidates
+            with stage("chat", "retrieval"):
+                symptom_to_ask = diagnosis.next_question(self.scores, self.reported_symptoms | self.asked_missing)
+            if symptom_to_ask:
+                followup = f"Are you also experiencing {symptom_to_ask}?"
+                self.conversation_history.append("Doctor: " + followup)
+                self.awaiting_followup = symptom_to_ask
+                return followup
             prompt = "Doctor: Do you have any other symptoms you'd like to mention?"
             self.conversation_history.append(prompt)
             return prompt
@@ -144,6 +165,36 @@ class ChatbotSession:
         return {
             "conversation": self.conversation_history,
             "symptoms": list(self.reported_symptoms),
-            "pain_level": getattr(self, "pain_level", None),
-            "medications": getattr(self, "medications", None)
+            "pain_level": self.pain_level,
+            "medications": self.medications
         }
+
+    def to_state(self) -> dict:
+        # Compact, JSON-serializable snapshot with short keys
+        return {
+            "v": self.STATE_VERSION,
+            "h": self.conversation_history,
+            "r": sorted(self.reported_symptoms),
+            "a": sorted(self.asked_missing),
+            "f": self.awaiting_followup,
+            "s": self.state,
+            "d": self.finished,
+            "p": self.pain_level,
+            "m": self.medications,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "ChatbotSession":
+        if state.get("v") != cls.STATE_VERSION:
+            raise ValueError(f"Unsupported session state version: {state.get('v')}")
+        session = cls.__new__(cls)
+        session.conversation_history = list(state["h"])
+        session.reported_symptoms = set(state["r"])
+        session.asked_missing = set(state["a"])
+        session.awaiting_followup = state["f"]
+        session.state = state["s"]
+        session.finished = state["d"]
+        session.pain_level = state["p"]
+        session.medications = state["m"]
+        session._scores = None
+        return session
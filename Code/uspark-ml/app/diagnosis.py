@@ -0,0 +1,132 @@
+import os
+import math
+import heapq
+import numpy as np
+
+# -------------------------------
+# INCREMENTAL DISEASE INFERENCE
+# -------------------------------
+# Each chat session keeps a running score per disease instead of re-vectorizing
+# all reported symptoms and searching the whole index every turn. Confirming a
+# symptom adds the index postings of its terms (the unnormalized query weights,
+# so the ranking matches find_closest_diseases); denying one multiplies the
+# diseases that list it by USPARK_DENIED_WEIGHT. Both only touch the affected
+# diseases, and scores are kept sparse.
+#
+# The next follow-up question is chosen among the symptoms of the top
+# USPARK_FOLLOWUP_CANDIDATES diseases that still score within USPARK_FOLLOWUP_RATIO
+# of the best one: the symptom whose answer splits their score mass most evenly
+# (highest binary entropy), so each answer rules out as much as possible. Once a
+# single candidate is left, or no unasked symptom separates them, no question is
+# asked.
+#
+# USPARK_DENIED_WEIGHT        score factor per denied symptom (1 = ignore denials)
+# USPARK_FOLLOWUP_CANDIDATES  top-k diseases considered for the next question
+# USPARK_FOLLOWUP_RATIO       minimum score relative to the best candidate
+
+DENIED_WEIGHT = float(os.environ.get("USPARK_DENIED_WEIGHT", "0.5"))
+FOLLOWUP_CANDIDATES = int(os.environ.get("USPARK_FOLLOWUP_CANDIDATES", "5"))
+FOLLOWUP_RATIO = float(os.environ.get("USPARK_FOLLOWUP_RATIO", "0.5"))
+
+
+class DiseaseScores:
+    __slots__ = ("relevance", "denials")
+
+    def __init__(self):
+        self.relevance = {}  # disease id -> accumulated term score
+        self.denials = {}    # disease id -> number of denied symptoms it lists
+
+
+def binary_entropy(p):
+    if p <= 0.0 or p >= 1.0:
+        return 0.0
+    return -(p * math.log2(p) + (1 - p) * math.log2(1 - p))
+
+
+class DiagnosisEngine:
+    def __init__(self, kb, index, vectorizer, denied_weight=DENIED_WEIGHT, candidates=FOLLOWUP_CANDIDATES,
+                 ratio=FOLLOWUP_RATIO):
+        self.kb = kb
+        self.index = index
+        self.vectorizer = vectorizer
+        self.denied_weight = denied_weight
+        self.candidates = candidates
+        self.ratio = ratio
+        self._terms = {}
+        # symptom id -> disease ids listing it (transpose of the disease -> symptom arrays)
+        symptom_ids = np.asarray(kb.disease_symptom_ids)
+        owners = np.repeat(np.arange(len(kb.diseases), dtype=np.int32), np.diff(np.asarray(kb.disease_indptr)))
+        order = np.argsort(symptom_ids, kind="stable")
+        self._symptom_diseases = owners[order]
+        self._symptom_indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(symptom_ids, minlength=len(kb.symptoms)))]).astype(np.int64)
+
+    def symptom_terms(self, symptom):
+        # (term ids, query weights) for one symptom; only knowledge-base symptoms are
+        # cached, so free text from chat messages cannot grow the cache
+        terms = self._terms.get(symptom)
+        if terms is None:
+            row = self.vectorizer.transform([symptom])
+            weights = row.data.astype(np.float64)
+            if self.index.scoring == "cosine":
+                weights = weights * self.index.idf[row.indices]
+            terms = (row.indices, weights)
+            if symptom in self.kb.symptom_ids:
+                self._terms[symptom] = terms
+        return terms
+
+    def diseases_with(self, symptom):
+        symptom_id = self.kb.symptom_ids.get(symptom)
+        if symptom_id is None:
+            return ()
+        return self._symptom_diseases[self._symptom_indptr[symptom_id]:self._symptom_indptr[symptom_id + 1]]
+
+    def confirm(self, scores, symptom):
+        relevance = scores.relevance
+        for term, weight in zip(*self.symptom_terms(symptom)):
+            docs, doc_weights = self.index.postings(term)
+            for doc, doc_weight in zip(docs.tolist(), doc_weights.tolist()):
+                relevance[doc] = relevance.get(doc, 0.0) + weight * doc_weight
+
+    def deny(self, scores, symptom):
+        if self.denied_weight == 1.0:
+            return
+        for doc in np.asarray(self.diseases_with(symptom)).tolist():
+            scores.denials[doc] = scores.denials.get(doc, 0) + 1
+
+    def rebuild(self, reported, denied):
+        scores = DiseaseScores()
+        for symptom in sorted(reported):
+            self.confirm(scores, symptom)
+        for symptom in sorted(denied):
+            self.deny(scores, symptom)
+        return scores
+
+    def top(self, scores, k=1):
+        # Up to k (disease id, score) pairs, highest first, lowest id on ties;
+        # only diseases sharing a term with a confirmed symptom are returned
+        denials, factor = scores.denials, self.denied_weight
+        ranked = ((score * factor ** denials.get(doc, 0), doc) for doc, score in scores.relevance.items() if score > 0)
+        return [(doc, score) for score, doc in heapq.nsmallest(k, ranked, key=lambda item: (-item[0], item[1]))]
+
+    def next_question(self, scores, exclude):
+        # Most discriminative unasked symptom among the top candidates, or None
+        candidates = self.top(scores, self.candidates)
+        if not candidates:
+            return None
+        candidates = [(doc, score) for doc, score in candidates if score >= self.ratio * candidates[0][1]]
+        total = sum(score for _, score in candidates)
+        if len(candidates) < 2 or total <= 0:
+            return None
+        mass = {}
+        for doc, score in candidates:
+            start, end = self.kb.disease_indptr[doc], self.kb.disease_indptr[doc + 1]
+            for symptom_id in np.asarray(self.kb.disease_symptom_ids[start:end]).tolist():
+                symptom = self.kb.symptoms[symptom_id]
+                if symptom not in exclude:
+                    mass[symptom] = mass.get(symptom, 0.0) + score / total
+        if not mass:
+            return None
+        # Best split first; on equal splits the likelier symptom, then by name
+        symptom, share = min(mass.items(), key=lambda item: (-round(binary_entropy(item[1]), 9), -item[1], item[0]))
+        return symptom if round(binary_entropy(share), 9) > 0 else None
@@ -0,0 +1,100 @@
+import os
+import threading
+import weakref
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# -------------------------------
+# CLASS ACTIVATION MAPS
+# -------------------------------
+# One engine per loaded model, attached once. The forward hook on the target
+# layer keeps its activations, and the model's own parameters never require
+# grad, so:
+#   gradcam  only the small head (avgpool + fc) is recorded by autograd; the
+#            gradient w.r.t. the activations comes from torch.autograd.grad,
+#            which frees the graph immediately and never touches parameter .grad
+#   cam      classic CAM from the fc weights of the predicted class, with no
+#            autograd at all, so a heatmap costs one forward pass
+# Both work on whole batches.
+#
+# USPARK_CAM_MODE  gradcam | cam
+
+CAM_MODE = os.environ.get("USPARK_CAM_MODE", "gradcam").lower()
+CAM_MODES = ("gradcam", "cam")
+
+
+class CAMEngine:
+    def __init__(self, model, target_layer="layer4", classifier="fc"):
+        # Weak, so the engine (kept per model in _engines) does not keep its model alive
+        self._model = weakref.ref(model)
+        self.target_layer = getattr(model, target_layer)
+        self.classifier = getattr(model, classifier)
+        for parameter in model.parameters():
+            parameter.requires_grad_(False)
+        self._local = threading.local()
+        self._handle = self.target_layer.register_forward_hook(self._capture)
+
+    @property
+    def model(self):
+        model = self._model()
+        if model is None:
+            raise RuntimeError("The model of this CAM engine has been released")
+        return model
+
+    def _capture(self, module, inputs, output):
+        if torch.is_grad_enabled():
+            # Cut the graph here so autograd only records the head
+            output = output.detach().requires_grad_(True)
+        self._local.activations = output
+        return output
+
+    def _normalize(self, cams, size):
+        H, W = size
+        results = []
+        for cam in cams.cpu().numpy():
+            cam = cv2.resize(cam, (W, H))
+            results.append((cam - np.min(cam)) / (np.max(cam) - np.min(cam) + 1e-8))
+        return results
+
+    def generate(self, input_tensor, mode=None):
+        # Returns (list of HxW heatmaps in [0, 1], logits) for a batch
+        mode = mode or CAM_MODE
+        if mode not in CAM_MODES:
+            raise ValueError(f"Unsupported CAM mode: {mode}")
+        try:
+            if mode == "cam":
+                with torch.no_grad():
+                    logits = self.model(input_tensor)
+                    activations = self._local.activations
+                    weights = self.classifier.weight[logits.argmax(dim=1)]
+                    cams = F.relu(torch.einsum("bc,bchw->bhw", weights, activations))
+            else:
+                with torch.enable_grad():
+                    logits = self.model(input_tensor)
+                    activations = self._local.activations
+                    score = logits.gather(1, logits.argmax(dim=1, keepdim=True)).sum()
+                    gradients, = torch.autograd.grad(score, activations)
+                weights = gradients.mean(dim=(2, 3), keepdim=True)
+                cams = F.relu((weights * activations.detach()).sum(dim=1))
+        finally:
+            self._local.activations = None
+        return self._normalize(cams, input_tensor.shape[-2:]), logits.detach()
+
+    def close(self):
+        self._handle.remove()
+
+
+_engines = weakref.WeakKeyDictionary()
+_engines_lock = threading.Lock()
+
+
+def get_cam_engine(model):
+    # Hot-reloaded models are new objects and get a fresh engine; old engines go with their model
+    with _engines_lock:
+        engine = _engines.get(model)
+        if engine is None:
+            engine = CAMEngine(model)
+            _engines[model] = engine
+        return engine
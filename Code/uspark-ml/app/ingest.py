@@ -0,0 +1,123 @@
+import os
+import json
+from PIL import Image
+from starlette.exceptions import HTTPException
+
+# -------------------------------
+# UPLOAD INGESTION
+# -------------------------------
+# Uploads are limited while they stream in: a request whose Content-Length is
+# over the limit is answered with 413 before its body is read, and bodies sent
+# without one (chunked) are cut off as soon as they pass it. The file is then
+# sniffed by its magic bytes and its header checked against the pixel limit
+# before any pixel data is decoded.
+#
+# Decoding goes straight to the resolution the pipeline needs (every model input
+# and render is at most 256px): JPEGs use the decoder's DCT scaling (draft mode)
+# to produce the smallest scale with both sides >= USPARK_DECODE_SIDE, other
+# formats are box-reduced by an integer factor right after decoding. The color
+# conversion to RGB happens once, on the reduced image. Tiled segmentation needs
+# the source resolution, so the reduction is skipped while it is enabled.
+#
+# USPARK_MAX_UPLOAD_MB        limit for a single /medseg upload
+# USPARK_MAX_BATCH_UPLOAD_MB  limit for /medseg/batch and /medseg/volume requests
+# USPARK_MAX_PIXELS           largest accepted width x height
+# USPARK_DECODE_SIDE          minimum side after reduced decode (0 = full resolution)
+
+MAX_UPLOAD_MB = float(os.environ.get("USPARK_MAX_UPLOAD_MB", "32"))
+MAX_BATCH_UPLOAD_MB = float(os.environ.get("USPARK_MAX_BATCH_UPLOAD_MB", "1024"))
+MAX_PIXELS = int(os.environ.get("USPARK_MAX_PIXELS", "100000000"))
+DECODE_SIDE = int(os.environ.get("USPARK_DECODE_SIDE", "512"))
+# Read here rather than from app.tiling, which imports torch
+FULL_RESOLUTION = os.environ.get("USPARK_TILED_SEGMENTATION", "off").lower() != "off"
+
+UPLOAD_LIMITS = {
+    "/medseg": int(MAX_UPLOAD_MB * 2 ** 20),
+    "/medseg/batch": int(MAX_BATCH_UPLOAD_MB * 2 ** 20),
+    "/medseg/volume": int(MAX_BATCH_UPLOAD_MB * 2 ** 20),
+}
+
+MAGIC_BYTES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+)
+
+
+class UploadRejected(ValueError):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def sniff_format(head: bytes):
+    for magic, name in MAGIC_BYTES:
+        if head.startswith(magic):
+            return name
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def decode_image(fileobj, target=None) -> Image.Image:
+    # fileobj: seekable binary file; returns an RGB image no smaller than target on either side
+    if target is None:
+        target = 0 if FULL_RESOLUTION else DECODE_SIDE
+    head = fileobj.read(16)
+    fileobj.seek(0)
+    if sniff_format(head) is None:
+        raise UploadRejected("Unsupported image type", 415)
+    try:
+        image = Image.open(fileobj)
+    except Image.DecompressionBombError as exc:
+        raise UploadRejected(str(exc), 413)
+    width, height = image.size
+    if width * height > MAX_PIXELS:
+        raise UploadRejected(f"Image has {width}x{height} pixels, limit is {MAX_PIXELS}", 413)
+    if target and image.format == "JPEG":
+        image.draft("RGB", (target, target))
+    image.load()
+    factor = min(image.size) // target if target else 1
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+class UploadLimitMiddleware:
+    # Pure ASGI middleware, so the limit applies before the multipart body is parsed
+    def __init__(self, app, limits=None):
+        self.app = app
+        self.limits = UPLOAD_LIMITS if limits is None else limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        length = headers.get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            body = json.dumps({"detail": f"Upload exceeds {limit} bytes"}).encode()
+            await send({"type": "http.response.start", "status": 413,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode()), (b"connection", b"close")]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside body parsing; FastAPI passes HTTPExceptions through as responses
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {limit} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,237 @@
+import os
+import sys
+import csv
+import json
+import uuid
+import shutil
+import argparse
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+from app.retrieval import SparseIndex, SCORINGS
+
+# -------------------------------
+# PRECOMPUTED DISEASE KNOWLEDGE BASE
+# -------------------------------
+# The CSV has several rows (symptom variants) per disease. The build step merges
+# every variant into one symptom set per disease, interns the symptom names,
+# fits the vectorizer vocabulary and builds the sparse index, then writes flat
+# .npy arrays plus a small meta.json. Workers memory-map the arrays at startup,
+# so boot time and RSS no longer depend on parsing the CSV.
+#
+# Files are never rewritten in place, since other workers may have them mapped:
+# each build goes into its own sibling directory (<out>-<id>), and <out> is a
+# symlink that is swapped to the new build atomically. Readers resolve the link
+# once, so meta.json and the arrays always come from the same build. The
+# previous build is unlinked afterwards; mappings already open keep its files.
+#
+#   python -m app.knowledge_base --csv disease_sympts_prec_full.csv --out kb
+
+KB_FORMAT_VERSION = 1
+ARRAYS = ("disease_indptr", "disease_symptom_ids", "disease_symptom_counts", "disease_variants")
+
+
+def load_disease_data(csv_path):
+    # disease -> {symptom: number of variants listing it}, disease -> precautions
+    disease_symptom_counts = {}
+    disease_variants = {}
+    disease_precautions = {}
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        for row in reader:
+            disease = (row.get("disease") or "").strip()
+            if not disease:
+                continue
+            symptoms = [s.strip().lower() for s in (row.get("symptoms") or "").split(",") if s.strip()]
+            precautions = [p.strip() for p in (row.get("precautions") or "").split(",") if p.strip()]
+            counts = disease_symptom_counts.setdefault(disease, {})
+            for symptom in set(symptoms):
+                counts[symptom] = counts.get(symptom, 0) + 1
+            disease_variants[disease] = disease_variants.get(disease, 0) + 1
+            if precautions and disease not in disease_precautions:
+                disease_precautions[disease] = precautions
+    for disease in disease_symptom_counts:
+        disease_precautions.setdefault(disease, [])
+    return disease_symptom_counts, disease_variants, disease_precautions
+
+
+def source_signature(csv_path):
+    stat = os.stat(csv_path)
+    return {"path": os.path.basename(csv_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+class KnowledgeBase:
+    def __init__(self, meta, arrays, indexes):
+        self.meta = meta
+        self.diseases = meta["diseases"]
+        self.symptoms = meta["symptoms"]
+        self.precautions = meta["precautions"]
+        self.symptom_ids = {symptom: i for i, symptom in enumerate(self.symptoms)}
+        self.disease_indptr = arrays["disease_indptr"]
+        self.disease_symptom_ids = arrays["disease_symptom_ids"]
+        self.disease_symptom_counts = arrays["disease_symptom_counts"]
+        self.disease_variants = arrays["disease_variants"]
+        self.vectorizer = CountVectorizer(vocabulary=meta["vocabulary"])
+        self.indexes = indexes
+
+    def index(self, scoring="cosine"):
+        return self.indexes[scoring]
+
+    def symptoms_for(self, disease_id):
+        # Symptoms of one disease, most frequent across variants first
+        start, end = self.disease_indptr[disease_id], self.disease_indptr[disease_id + 1]
+        ids = self.disease_symptom_ids[start:end]
+        counts = self.disease_symptom_counts[start:end]
+        order = np.argsort(-counts, kind="stable")
+        return [self.symptoms[ids[i]] for i in order]
+
+    def symptom_frequencies(self, disease_id):
+        # symptom -> fraction of the disease's variants that list it
+        start, end = self.disease_indptr[disease_id], self.disease_indptr[disease_id + 1]
+        variants = float(self.disease_variants[disease_id]) or 1.0
+        return {self.symptoms[s]: float(c) / variants
+                for s, c in zip(self.disease_symptom_ids[start:end], self.disease_symptom_counts[start:end])}
+
+    def disease_symptoms(self):
+        return {disease: self.symptoms_for(i) for i, disease in enumerate(self.diseases)}
+
+    def disease_precautions(self):
+        return dict(zip(self.diseases, self.precautions))
+
+
+def build_knowledge_base(csv_path):
+    symptom_counts, variants, precautions = load_disease_data(csv_path)
+    diseases = list(symptom_counts)
+    symptoms = sorted({symptom for counts in symptom_counts.values() for symptom in counts})
+    symptom_ids = {symptom: i for i, symptom in enumerate(symptoms)}
+
+    indptr, ids, counts = [0], [], []
+    for disease in diseases:
+        for symptom in sorted(symptom_counts[disease], key=symptom_ids.get):
+            ids.append(symptom_ids[symptom])
+            counts.append(symptom_counts[disease][symptom])
+        indptr.append(len(ids))
+
+    vectorizer = CountVectorizer()
+    term_counts = vectorizer.fit_transform([" ".join(symptom_counts[disease]) for disease in diseases])
+    vocabulary = [term for term, _ in sorted(vectorizer.vocabulary_.items(), key=lambda item: item[1])]
+
+    meta = {
+        "format_version": KB_FORMAT_VERSION,
+        "source": source_signature(csv_path),
+        "diseases": diseases,
+        "symptoms": symptoms,
+        "precautions": [precautions[disease] for disease in diseases],
+        "vocabulary": vocabulary,
+    }
+    arrays = {
+        "disease_indptr": np.asarray(indptr, dtype=np.int64),
+        "disease_symptom_ids": np.asarray(ids, dtype=np.int32),
+        "disease_symptom_counts": np.asarray(counts, dtype=np.int32),
+        "disease_variants": np.asarray([variants[disease] for disease in diseases], dtype=np.int32),
+    }
+    indexes = {scoring: SparseIndex.build(term_counts, scoring=scoring) for scoring in SCORINGS}
+    return KnowledgeBase(meta, arrays, indexes)
+
+
+def save_knowledge_base(kb, out_dir):
+    out_dir = os.path.normpath(out_dir)
+    build_dir = f"{out_dir}-{uuid.uuid4().hex[:12]}"
+    os.makedirs(build_dir)
+    try:
+        write_knowledge_base(kb, build_dir)
+        publish_build(build_dir, out_dir)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+
+def publish_build(build_dir, out_dir):
+    # Points out_dir at build_dir in one rename; a directory from older versions is moved aside first
+    previous = None
+    if os.path.islink(out_dir):
+        previous = os.path.join(os.path.dirname(out_dir), os.readlink(out_dir))
+    elif os.path.isdir(out_dir):
+        previous = f"{out_dir}-{uuid.uuid4().hex[:12]}"
+        os.rename(out_dir, previous)
+    link = f"{build_dir}.link"
+    os.symlink(os.path.basename(build_dir), link)
+    os.replace(link, out_dir)
+    if previous and os.path.realpath(previous) != os.path.realpath(build_dir):
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def write_knowledge_base(kb, out_dir):
+    arrays = {
+        "disease_indptr": kb.disease_indptr,
+        "disease_symptom_ids": kb.disease_symptom_ids,
+        "disease_symptom_counts": kb.disease_symptom_counts,
+        "disease_variants": kb.disease_variants,
+    }
+    for scoring, index in kb.indexes.items():
+        arrays[f"index_{scoring}_indptr"] = index.indptr
+        arrays[f"index_{scoring}_doc_ids"] = index.doc_ids
+        arrays[f"index_{scoring}_weights"] = index.weights
+        arrays[f"index_{scoring}_idf"] = index.idf
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, name + ".npy"), np.ascontiguousarray(array))
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(kb.meta, f)
+
+
+def load_knowledge_base(kb_dir):
+    kb_dir = os.path.realpath(kb_dir)
+    with open(os.path.join(kb_dir, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format_version") != KB_FORMAT_VERSION:
+        raise ValueError(f"Unsupported knowledge base format in {kb_dir}")
+
+    def mapped(name):
+        return np.load(os.path.join(kb_dir, name + ".npy"), mmap_mode="r")
+
+    arrays = {name: mapped(name) for name in ARRAYS}
+    indexes = {}
+    for scoring in SCORINGS:
+        indexes[scoring] = SparseIndex(
+            mapped(f"index_{scoring}_indptr"),
+            mapped(f"index_{scoring}_doc_ids"),
+            mapped(f"index_{scoring}_weights"),
+            mapped(f"index_{scoring}_idf"),
+            len(meta["diseases"]),
+            scoring,
+        )
+    return KnowledgeBase(meta, arrays, indexes)
+
+
+def load_or_build_knowledge_base(kb_dir, csv_path):
+    # Use the prebuilt artifact when it matches the CSV; otherwise build in-process
+    # (and try to persist it so the next worker can map it)
+    try:
+        kb = load_knowledge_base(kb_dir)
+        if not os.path.exists(csv_path) or kb.meta["source"] == source_signature(csv_path):
+            return kb
+    except (OSError, ValueError, KeyError):
+        pass
+    kb = build_knowledge_base(csv_path)
+    try:
+        save_knowledge_base(kb, kb_dir)
+    except OSError:
+        pass
+    return kb
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the precomputed disease knowledge base")
+    parser.add_argument("--csv", default="disease_sympts_prec_full.csv")
+    parser.add_argument("--out", default="kb")
+    args = parser.parse_args(argv)
+    kb = build_knowledge_base(args.csv)
+    save_knowledge_base(kb, args.out)
+    print(f"Wrote {len(kb.diseases)} diseases, {len(kb.symptoms)} symptoms, "
+          f"{len(kb.meta['vocabulary'])} terms to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,30 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Response, Request
+from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.background import BackgroundTask
+from typing import List
 from uuid import uuid4
-import io
-from PIL import Image
+import json
+import logging
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-import gradio as gr
-
-# Import modules from the Uspark package
-from app.chatbot import ChatbotSession
-from app.mediseg import complete_pipeline_image
-from app.database import save_chat_session, save_medseg_result
 
-app = FastAPI(title="Uspark API")
+# Import modules from the Uspark package. Only light modules are imported here;
+# the chatbot, the imaging pipeline (torch) and Gradio load lazily as subsystems.
+from app.sessions import create_session_store
+from app.payloads import OUTPUT_FORMATS, CAM_GRID, CAM_FULL_RESOLUTION, multipart_body
+from app.rendering import RENDER_MODE, RENDER_FORMAT, RENDER_QUALITY, PNG_COMPRESSION
+from app.result_cache import ResultCache, image_cache_key
+from starlette.concurrency import run_in_threadpool
+from app.batching import MicroBatcher
+from app.database import save_chat_session, save_medseg_result, get_writer, close_persistence
+from app.startup import Subsystems, SubsystemUnavailable, LazyASGIApp
+from app.workers import create_inference, INFERENCE_WORKERS, PRIORITY_BULK
+from app.metrics import stage, render_metrics, profiler, HTTP_SECONDS
+from app.ingest import decode_image, UploadRejected, UploadLimitMiddleware
+from app.admission import create_admission, deadline_budget, AdmissionRejected
 
 # Ensure models are loaded from the 'models' directory within 'Uspark'
 import sys
@@ -21,59 +35,346 @@ class ChatMessage(BaseModel):
     session_id: str
     message: str
 
-# In-memory session store (for demo purposes; consider persistent storage for production)
-sessions = {}
+# -------------------------------
+# Subsystems
+# -------------------------------
+subsystems = Subsystems()
+
+def init_chat():
+    from app.chatbot import ChatbotSession
+    # Bounded session store; USPARK_SESSION_STORE=sqlite shares sessions across workers
+    return ChatbotSession, create_session_store(ChatbotSession)
+
+def warm_chat(chat_state):
+    from app.chatbot import ner_service
+    ner_service.model
+
+def init_medseg():
+    # The models run in this process, or in USPARK_INFERENCE_WORKERS worker processes
+    return create_inference()
+
+def warm_medseg(inference):
+    inference.warm_up()
+
+def init_gradio():
+    import gradio as gr
+
+    # Gradio Interface
+    def my_model(input_text):
+        return f"Processed: {input_text}"
+
+    gradio_app = gr.Interface(fn=my_model, inputs="text", outputs="text")
+    return gr.mount_gradio_app(FastAPI(), gradio_app, path="")
+
+chat = subsystems.add("chat", init_chat, warm_chat)
+medseg = subsystems.add("medseg", init_medseg, warm_medseg)
+# A misconfigured backend stops the server at startup instead of dropping every record
+persistence = subsystems.add("persistence", get_writer, required=True)
+gradio = subsystems.add("gradio", init_gradio)
+
+def run_medseg_batch(requests):
+    return medseg.get().run_batch(requests)
+
+def run_bulk_batch(requests):
+    # Volume and batch streams wait behind interactive /medseg batches for a worker
+    return medseg.get().run_batch(requests, priority=PRIORITY_BULK)
+
+def decode_upload(fileobj):
+    # Reads the spooled upload directly; decodes at the reduced resolution the models need
+    with stage("medseg", "decode"):
+        return decode_image(fileobj)
+
+# Concurrent /medseg uploads are classified and segmented together in batches,
+# one batch in flight per inference worker
+medseg_batcher = MicroBatcher(run_medseg_batch, concurrency=max(1, INFERENCE_WORKERS))
+
+# Identical uploads (re-sent studies, client retries) are served from the cache
+medseg_cache = ResultCache()
+
+# Per-endpoint concurrency limits, bounded queues and deadlines; chat turns go first
+admission = create_admission()
+
+@asynccontextmanager
+async def lifespan(app):
+    # Optional warm-up (USPARK_WARMUP) runs in the background; /readyz reports when it is done
+    persistence.get()
+    subsystems.start_warm_up()
+    yield
+    await gradio_mount.aclose()
+    if medseg.ready:
+        medseg.value.close()
+    # Write out records still queued behind the request path
+    close_persistence()
+
+app = FastAPI(title="Uspark API", lifespan=lifespan)
+logger = logging.getLogger(__name__)
+
+# Oversized uploads are refused from Content-Length, or cut off while streaming (413)
+app.add_middleware(UploadLimitMiddleware)
+
+@app.exception_handler(SubsystemUnavailable)
+async def subsystem_unavailable(request, exc):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request, exc):
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    started = time.perf_counter()
+    profiler.request_started()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Route templates, not raw paths, keep the label set bounded
+        route = getattr(request.scope.get("route"), "path", None) or "/" + request.url.path.split("/")[1]
+        HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route, status=status)
+        if profiler.enabled:
+            dump = await run_in_threadpool(profiler.request_finished, started, f"{request.method} {route}")
+            if dump:
+                logger.warning("Slow %s %s: profile written to %s", request.method, route, dump)
+
+@app.get("/metrics")
+def metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    ready, report = subsystems.readiness()
+    return JSONResponse(status_code=200 if ready else 503, content=report)
 
 @app.post("/chat/start")
 def start_chat():
+    ChatbotSession, sessions = chat.get()
     session_id = str(uuid4())
     session = ChatbotSession()
-    sessions[session_id] = session
+    sessions.put(session_id, session)
     return {"session_id": session_id, "message": session.conversation_history[0]}
 
 @app.post("/chat/message")
-def chat_message(chat: ChatMessage):
-    if chat.session_id not in sessions:
+async def chat_message(message: ChatMessage, request: Request):
+    with await admission.admit("chat", deadline_budget(request.headers)):
+        return await run_in_threadpool(process_chat_message, message)
+
+def process_chat_message(message):
+    _, sessions = chat.get()
+    session = sessions.get(message.session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Invalid session_id")
     
-    session = sessions[chat.session_id]
-    response = session.process_message(chat.message)
+    with stage("chat", "process_message"):
+        response = session.process_message(message.message)
     
-    # If the session has finished (after pain & medication), save to MongoDB and remove from memory.
+    # If the session has finished (after pain & medication), queue it for persistence and remove it from the store.
     if session.finished:
-        save_chat_session(chat.session_id, session.get_data())
-        del sessions[chat.session_id]
+        with stage("chat", "persist"):
+            save_chat_session(message.session_id, session.get_data())
+        sessions.delete(message.session_id)
+    else:
+        sessions.put(message.session_id, session)
     
     return {"response": response, "conversation": session.conversation_history}
 
 @app.post("/medseg")
-async def medseg_endpoint(file: UploadFile = File(...)):
-    try:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid image file")
-    
-    # Process image through the complete pipeline (classification + segmentation)
-    result = complete_pipeline_image(image)
+async def medseg_endpoint(request: Request, file: UploadFile = File(...), output: str = Query("composite")):
+    # output: composite (base64 image), mask (RLE/raw JSON) or binary (multipart, no base64)
+    if output not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"output must be one of {', '.join(OUTPUT_FORMATS)}")
     
-    # Save result to MongoDB
-    result_record = {
-        "filename": file.filename,
-        "result": result  # Contains predicted modality and base64 image(s)
-    }
-    save_medseg_result(result_record)
+    variant = f"{output}:{RENDER_MODE}:{RENDER_FORMAT}:{RENDER_QUALITY}:{PNG_COMPRESSION}:{CAM_GRID}:{CAM_FULL_RESOLUTION}"
+    cache_key = None
+    result = None
+    # Admitted before decoding, so shed requests cost no decode work and decode counts as service time
+    with await admission.admit("medseg", deadline_budget(request.headers)) as ticket:
+        try:
+            image = await run_in_threadpool(decode_upload, file.file)
+        except UploadRejected as exc:
+            raise HTTPException(status_code=exc.status_code, detail=str(exc))
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid image file")
+        
+        # Bypassed until the model versions are known (pool workers still starting)
+        versions = (await run_in_threadpool(medseg.get)).versions() if medseg_cache.enabled else None
+        if versions:
+            cache_key = await run_in_threadpool(image_cache_key, image, versions, variant)
+            result = await run_in_threadpool(medseg_cache.get, cache_key)
+        
+        if result is None:
+            # Process image through the complete pipeline (classification + segmentation);
+            # past the deadline the request is dropped from the micro-batch
+            result = await ticket.wait(medseg_batcher.submit((image, output)))
+            if cache_key is not None:
+                await run_in_threadpool(medseg_cache.put, cache_key, result)
+            
+            # Queued for the background writer; the database round trip is off the request path
+            result_record = {
+                "filename": file.filename,
+                "result": result  # Contains predicted modality and base64 image(s)
+            }
+            with stage("medseg", "persist"):
+                save_medseg_result(result_record)
     
+    if output == "binary":
+        metadata = {key: value for key, value in result.items() if key != "mask_bytes"}
+        body, content_type = multipart_body(metadata, result.get("mask_bytes") or b"")
+        return Response(content=body, media_type=content_type)
     return result
 
-# Gradio Interface
-def my_model(input_text):
-    return f"Processed: {input_text}"
+@app.post("/medseg/volume")
+async def medseg_volume_endpoint(request: Request, files: List[UploadFile] = File(...),
+                                 output: str = Query("mask")):
+    # Accepts one .nii/.nii.gz volume, or a DICOM series as several files or a zip.
+    # Per-slice results are streamed back as NDJSON while later slices are still processed.
+    if output not in ("composite", "mask"):
+        raise HTTPException(status_code=400, detail="output must be composite or mask for volumes")
+    await run_in_threadpool(medseg.get)
+    from app.volumes import (is_nifti, spool_to_disk, count_nifti_slices, iter_nifti_slices,
+                             open_dicom_sources, order_dicom_series, iter_dicom_slices,
+                             iter_batches, next_batch_results)
+    # The bulk slot is held until the stream ends (released again by the background task
+    # if the client goes away before streaming starts)
+    ticket = await admission.admit("bulk", deadline_budget(request.headers))
+
+    temp_path = None
+    try:
+        if len(files) == 1 and is_nifti(files[0].filename):
+            suffix = ".nii.gz" if files[0].filename.lower().endswith(".gz") else ".nii"
+            temp_path = await run_in_threadpool(spool_to_disk, files[0].file, suffix)
+            total = await run_in_threadpool(count_nifti_slices, temp_path)
+            slices = iter_nifti_slices(temp_path)
+        else:
+            sources = await run_in_threadpool(
+                lambda: order_dicom_series(open_dicom_sources([(f.filename, f.file) for f in files])))
+            if not sources:
+                raise ValueError("No DICOM slices found")
+            total = len(sources)
+            slices = iter_dicom_slices(sources)
+    except UploadRejected as exc:
+        ticket.release()
+        raise HTTPException(status_code=exc.status_code, detail=str(exc))
+    except Exception:
+        ticket.release()
+        if temp_path:
+            os.remove(temp_path)
+        raise HTTPException(status_code=400, detail="Invalid NIfTI volume or DICOM series")
+
+    async def stream():
+        modalities = {}
+        try:
+            yield json.dumps({"type": "volume", "slices": total}) + "\n"
+            batches = iter_batches(slices)
+            while True:
+                results = await run_in_threadpool(next_batch_results, batches, output, run_bulk_batch)
+                if results is None:
+                    break
+                for result in results:
+                    modality = result["predicted_modality"]
+                    modalities[modality] = modalities.get(modality, 0) + 1
+                    yield json.dumps({"type": "slice", **result}) + "\n"
+            save_medseg_result({
+                "filename": ",".join(f.filename or "" for f in files),
+                "result": {"volume": True, "slices": sum(modalities.values()), "modalities": modalities}
+            })
+            yield json.dumps({"type": "done", "modalities": modalities}) + "\n"
+        finally:
+            ticket.release()
+            if temp_path:
+                os.remove(temp_path)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson", background=BackgroundTask(ticket.release))
+
+@app.post("/medseg/batch")
+async def medseg_batch_endpoint(request: Request, files: List[UploadFile] = File(...),
+                                output: str = Query("mask")):
+    # Accepts many images and/or zip archives of images. Images are decoded in parallel
+    # and classified/segmented in batches; per-image results are streamed back as NDJSON
+    # and a single summary record is persisted for the whole upload.
+    if output not in ("composite", "mask"):
+        raise HTTPException(status_code=400, detail="output must be composite or mask for batches")
+    await run_in_threadpool(medseg.get)
+    from app.bulk import upload_sources, iter_decoded_batches, next_bulk_results
+
+    try:
+        sources = await run_in_threadpool(upload_sources, [(f.filename, f.file) for f in files])
+    except UploadRejected as exc:
+        raise HTTPException(status_code=exc.status_code, detail=str(exc))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid zip archive")
+    if not sources:
+        raise HTTPException(status_code=400, detail="No images found")
+    ticket = await admission.admit("bulk", deadline_budget(request.headers))
+
+    async def stream():
+        modalities, errors = {}, 0
+        try:
+            yield json.dumps({"type": "batch", "images": len(sources)}) + "\n"
+            batches = iter_decoded_batches(iter(sources))
+            while True:
+                results = await run_in_threadpool(next_bulk_results, batches, output, run_bulk_batch)
+                if results is None:
+                    break
+                for source_id, result, error in results:
+                    if error is not None:
+                        errors += 1
+                        yield json.dumps({"type": "image", "id": source_id, "error": error}) + "\n"
+                        continue
+                    modality = result["predicted_modality"]
+                    modalities[modality] = modalities.get(modality, 0) + 1
+                    yield json.dumps({"type": "image", "id": source_id, **result}) + "\n"
+            save_medseg_result({
+                "filename": ",".join(f.filename or "" for f in files),
+                "result": {"batch": True, "images": sum(modalities.values()), "errors": errors,
+                           "modalities": modalities}
+            })
+            yield json.dumps({"type": "done", "modalities": modalities, "errors": errors}) + "\n"
+        finally:
+            ticket.release()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson", background=BackgroundTask(ticket.release))
+
+@app.get("/chat/sessions")
+def chat_sessions():
+    _, sessions = chat.get()
+    return sessions.stats()
+
+@app.get("/medseg/models")
+def medseg_models():
+    return medseg.get().models()
+
+@app.get("/medseg/workers")
+def medseg_workers():
+    return medseg.get().stats()
+
+@app.get("/medseg/cache")
+def medseg_cache_stats():
+    return medseg_cache.stats()
+
+@app.get("/medseg/batching")
+def medseg_batching():
+    return medseg_batcher.stats()
+
+@app.get("/admission")
+def admission_stats():
+    return admission.stats()
+
+@app.get("/persistence")
+def persistence_stats():
+    return persistence.get().stats()
 
-gradio_app = gr.Interface(fn=my_model, inputs="text", outputs="text")
+# Mount Gradio app inside FastAPI; it is built on the first /gradio request
+gradio_mount = LazyASGIApp(gradio)
+app.mount("/gradio", gradio_mount)
 
-# Mount Gradio app inside FastAPI
-app = gr.mount_gradio_app(app, gradio_app, path="/gradio")
+subsystems.import_seconds = time.perf_counter() - _import_started
 
 if __name__ == "__main__":
     import uvicorn
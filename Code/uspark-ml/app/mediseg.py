@@ -1,21 +1,26 @@
 import os
 import torch
 import numpy as np
-import nibabel as nib
-import pydicom
 import cv2
 from PIL import Image
-import matplotlib.pyplot as plt
 import torch.nn as nn
-import torch.nn.functional as F
 import torchvision.models as models
 from torchvision import transforms
-from monai.transforms import EnsureChannelFirst, ScaleIntensity, Resize, ToTensor
 from io import BytesIO
 import base64
 
+from app.model_registry import ModelRegistry
+from app.backends import configure_threads
+from app.explain import get_cam_engine, CAM_MODE
+from app.rendering import render_panels_base64, output_format
+from app.payloads import label_mask_payload, binary_mask_payload, cam_payload, payload_to_json, payload_to_bytes
+from app.metrics import stage, IMAGES_TOTAL
+from app.preprocess import ImagePyramid, as_pyramid, batch_tensor
+from app.tiling import should_tile, tiled_segmentation, display_mask
+
 # Set device
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+configure_threads()
 
 # -------------------------------
 # CLASSIFIER MODULE (Medical Classifier)
@@ -27,27 +32,30 @@ class_names = ['AbdomenCT', 'BreastMRI', 'Chest Xray', 'ChestCT',
 model_path_classifier = os.path.join("models", "best_metric_model (4).pth")
 
 from monai.networks.nets import DenseNet121
-classifier_model = DenseNet121(
-    spatial_dims=2,
-    in_channels=3,
-    out_channels=len(class_names)
-).to(device)
 
-state_dict = torch.load(model_path_classifier, map_location=device)
-classifier_model.load_state_dict(state_dict, strict=False)
-classifier_model.eval()
+def build_classifier():
+    return DenseNet121(
+        spatial_dims=2,
+        in_channels=3,
+        out_channels=len(class_names)
+    )
 
-# A simple transform for classification from a PIL image
-def classify_medical_image_pil(image: Image.Image) -> str:
-    transform = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Resize((224, 224))
-    ])
-    image_tensor = transform(image).unsqueeze(0).to(device)
-    with torch.no_grad():
+registry = ModelRegistry(device)
+registry.register("classifier", build_classifier, model_path_classifier, strict=False,
+                  input_shape=(3, 224, 224))
+
+# Images (PIL or ImagePyramid, see app/preprocess.py) are resized to 224x224 without
+# antialiasing, matching the tensor transforms.Resize the classifier has always been fed
+def classify_medical_images_pil(images: list) -> list:
+    image_tensor = batch_tensor(images, 224, antialias=False).to(device)
+    classifier_model = registry.get("classifier")
+    with stage("medseg", "classify", model="classifier"), torch.no_grad():
         output = classifier_model(image_tensor)
-        pred_class = torch.argmax(output, dim=1).item()
-    return class_names[pred_class]
+        pred_classes = torch.argmax(output, dim=1).tolist()
+    return [class_names[pred_class] for pred_class in pred_classes]
+
+def classify_medical_image_pil(image: Image.Image) -> str:
+    return classify_medical_images_pil([image])[0]
 
 # -------------------------------
 # SPECIALIZED MODULES
@@ -115,44 +123,42 @@ class UNetMulti(nn.Module):
         output = self.final_conv(c8)
         return output
 
-def process_brain_tumor(image: Image.Image, model_path=os.path.join("models", "brain_tumor_unet_multiclass.pth")) -> str:
-    model = UNetMulti(in_channels=3, out_channels=4).to(device)
-    model.load_state_dict(torch.load(model_path, map_location=device))
-    model.eval()
-    
-    transform_img = transforms.Compose([
-        transforms.Resize((256,256)),
-        transforms.ToTensor()
-    ])
-    input_tensor = transform_img(image).unsqueeze(0).to(device)
-    with torch.no_grad():
-        output = model(input_tensor)
-        preds = torch.argmax(output, dim=1).squeeze().cpu().numpy()
-    
-    image_np = np.array(image.resize((256,256)))
+registry.register("brain_tumor", lambda: UNetMulti(in_channels=3, out_channels=4),
+                  os.path.join("models", "brain_tumor_unet_multiclass.pth"), input_shape=(3, 256, 256))
+
+# Images are resized to 256x256, or segmented in full-resolution tiles (app/tiling.py)
+def segment_brain_tumor(images: list, model_path=os.path.join("models", "brain_tumor_unet_multiclass.pth")) -> list:
+    model = registry.get("brain_tumor", model_path)
+    preds = [None] * len(images)
+    resized = [i for i, image in enumerate(images) if not should_tile(image)]
+    if resized:
+        input_tensor = batch_tensor([images[i] for i in resized], 256).to(device)
+        with torch.no_grad():
+            output = model(input_tensor)
+            for i, pred in zip(resized, torch.argmax(output, dim=1).cpu().numpy()):
+                preds[i] = pred
+    for i, image in enumerate(images):
+        if preds[i] is None:
+            preds[i] = tiled_segmentation(as_pyramid(image).image,
+                                          lambda x: torch.softmax(model(x.to(device)), dim=1), channels=4)
+    return preds
+
+def render_brain_tumor(image: Image.Image, preds: np.ndarray, mode=None) -> str:
+    preds = display_mask(preds)
+    image_np = as_pyramid(image).array(preds.shape)
     # Create overlay and blended image
     overlay = cv2.applyColorMap(np.uint8(255 * preds/np.max(preds + 1e-8)), cv2.COLORMAP_JET)
     overlay = cv2.cvtColor(overlay, cv2.COLOR_BGR2RGB)
     blended = cv2.addWeighted(np.uint8(image_np), 0.6, overlay, 0.4, 0)
     
-    # Create a figure with subplots
-    fig, ax = plt.subplots(1, 3, figsize=(18,6))
-    ax[0].imshow(image_np)
-    ax[0].set_title("Original Image")
-    ax[0].axis("off")
-    ax[1].imshow(preds, cmap='jet')
-    ax[1].set_title("Segmentation Mask")
-    ax[1].axis("off")
-    ax[2].imshow(blended)
-    ax[2].set_title("Overlay")
-    ax[2].axis("off")
-    
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode("utf-8")
-    plt.close(fig)
-    return img_base64
+    return render_panels_base64(
+        [(image_np, None), (preds, "jet"), (blended, None)],
+        ["Original Image", "Segmentation Mask", "Overlay"],
+        mode
+    )
+
+def process_brain_tumor(image: Image.Image, model_path=os.path.join("models", "brain_tumor_unet_multiclass.pth")) -> str:
+    return render_brain_tumor(image, segment_brain_tumor([image], model_path)[0])
 
 # --- B. Endoscopy Polyp Detection Module (Binary UNet) ---
 class UNetBinary(nn.Module):
@@ -202,124 +208,87 @@ class UNetBinary(nn.Module):
         output = self.final_conv(c8)
         return output
 
-def process_endoscopy(image: Image.Image, model_path=os.path.join("models", "endoscopy_unet.pth")) -> str:
-    model = UNetBinary(in_channels=3, out_channels=1).to(device)
-    model.load_state_dict(torch.load(model_path, map_location=device))
-    model.eval()
-    
-    transform_img = transforms.Compose([
-        transforms.Resize((256,256)),
-        transforms.ToTensor()
-    ])
-    input_tensor = transform_img(image).unsqueeze(0).to(device)
-    with torch.no_grad():
-        output = model(input_tensor)
-        prob = torch.sigmoid(output)
-        mask = (prob > 0.5).float().squeeze().cpu().numpy()
-    
-    image_np = np.array(image.resize((256,256)))
+registry.register("endoscopy", lambda: UNetBinary(in_channels=3, out_channels=1),
+                  os.path.join("models", "endoscopy_unet.pth"), input_shape=(3, 256, 256))
+
+def segment_endoscopy(images: list, model_path=os.path.join("models", "endoscopy_unet.pth")) -> list:
+    model = registry.get("endoscopy", model_path)
+    masks = [None] * len(images)
+    resized = [i for i, image in enumerate(images) if not should_tile(image)]
+    if resized:
+        input_tensor = batch_tensor([images[i] for i in resized], 256).to(device)
+        with torch.no_grad():
+            output = model(input_tensor)
+            prob = torch.sigmoid(output)
+            for i, mask in zip(resized, (prob > 0.5).float().squeeze(1).cpu().numpy()):
+                masks[i] = mask
+    for i, image in enumerate(images):
+        if masks[i] is None:
+            masks[i] = tiled_segmentation(as_pyramid(image).image,
+                                          lambda x: torch.sigmoid(model(x.to(device))), channels=1)
+    return masks
+
+def render_endoscopy(image: Image.Image, mask: np.ndarray, mode=None) -> str:
+    mask = display_mask(mask)
+    image_np = as_pyramid(image).array(mask.shape)
     overlay = cv2.applyColorMap(np.uint8(255*mask), cv2.COLORMAP_JET)
     overlay = cv2.cvtColor(overlay, cv2.COLOR_BGR2RGB)
     blended = cv2.addWeighted(np.uint8(image_np), 0.6, overlay, 0.4, 0)
     
-    fig, ax = plt.subplots(1, 3, figsize=(18,6))
-    ax[0].imshow(image_np)
-    ax[0].set_title("Actual Image")
-    ax[0].axis("off")
-    ax[1].imshow(mask, cmap='gray')
-    ax[1].set_title("Segmentation Mask")
-    ax[1].axis("off")
-    ax[2].imshow(blended)
-    ax[2].set_title("Overlay")
-    ax[2].axis("off")
-    
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode("utf-8")
-    plt.close(fig)
-    return img_base64
-
-# --- C. Pneumonia Detection Module (Using Grad-CAM on ResNet18) ---
-class GradCAM_Pneumonia:
-    def __init__(self, model, target_layer):
-        self.model = model
-        self.target_layer = target_layer
-        self.gradients = None
-        self.activations = None
-        self.hook_handles = []
-        self._register_hooks()
-    
-    def _register_hooks(self):
-        def forward_hook(module, input, output):
-            self.activations = output.detach()
-        def backward_hook(module, grad_in, grad_out):
-            self.gradients = grad_out[0].detach()
-        handle1 = self.target_layer.register_forward_hook(forward_hook)
-        handle2 = self.target_layer.register_backward_hook(backward_hook)
-        self.hook_handles.extend([handle1, handle2])
-    
-    def remove_hooks(self):
-        for handle in self.hook_handles:
-            handle.remove()
-    
-    def generate(self, input_image, target_class=None):
-        output = self.model(input_image)
-        if target_class is None:
-            target_class = output.argmax(dim=1).item()
-        self.model.zero_grad()
-        one_hot = torch.zeros_like(output)
-        one_hot[0, target_class] = 1
-        output.backward(gradient=one_hot, retain_graph=True)
-        weights = self.gradients.mean(dim=(2,3), keepdim=True)
-        cam = (weights * self.activations).sum(dim=1, keepdim=True)
-        cam = F.relu(cam)
-        cam = cam.squeeze().cpu().numpy()
-        _, _, H, W = input_image.shape
-        cam = cv2.resize(cam, (W, H))
-        cam = (cam - np.min(cam)) / (np.max(cam) - np.min(cam) + 1e-8)
-        return cam, output
+    return render_panels_base64(
+        [(image_np, None), (mask, "gray"), (blended, None)],
+        ["Actual Image", "Segmentation Mask", "Overlay"],
+        mode
+    )
 
-def process_pneumonia(image: Image.Image, model_path=os.path.join("models", "pneumonia_resnet18.pth")) -> str:
+def process_endoscopy(image: Image.Image, model_path=os.path.join("models", "endoscopy_unet.pth")) -> str:
+    return render_endoscopy(image, segment_endoscopy([image], model_path)[0])
+
+# --- C. Pneumonia Detection Module (Using Grad-CAM on ResNet18, see app/explain.py) ---
+def build_pneumonia_resnet():
     model = models.resnet18(pretrained=False)
     num_ftrs = model.fc.in_features
     model.fc = nn.Linear(num_ftrs, 2)  # 2 classes: normal and pneumonia
-    model.load_state_dict(torch.load(model_path, map_location=device))
-    model.to(device)
-    model.eval()
-    
-    grad_cam = GradCAM_Pneumonia(model, model.layer4)
-    
-    transform_img = transforms.Compose([
-        transforms.Resize((224,224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485,0.456,0.406],
-                             std=[0.229,0.224,0.225])
-    ])
-    input_tensor = transform_img(image).unsqueeze(0).to(device)
-    with torch.no_grad():
-        cam, output = grad_cam.generate(input_tensor)
-        predicted_class = output.argmax(dim=1).item()
+    return model
+
+# The CAM engine hooks layer4 of the eager module, so pneumonia stays eager
+registry.register("pneumonia", build_pneumonia_resnet,
+                  os.path.join("models", "pneumonia_resnet18.pth"), input_shape=(3, 224, 224), optimizable=False)
+
+pneumonia_normalize = transforms.Normalize(mean=[0.485,0.456,0.406],
+                                           std=[0.229,0.224,0.225])
+
+def detect_pneumonia(images: list, model_path=os.path.join("models", "pneumonia_resnet18.pth")) -> list:
+    model = registry.get("pneumonia", model_path)
+    input_tensor = pneumonia_normalize(batch_tensor(images, 224)).to(device)
+    with stage("medseg", "gradcam", model="pneumonia"):
+        cams, output = get_cam_engine(model).generate(input_tensor)
+    predicted_classes = output.argmax(dim=1).tolist()
+    return list(zip(cams, predicted_classes))
+
+def get_bounding_box(heatmap, thresh=0.5, min_area=100):
+    heat_uint8 = np.uint8(255 * heatmap)
+    ret, binary = cv2.threshold(heat_uint8, int(thresh*255), 255, cv2.THRESH_BINARY)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if len(contours)==0:
+        return None
+    largest = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(largest) < min_area:
+        return None
+    x, y, w, h = cv2.boundingRect(largest)
+    return (x, y, w, h)
+
+def pneumonia_findings(cam: np.ndarray, predicted_class: int):
     label_text = "Pneumonia" if predicted_class == 1 else "Normal"
-    
-    def get_bounding_box(heatmap, thresh=0.5, min_area=100):
-        heat_uint8 = np.uint8(255 * heatmap)
-        ret, binary = cv2.threshold(heat_uint8, int(thresh*255), 255, cv2.THRESH_BINARY)
-        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if len(contours)==0:
-            return None
-        largest = max(contours, key=cv2.contourArea)
-        if cv2.contourArea(largest) < min_area:
-            return None
-        x, y, w, h = cv2.boundingRect(largest)
-        return (x, y, w, h)
-    
     bbox = None
     if predicted_class == 1:
         bbox = get_bounding_box(cam, thresh=0.5, min_area=100)
+    return label_text, bbox
+
+def render_pneumonia(image: Image.Image, cam: np.ndarray, predicted_class: int, mode=None) -> str:
+    label_text, bbox = pneumonia_findings(cam, predicted_class)
     
-    resized_image = image.resize((224,224))
-    image_np = np.array(resized_image)
+    image_np = as_pyramid(image).array(224)
     overlay = image_np.copy()
     if bbox is not None:
         x, y, w, h = bbox
@@ -329,44 +298,114 @@ def process_pneumonia(image: Image.Image, model_path=os.path.join("models", "pne
     heatmap_color = cv2.applyColorMap(np.uint8(255*cam), cv2.COLORMAP_JET)
     heatmap_color = cv2.cvtColor(heatmap_color, cv2.COLOR_BGR2RGB)
     
-    fig, ax = plt.subplots(1, 3, figsize=(18,6))
-    ax[0].imshow(image_np)
-    ax[0].set_title("Actual Image")
-    ax[0].axis("off")
-    ax[1].imshow(heatmap_color)
-    ax[1].set_title("Detected Output (Heatmap)")
-    ax[1].axis("off")
-    ax[2].imshow(overlay)
-    ax[2].set_title("Boxed Overlay")
-    ax[2].axis("off")
-    
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode("utf-8")
-    plt.close(fig)
-    grad_cam.remove_hooks()
-    return img_base64
+    return render_panels_base64(
+        [(image_np, None), (heatmap_color, None), (overlay, None)],
+        ["Actual Image", "Detected Output (Heatmap)", "Boxed Overlay"],
+        mode
+    )
+
+def pneumonia_mask(cam: np.ndarray, predicted_class: int) -> dict:
+    label_text, bbox = pneumonia_findings(cam, predicted_class)
+    return cam_payload(cam, label_text, bbox)
+
+def process_pneumonia(image: Image.Image, model_path=os.path.join("models", "pneumonia_resnet18.pth")) -> str:
+    cam, predicted_class = detect_pneumonia([image], model_path)[0]
+    return render_pneumonia(image, cam, predicted_class)
 
 # -------------------------------
 # COMPLETE PIPELINE FUNCTION
 # -------------------------------
-def complete_pipeline_image(image: Image.Image) -> dict:
-    predicted_modality = classify_medical_image_pil(image)
-    result = {"predicted_modality": predicted_modality}
-    
-    if predicted_modality in ["HeadCT", "HeadMRI"]:
-        result_overlay = process_brain_tumor(image)
-        result["segmentation_result"] = result_overlay
-    elif predicted_modality == "Endoscopy":
-        result_overlay = process_endoscopy(image)
-        result["segmentation_result"] = result_overlay
-    elif predicted_modality == "Chest Xray":
-        result_overlay = process_pneumonia(image)
-        result["segmentation_result"] = result_overlay
+def encode_original(image: Image.Image) -> str:
+    buf = BytesIO()
+    as_pyramid(image).image.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+# Each specialist is a (batched inference, per-image render, raw mask) triple;
+# images are routed by predicted modality so every specialist runs once per batch.
+SPECIALISTS = {
+    "brain_tumor": (segment_brain_tumor, render_brain_tumor, label_mask_payload),
+    "endoscopy": (segment_endoscopy, render_endoscopy, binary_mask_payload),
+    "pneumonia": (detect_pneumonia, render_pneumonia, pneumonia_mask),
+}
+
+MODALITY_SPECIALIST = {
+    "HeadCT": "brain_tumor",
+    "HeadMRI": "brain_tumor",
+    "Endoscopy": "endoscopy",
+    "Chest Xray": "pneumonia",
+}
+
+def infer_pipeline_images(images: list) -> list:
+    # Classification plus specialist inference, without any rendering
+    modalities = classify_medical_images_pil(images)
+    for modality in modalities:
+        IMAGES_TOTAL.inc(modality=modality)
+    raw = [{"predicted_modality": modality, "specialist": MODALITY_SPECIALIST.get(modality), "output": None}
+           for modality in modalities]
+
+    routed = {}
+    for i, entry in enumerate(raw):
+        if entry["specialist"] is not None:
+            routed.setdefault(entry["specialist"], []).append(i)
+
+    for specialist, indices in routed.items():
+        infer = SPECIALISTS[specialist][0]
+        with stage("medseg", "specialist", model=specialist):
+            outputs = infer([images[i] for i in indices])
+        for i, output in zip(indices, outputs):
+            raw[i]["output"] = output if isinstance(output, tuple) else (output,)
+    return raw
+
+def format_pipeline_result(image: Image.Image, raw: dict, output="composite", render_mode=None) -> dict:
+    # Rendering/base64 for composites, mask encoding otherwise
+    with stage("medseg", "render" if output == "composite" else "encode",
+               model=raw["specialist"] or "", modality=raw["predicted_modality"]):
+        return _format_pipeline_result(image, raw, output, render_mode)
+
+def _format_pipeline_result(image: Image.Image, raw: dict, output="composite", render_mode=None) -> dict:
+    result = {"predicted_modality": raw["predicted_modality"]}
+    specialist = raw["specialist"]
+    if output == "composite":
+        if specialist is None:
+            # For modalities without specialized processing, return the original image as base64
+            result["segmentation_result"] = encode_original(image)
+            result["segmentation_format"] = "png"
+        else:
+            render = SPECIALISTS[specialist][1]
+            result["segmentation_result"] = render(image, *raw["output"], mode=render_mode)
+            result["segmentation_format"] = output_format(render_mode)
+        return result
+
+    # Raw mask outputs never echo the upload back for unsupported modalities
+    if specialist is None:
+        result["mask"] = None
+        return result
+    payload = SPECIALISTS[specialist][2](*raw["output"])
+    if output == "mask":
+        result["mask"] = payload_to_json(payload)
+    elif output == "binary":
+        result["mask"], result["mask_bytes"] = payload_to_bytes(payload)
     else:
-        # For modalities without specialized processing, return the original image as base64
-        buf = BytesIO()
-        image.save(buf, format="PNG")
-        result["segmentation_result"] = base64.b64encode(buf.getvalue()).decode("utf-8")
+        raise ValueError(f"Unsupported output format: {output}")
     return result
+
+def pipeline_versions() -> dict:
+    # Everything besides the pixels and output options that determines a result
+    return {**registry.versions(), "cam_mode": CAM_MODE}
+
+def complete_pipeline_requests(requests: list) -> list:
+    # requests: list of (image, output format) pairs, as queued by the batcher.
+    # Each image is decoded into one pyramid shared by classifier, specialist and renderer.
+    with stage("medseg", "preprocess"):
+        images = [ImagePyramid(image) for image, _ in requests]
+    raw = infer_pipeline_images(images)
+    return [format_pipeline_result(image, entry, output) for image, (_, output), entry in zip(images, requests, raw)]
+
+def complete_pipeline_images(images: list, output="composite", render_mode=None) -> list:
+    with stage("medseg", "preprocess"):
+        images = [as_pyramid(image) for image in images]
+    raw = infer_pipeline_images(images)
+    return [format_pipeline_result(image, entry, output, render_mode) for image, entry in zip(images, raw)]
+
+def complete_pipeline_image(image: Image.Image, output="composite", render_mode=None) -> dict:
+    return complete_pipeline_images([image], output, render_mode)[0]
@@ -0,0 +1,337 @@
+import os
+import sys
+import glob
+import time
+import bisect
+import datetime
+import threading
+import contextlib
+from collections import deque, Counter as _Tally
+
+# -------------------------------
+# METRICS AND SLOW-REQUEST PROFILING
+# -------------------------------
+# Counters, gauges and histograms rendered in the Prometheus text format on /metrics,
+# with no client library. Pipeline stages are timed with stage(), which feeds
+# uspark_stage_seconds{pipeline, stage, model, modality}; stages nest (e.g.
+# gradcam inside the pneumonia specialist). Inference worker processes capture
+# their observations per batch and the API process replays them, so /metrics
+# covers the pool too.
+#
+# With USPARK_PROFILE_SLOW_MS > 0 a sampling profiler records the stacks of all
+# threads while requests are in flight (every USPARK_PROFILE_INTERVAL_MS), and
+# a request slower than the threshold dumps the samples taken during it to
+# USPARK_PROFILE_DIR as collapsed stacks (flamegraph.pl / speedscope input).
+
+PROFILE_SLOW_MS = float(os.environ.get("USPARK_PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("USPARK_PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.environ.get("USPARK_PROFILE_DIR", "profiles")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = {}
+_capture = threading.local()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _muted():
+    return getattr(_capture, "muted", False)
+
+
+def _record(name, labels, value):
+    observations = getattr(_capture, "observations", None)
+    if observations is not None:
+        observations.append((name, labels, value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def inc(self, amount=1.0, **labels):
+        if _muted():
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        _record(self.name, labels, amount)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def set(self, value, **labels):
+        if _muted():
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def observe(self, value, **labels):
+        if _muted():
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+        _record(self.name, labels, value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in list(REGISTRY.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------------
+# Application metrics
+# -------------------------------
+STAGE_SECONDS = Histogram("uspark_stage_seconds", "Time spent in one pipeline stage",
+                          ("pipeline", "stage", "model", "modality"))
+IMAGES_TOTAL = Counter("uspark_medseg_images_total", "Images processed, by predicted modality", ("modality",))
+HTTP_SECONDS = Histogram("uspark_http_request_seconds", "HTTP request latency until the response starts",
+                         ("method", "route", "status"))
+PERSISTENCE_RECORDS = Counter("uspark_persistence_records_total", "Records handled by the background writer",
+                              ("collection", "outcome"))
+PERSISTENCE_FLUSH_SECONDS = Histogram("uspark_persistence_flush_seconds", "Duration of one insert_many batch",
+                                      ("collection",))
+ADMISSION_WAIT_SECONDS = Histogram("uspark_admission_wait_seconds", "Time admitted requests spent queued",
+                                   ("lane",))
+ADMISSION_REQUESTS = Counter("uspark_admission_requests_total", "Admission decisions", ("lane", "outcome"))
+ADMISSION_QUEUED = Gauge("uspark_admission_queued", "Requests waiting for admission", ("lane",))
+ADMISSION_RUNNING = Gauge("uspark_admission_running", "Admitted requests in progress", ("lane",))
+
+
+@contextlib.contextmanager
+def stage(pipeline, name, model="", modality=""):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, pipeline=pipeline, stage=name,
+                              model=model, modality=modality)
+
+
+@contextlib.contextmanager
+def capture():
+    # Collects every observation made on this thread (used inside worker processes)
+    previous = getattr(_capture, "observations", None)
+    _capture.observations = observations = []
+    try:
+        yield observations
+    finally:
+        _capture.observations = previous
+
+
+@contextlib.contextmanager
+def muted():
+    # Nothing recorded on this thread counts (warm-up runs on synthetic images)
+    previous = _muted()
+    _capture.muted = True
+    try:
+        yield
+    finally:
+        _capture.muted = previous
+
+
+def replay(observations):
+    for name, labels, value in observations:
+        metric = REGISTRY.get(name)
+        if isinstance(metric, Counter):
+            metric.inc(value, **labels)
+        elif isinstance(metric, Histogram):
+            metric.observe(value, **labels)
+
+
+# -------------------------------
+# Sampling profiler for slow requests
+# -------------------------------
+# Leaf frames of threads that are parked, not working
+IDLE_LEAVES = {("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+               ("selectors.py", "select"), ("base_events.py", "_run_once"), ("thread.py", "_worker")}
+
+
+def collapse_stack(frame):
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold_ms=PROFILE_SLOW_MS, interval_ms=PROFILE_INTERVAL_MS, out_dir=PROFILE_DIR,
+                 max_samples=100000):
+        self.enabled = threshold_ms > 0
+        self.threshold = threshold_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.out_dir = out_dir
+        self._samples = deque(maxlen=max_samples)
+        self._active = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.dumps = 0
+
+    def request_started(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._active += 1
+            self._wake.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+
+    def request_finished(self, started, label):
+        # started: time.perf_counter() at request start; returns the dump path, if any
+        if not self.enabled:
+            return None
+        finished = time.perf_counter()
+        with self._lock:
+            self._active -= 1
+            if self._active == 0:
+                self._wake.clear()
+        if finished - started < self.threshold:
+            return None
+        return self.dump(started, finished, label)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            self._wake.wait()
+            now = time.perf_counter()
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                if leaf not in IDLE_LEAVES:
+                    stacks.append(collapse_stack(frame))
+            self._samples.append((now, stacks))
+            time.sleep(self.interval)
+
+    def dump(self, started, finished, label):
+        tally = _Tally()
+        for timestamp, stacks in list(self._samples):
+            if started <= timestamp <= finished:
+                tally.update(stacks)
+        if not tally:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = "".join(c if c.isalnum() else "_" for c in label).strip("_") or "request"
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(self.out_dir, f"{stamp}-{name}-{int((finished - started) * 1000)}ms.folded")
+        with open(path, "w") as f:
+            for stack, count in tally.most_common():
+                f.write(f"{stack} {count}\n")
+        self.dumps += 1
+        return path
+
+
+profiler = SlowRequestProfiler()
+
+
+# -------------------------------
+# Per-process memory (RSS / PSS / USS)
+# -------------------------------
+def memory_report(pid="self"):
+    # RSS, PSS (shared pages split across their users) and USS (pages only this process holds), in MB
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[0].endswith(":"):
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024.0
+    except OSError:
+        return {}
+    return {
+        "rss_mb": fields.get("Rss", 0.0),
+        "pss_mb": fields.get("Pss", 0.0),
+        "uss_mb": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0),
+        "shared_mb": fields.get("Shared_Clean", 0.0) + fields.get("Shared_Dirty", 0.0),
+        "swap_mb": fields.get("Swap", 0.0),
+    }
+
+
+def matching_pids(pattern):
+    pids = []
+    for entry in glob.glob("/proc/[0-9]*/cmdline"):
+        pid = int(entry.split("/")[2])
+        try:
+            with open(entry, "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode("utf-8", "replace")
+        except OSError:
+            continue
+        if pattern in cmdline and pid != os.getpid():
+            pids.append(pid)
+    return sorted(pids)
@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+import logging
+import torch
+
+from app.backends import backend_for, supports_backend, optimize_model, parity_check, calibration_inputs, PARITY_CHECK
+from app.weights import WEIGHTS_FORMAT, ensure_flat, load_flat, assign_weights
+
+# -------------------------------
+# MODEL REGISTRY
+# -------------------------------
+# Each network is built and its checkpoint deserialized once per process, then
+# shared by every request. Loading is lazy (first use) by default; set
+# USPARK_MODEL_LOADING=eager to load everything from the startup hook instead.
+# When hot reloading is on, the checkpoint mtime is re-checked at most every
+# USPARK_MODEL_RELOAD_INTERVAL seconds and the model is rebuilt if it changed.
+# On CPU, weights are mapped from flat files shared by all processes (see
+# app/weights.py) unless USPARK_WEIGHTS_FORMAT=pth.
+
+LOADING_MODE = os.environ.get("USPARK_MODEL_LOADING", "lazy").lower()
+HOT_RELOAD = os.environ.get("USPARK_MODEL_HOT_RELOAD", "1") not in ("0", "false", "no")
+RELOAD_INTERVAL = float(os.environ.get("USPARK_MODEL_RELOAD_INTERVAL", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class ModelEntry:
+    def __init__(self, name, builder, path, strict=True, input_shape=None, optimizable=True, base_name=None):
+        self.name = name
+        self.base_name = base_name or name
+        self.builder = builder
+        self.path = path
+        self.strict = strict
+        self.input_shape = input_shape
+        self.optimizable = optimizable
+        self.backend = "eager"
+        self.weights = None
+        self.parity = None
+        self.model = None
+        self.mtime = None
+        self.load_time = None
+        self.memory_bytes = None
+        self.loads = 0
+        self.last_checked = 0.0
+        self.lock = threading.Lock()
+
+
+def model_memory_bytes(model):
+    total = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelRegistry:
+    def __init__(self, device, mode=LOADING_MODE, hot_reload=HOT_RELOAD, reload_interval=RELOAD_INTERVAL):
+        self.device = device
+        self.mode = mode
+        self.hot_reload = hot_reload
+        self.reload_interval = reload_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, builder, path, strict=True, input_shape=None, optimizable=True):
+        # input_shape (C, H, W) is used to trace/export optimized backends;
+        # optimizable=False pins models that need eager autograd to eager
+        self._entries[name] = ModelEntry(name, builder, path, strict=strict,
+                                         input_shape=input_shape, optimizable=optimizable)
+
+    def _entry(self, name, path=None):
+        entry = self._entries[name]
+        if path is None or path == entry.path:
+            return entry
+        # A non-default checkpoint for a registered architecture gets its own slot
+        key = f"{name}@{path}"
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = ModelEntry(key, entry.builder, path, strict=entry.strict,
+                                                input_shape=entry.input_shape, optimizable=entry.optimizable,
+                                                base_name=entry.base_name)
+            return self._entries[key]
+
+    def _build_eager(self, entry):
+        flat = ensure_flat(entry.path) if WEIGHTS_FORMAT == "mmap" and self.device.type == "cpu" else None
+        if flat is not None:
+            tensors = load_flat(flat)
+            # Built on the meta device so no throwaway weights are allocated; rebuilt
+            # normally if the file does not provide every parameter and buffer
+            with torch.device("meta"):
+                model = entry.builder()
+            assign_weights(model, tensors, strict=entry.strict)
+            if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+                model = assign_weights(entry.builder(), tensors, strict=entry.strict)
+            entry.weights = "mmap"
+        else:
+            model = entry.builder()
+            state_dict = torch.load(entry.path, map_location=self.device)
+            model.load_state_dict(state_dict, strict=entry.strict)
+            entry.weights = "pth"
+        model.to(self.device)
+        model.eval()
+        return model
+
+    def example_input(self, name, batch=1):
+        entry = self._entries[name]
+        return torch.rand((batch,) + tuple(entry.input_shape), device=self.device)
+
+    def load_eager(self, name):
+        return self._build_eager(self._entries[name])
+
+    def _load(self, entry):
+        start = time.perf_counter()
+        mtime = os.path.getmtime(entry.path)
+        model = self._build_eager(entry)
+        memory_bytes = model_memory_bytes(model)
+        backend = backend_for(entry.base_name) if entry.optimizable and entry.input_shape else "eager"
+        if not supports_backend(model, backend):
+            logger.warning("%s has no layers the %s backend quantizes; serving it eager", entry.name, backend)
+            backend = "eager"
+        if backend != "eager":
+            example = torch.rand((1,) + tuple(entry.input_shape), device=self.device)
+            inputs = None
+            if PARITY_CHECK or backend == "int8-static":
+                inputs = calibration_inputs((2,) + tuple(entry.input_shape), self.device, batches=4)
+            reference = model
+            model = optimize_model(reference, backend, example, entry.path, inputs)
+            if PARITY_CHECK:
+                entry.parity = parity_check(reference, model, inputs)
+        entry.model = model
+        entry.backend = backend
+        entry.mtime = mtime
+        entry.load_time = time.perf_counter() - start
+        entry.memory_bytes = memory_bytes
+        entry.loads += 1
+        entry.last_checked = time.monotonic()
+
+    def _mtime_changed(self, entry):
+        try:
+            return os.path.getmtime(entry.path) != entry.mtime
+        except OSError:
+            # Checkpoint is being replaced; keep serving the loaded copy
+            return False
+
+    def _is_stale(self, entry):
+        if not self.hot_reload:
+            return False
+        now = time.monotonic()
+        if now - entry.last_checked < self.reload_interval:
+            return False
+        entry.last_checked = now
+        return self._mtime_changed(entry)
+
+    def get(self, name, path=None):
+        entry = self._entry(name, path)
+        if entry.model is not None and not self._is_stale(entry):
+            return entry.model
+        with entry.lock:
+            if entry.model is None or self._mtime_changed(entry):
+                self._load(entry)
+            return entry.model
+
+    def versions(self):
+        # Checkpoint identity for cache keys: the loaded mtime (or the file's if not loaded
+        # yet) and the configured inference backend
+        versions = {}
+        for name, entry in list(self._entries.items()):
+            mtime = entry.mtime
+            if mtime is None:
+                try:
+                    mtime = os.path.getmtime(entry.path)
+                except OSError:
+                    mtime = None
+            backend = backend_for(entry.base_name) if entry.optimizable and entry.input_shape else "eager"
+            versions[name] = f"{mtime}:{backend}"
+        return versions
+
+    def load_all(self):
+        for name in list(self._entries):
+            self.get(name)
+
+    def stats(self):
+        stats = {}
+        for name, entry in list(self._entries.items()):
+            stats[name] = {
+                "path": entry.path,
+                "loaded": entry.model is not None,
+                "backend": entry.backend,
+                "weights": entry.weights,
+                "parity": entry.parity,
+                "load_time_seconds": entry.load_time,
+                "memory_bytes": entry.memory_bytes,
+                "loads": entry.loads,
+            }
+        return stats
@@ -0,0 +1,224 @@
+import os
+import re
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+# -------------------------------
+# SYMPTOM EXTRACTION SERVICE
+# -------------------------------
+# Every chat turn used to run the Medical-NER transformer on its own. The
+# service puts three layers in front of it:
+#   1. an LRU cache of normalized text -> extracted symptoms
+#   2. an Aho-Corasick dictionary matcher over the known symptoms; when every
+#      meaningful word of the message is covered by a match the model is skipped
+#   3. a micro-batcher that coalesces concurrent messages into one pipeline call
+#
+# USPARK_NER_CACHE_SIZE       cached messages (0 disables the cache)
+# USPARK_NER_DICTIONARY       1/0, enable the dictionary fast path
+# USPARK_NER_BATCH_SIZE       max messages per pipeline call
+# USPARK_NER_BATCH_WINDOW_MS  how long to wait for more messages
+# USPARK_NER_TIMEOUT_S        how long a message waits for its batch (includes the first model load)
+
+NER_CACHE_SIZE = int(os.environ.get("USPARK_NER_CACHE_SIZE", "4096"))
+NER_DICTIONARY = os.environ.get("USPARK_NER_DICTIONARY", "1") not in ("0", "false", "no")
+NER_BATCH_SIZE = int(os.environ.get("USPARK_NER_BATCH_SIZE", "16"))
+NER_BATCH_WINDOW_MS = float(os.environ.get("USPARK_NER_BATCH_WINDOW_MS", "5"))
+NER_TIMEOUT_S = float(os.environ.get("USPARK_NER_TIMEOUT_S", "120"))
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Words that may surround a symptom without making the match uncertain
+FILLER_WORDS = {
+    "i", "im", "i'm", "ive", "have", "has", "had", "having", "a", "an", "the", "and", "or", "my", "me",
+    "am", "is", "are", "been", "feel", "feeling", "some", "also", "with", "got", "get", "getting",
+    "bit", "little", "of", "really", "very", "bad", "severe", "mild", "slight", "too", "just", "yes",
+    "since", "today", "yesterday", "lately", "days", "day", "week", "weeks", "experiencing", "suffering",
+    "from", "in", "on", "it", "its", "there", "constant", "frequent", "sometimes",
+}
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SymptomMatcher:
+    # Token-level Aho-Corasick automaton: "skin_rash" matches "skin rash" and
+    # "skin_rash", always on whole words
+    def __init__(self, symptoms):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        for symptom in symptoms:
+            tokens = tokenize(symptom.replace("_", " "))
+            if tokens:
+                self._add(tokens, symptom)
+        self._build_failure_links()
+
+    def _add(self, tokens, symptom):
+        state = 0
+        for token in tokens:
+            if token not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[state][token] = len(self.goto) - 1
+            state = self.goto[state][token]
+        self.outputs[state].append((symptom, len(tokens)))
+
+    def _build_failure_links(self):
+        # Depth-1 states fail to the root; deeper ones follow their parent's link
+        pending = deque(self.goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for token, child in self.goto[state].items():
+                pending.append(child)
+                fallback = self.fail[state]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def match(self, text: str):
+        # Returns (matched symptoms, True if every non-filler word is covered)
+        tokens = tokenize(text)
+        covered = [False] * len(tokens)
+        found = set()
+        state = 0
+        for i, token in enumerate(tokens):
+            while state and token not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(token, 0)
+            for symptom, length in self.outputs[state]:
+                found.add(symptom)
+                for j in range(i - length + 1, i + 1):
+                    covered[j] = True
+        confident = bool(found) and all(covered[i] or token in FILLER_WORDS for i, token in enumerate(tokens))
+        return found, confident
+
+
+def symptoms_from_entities(results) -> set:
+    return {r["word"].lower() for r in results if "SIGN_SYMPTOM" in r["entity_group"]}
+
+
+class NERService:
+    def __init__(self, pipeline_factory, known_symptoms=(), cache_size=NER_CACHE_SIZE, use_dictionary=NER_DICTIONARY,
+                 batch_size=NER_BATCH_SIZE, batch_window_ms=NER_BATCH_WINDOW_MS, timeout=NER_TIMEOUT_S):
+        self.pipeline_factory = pipeline_factory
+        self.matcher = SymptomMatcher(known_symptoms) if use_dictionary else None
+        self.cache_size = cache_size
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window_ms / 1000.0
+        self.timeout = timeout
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.cache_hits = 0
+        self.dictionary_hits = 0
+        self.model_calls = 0
+        self.model_batches = 0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self.pipeline_factory()
+        return self._model
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return self._cache[key]
+        return None
+
+    def _cache_put(self, key, value):
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def extract(self, text: str) -> list:
+        key = normalize_text(text)
+        if not key:
+            return []
+        cached = self._cache_get(key)
+        if cached is not None:
+            return list(cached)
+
+        found, confident = self.matcher.match(key) if self.matcher is not None else (set(), False)
+        if confident:
+            self.dictionary_hits += 1
+        else:
+            found |= self._run_model(text)
+        result = tuple(sorted(found))
+        self._cache_put(key, result)
+        return list(result)
+
+    # --- micro-batching of model calls ---
+    def _run_model(self, text):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future.result(timeout=self.timeout)
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._worker_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name="ner-batcher", daemon=True)
+                    self._worker.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=self.batch_window))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+            # Every future gets a result or an exception, whatever goes wrong
+            try:
+                outputs = self.model(texts, batch_size=len(texts))
+                # A single input comes back unwrapped (an empty list when nothing was found)
+                if len(texts) == 1 and (not outputs or isinstance(outputs[0], dict)):
+                    outputs = [outputs]
+                if len(outputs) != len(texts):
+                    raise RuntimeError(f"NER pipeline returned {len(outputs)} results for {len(texts)} texts")
+                self.model_calls += len(texts)
+                self.model_batches += 1
+                for (_, future), results in zip(batch, outputs):
+                    future.set_result(symptoms_from_entities(results))
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+
+    def stats(self):
+        return {
+            "cache_entries": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "dictionary_hits": self.dictionary_hits,
+            "model_calls": self.model_calls,
+            "model_batches": self.model_batches,
+            "model_loaded": self._model is not None,
+        }
@@ -0,0 +1,120 @@
+import os
+import json
+from uuid import uuid4
+import cv2
+import numpy as np
+
+# -------------------------------
+# COMPACT MASK PAYLOADS
+# -------------------------------
+# Alternatives to the base64 composite for clients that draw their own
+# overlays. "mask" returns the raw label mask / binary mask run-length encoded
+# in JSON, and the Grad-CAM heatmap as a grid x grid uint8 array (the CAM is
+# smooth, upsampled from 7x7 layer4 activations, so a client-side bilinear
+# resize restores it); its metadata carries "scale" (1/255), so
+# value = data * scale. "binary" returns the same data as raw bytes in a
+# multipart/mixed response, with no base64. With USPARK_CAM_FULL_RESOLUTION=1
+# the binary format sends the heatmap at its native resolution as float16
+# values in [0, 1] instead; JSON always gets the grid.
+#
+# USPARK_CAM_GRID             side of the CAM grid
+# USPARK_CAM_FULL_RESOLUTION  1 = native float16 CAM in the binary format
+
+OUTPUT_FORMATS = ("composite", "mask", "binary")
+CAM_GRID = max(1, int(os.environ.get("USPARK_CAM_GRID", "32")))
+CAM_FULL_RESOLUTION = os.environ.get("USPARK_CAM_FULL_RESOLUTION", "0") in ("1", "true", "yes")
+CAM_SCALE = 1 / 255
+
+
+def rle_encode(mask: np.ndarray) -> dict:
+    # Row-major runs: values[i] repeated counts[i] times
+    flat = np.ascontiguousarray(mask).ravel()
+    if flat.size == 0:
+        return {"values": [], "counts": []}
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    counts = np.diff(np.concatenate((starts, [flat.size])))
+    return {"values": flat[starts].tolist(), "counts": counts.tolist()}
+
+
+def rle_decode(rle: dict, shape) -> np.ndarray:
+    return np.repeat(np.asarray(rle["values"], dtype=np.uint8), rle["counts"]).reshape(shape)
+
+
+def mask_bbox(mask: np.ndarray):
+    # Row/column projections instead of np.nonzero, so full-resolution masks stay cheap
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    x, y = int(cols[0]), int(rows[0])
+    return [x, y, int(cols[-1]) - x + 1, int(rows[-1]) - y + 1]
+
+
+def label_mask_payload(preds: np.ndarray) -> dict:
+    mask = preds.astype(np.uint8)
+    return {"kind": "label", "array": mask, "bbox": mask_bbox(mask)}
+
+
+def binary_mask_payload(mask: np.ndarray) -> dict:
+    mask = (mask > 0).astype(np.uint8)
+    return {"kind": "binary", "array": mask, "bbox": mask_bbox(mask)}
+
+
+def cam_payload(cam: np.ndarray, label: str, bbox) -> dict:
+    # Kept at native resolution; the encoders below decide what is sent
+    return {
+        "kind": "cam",
+        "array": np.clip(cam, 0, 1).astype(np.float16),
+        "source_shape": list(cam.shape),
+        "label": label,
+        "bbox": list(bbox) if bbox is not None else None,
+    }
+
+
+def cam_grid(payload: dict, grid=CAM_GRID) -> dict:
+    small = cv2.resize(payload["array"].astype(np.float32), (grid, grid), interpolation=cv2.INTER_AREA)
+    return {**payload, "array": np.uint8(np.round(np.clip(small, 0, 1) * 255)), "scale": CAM_SCALE}
+
+
+def payload_metadata(payload: dict) -> dict:
+    meta = {key: value for key, value in payload.items() if key != "array"}
+    meta["shape"] = list(payload["array"].shape)
+    meta["dtype"] = str(payload["array"].dtype)
+    return meta
+
+
+def payload_to_json(payload: dict) -> dict:
+    if payload["kind"] == "cam":
+        payload = cam_grid(payload)
+    meta = payload_metadata(payload)
+    if payload["kind"] == "cam":
+        meta["encoding"] = "raw"
+        meta["data"] = payload["array"].ravel().tolist()
+    else:
+        meta["encoding"] = "rle"
+        meta["rle"] = rle_encode(payload["array"])
+    return meta
+
+
+def payload_to_bytes(payload: dict, full_resolution=CAM_FULL_RESOLUTION):
+    if payload["kind"] == "cam" and not full_resolution:
+        payload = cam_grid(payload)
+    meta = payload_metadata(payload)
+    if payload["kind"] == "binary":
+        meta["encoding"] = "packbits"
+        return meta, np.packbits(payload["array"].ravel()).tobytes()
+    meta["encoding"] = "raw"
+    return meta, payload["array"].tobytes()
+
+
+def multipart_body(metadata: dict, data: bytes, boundary=None):
+    boundary = boundary or uuid4().hex
+    parts = [
+        f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode(),
+        json.dumps(metadata).encode(),
+        f"\r\n--{boundary}\r\nContent-Type: application/octet-stream\r\n\r\n".encode(),
+        data,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ]
+    return b"".join(parts), f"multipart/mixed; boundary={boundary}"
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+# -------------------------------
+# SHARED PREPROCESSING (resolution pyramid)
+# -------------------------------
+# An upload is converted to RGB and turned into a float tensor once. Every
+# resolution a model or renderer asks for (224 for the classifier and the
+# pneumonia model, 256 for the UNets and their overlays) is resampled from that
+# tensor with antialiased bilinear interpolation, starting from the smallest
+# level already built that is still at least as large, and cached on the
+# pyramid. The specialist and the renderer of one image therefore share the
+# same resized pixels instead of each resizing the PIL image again. The
+# classifier keeps the input it has always had, a plain (non-antialiased)
+# bilinear resize of the same base tensor.
+# Images larger than USPARK_PYRAMID_MAX_SIDE are box-reduced by an integer factor
+# before the float tensor is built, so a huge upload does not cost 12 bytes per
+# source pixel (tiled segmentation reads the original image directly).
+#
+# USPARK_PYRAMID_CACHE     keep resized levels on the pyramid (1) or rebuild per use (0)
+# USPARK_PYRAMID_MAX_SIDE  longest side of the float base level
+
+PYRAMID_CACHE = os.environ.get("USPARK_PYRAMID_CACHE", "1") == "1"
+PYRAMID_MAX_SIDE = int(os.environ.get("USPARK_PYRAMID_MAX_SIDE", "2048"))
+
+
+class ImagePyramid:
+    __slots__ = ("image", "_base", "_levels", "_arrays")
+
+    def __init__(self, image: Image.Image):
+        self.image = image if image.mode == "RGB" else image.convert("RGB")
+        factor = -(-max(self.image.size) // PYRAMID_MAX_SIDE)
+        source = self.image.reduce(factor) if factor > 1 else self.image
+        base = torch.from_numpy(np.asarray(source).copy()).permute(2, 0, 1).float().div_(255.0)
+        self._base = source.size[::-1]
+        self._levels = {self._base: base}
+        self._arrays = {}
+
+    @property
+    def size(self):
+        return self.image.size
+
+    def tensor(self, size, antialias=True) -> torch.Tensor:
+        # (3, H, W) float tensor in [0, 1]; size is an int or (height, width).
+        # antialias=False resamples the base level without a low-pass filter, like
+        # torchvision's tensor Resize did by default (the classifier's input)
+        size = (size, size) if isinstance(size, int) else tuple(int(v) for v in size)
+        key = size if antialias else size + ("aliased",)
+        level = self._levels.get(key)
+        if level is not None:
+            return level
+        source = self._base
+        if antialias:
+            candidates = [shape for shape in self._levels
+                          if len(shape) == 2 and shape[0] >= size[0] and shape[1] >= size[1]]
+            if candidates:
+                source = min(candidates, key=lambda shape: shape[0] * shape[1])
+        level = F.interpolate(self._levels[source].unsqueeze(0), size=size, mode="bilinear",
+                              align_corners=False, antialias=antialias).squeeze(0).clamp_(0.0, 1.0)
+        if PYRAMID_CACHE:
+            self._levels[key] = level
+        return level
+
+    def array(self, size) -> np.ndarray:
+        # (H, W, 3) uint8 array for rendering, derived from the same level
+        size = (size, size) if isinstance(size, int) else tuple(int(v) for v in size)
+        array = self._arrays.get(size)
+        if array is None:
+            array = self.tensor(size).mul(255.0).round_().byte().permute(1, 2, 0).contiguous().numpy()
+            if PYRAMID_CACHE:
+                self._arrays[size] = array
+        return array
+
+
+def as_pyramid(image) -> ImagePyramid:
+    return image if isinstance(image, ImagePyramid) else ImagePyramid(image)
+
+
+def batch_tensor(images: list, size, antialias=True) -> torch.Tensor:
+    return torch.stack([as_pyramid(image).tensor(size, antialias) for image in images])
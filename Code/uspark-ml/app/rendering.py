@@ -0,0 +1,114 @@
+import os
+import base64
+from io import BytesIO
+import cv2
+import numpy as np
+
+# -------------------------------
+# THREE-PANEL RENDERING
+# -------------------------------
+# The fast path builds the original | mask | overlay composite directly from
+# NumPy arrays and encodes it with OpenCV. "report" mode keeps the previous
+# matplotlib figure for users who want the titled 18x6in layout.
+#
+# USPARK_RENDER_MODE     fast | report
+# USPARK_RENDER_FORMAT   png | jpeg | webp
+# USPARK_RENDER_QUALITY  JPEG/WebP quality (1-100)
+# USPARK_PNG_COMPRESSION PNG compression level (0-9)
+
+RENDER_MODE = os.environ.get("USPARK_RENDER_MODE", "fast").lower()
+RENDER_FORMAT = os.environ.get("USPARK_RENDER_FORMAT", "png").lower()
+RENDER_QUALITY = int(os.environ.get("USPARK_RENDER_QUALITY", "90"))
+PNG_COMPRESSION = int(os.environ.get("USPARK_PNG_COMPRESSION", "1"))
+
+TITLE_HEIGHT = 28
+GUTTER = 8
+
+COLORMAPS = {
+    "jet": cv2.COLORMAP_JET,
+}
+
+
+def apply_colormap(data: np.ndarray, cmap: str) -> np.ndarray:
+    # Autoscale to the data range like matplotlib's imshow does
+    data = data.astype(np.float32)
+    low, high = float(data.min()), float(data.max())
+    scaled = np.zeros(data.shape, dtype=np.uint8) if high <= low else np.uint8(255 * (data - low) / (high - low))
+    if cmap == "gray":
+        return np.repeat(scaled[:, :, None], 3, axis=2)
+    colored = cv2.applyColorMap(scaled, COLORMAPS[cmap])
+    return cv2.cvtColor(colored, cv2.COLOR_BGR2RGB)
+
+
+def to_rgb_panel(data: np.ndarray, cmap=None) -> np.ndarray:
+    if data.ndim == 2:
+        return apply_colormap(data, cmap or "gray")
+    return np.ascontiguousarray(data[:, :, :3], dtype=np.uint8)
+
+
+def compose_panels(panels: list, titles: list) -> np.ndarray:
+    rgb = [to_rgb_panel(data, cmap) for data, cmap in panels]
+    height = max(panel.shape[0] for panel in rgb)
+    width = sum(panel.shape[1] for panel in rgb) + GUTTER * (len(rgb) - 1)
+    canvas = np.full((height + TITLE_HEIGHT, width, 3), 255, dtype=np.uint8)
+    x = 0
+    for panel, title in zip(rgb, titles):
+        h, w = panel.shape[:2]
+        canvas[TITLE_HEIGHT:TITLE_HEIGHT + h, x:x + w] = panel
+        (text_w, _), _ = cv2.getTextSize(title, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        cv2.putText(canvas, title, (x + max(0, (w - text_w) // 2), TITLE_HEIGHT - 9),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1, cv2.LINE_AA)
+        x += w + GUTTER
+    return canvas
+
+
+def encode_image(image_rgb: np.ndarray, fmt=None, quality=None, png_compression=None) -> bytes:
+    fmt = (fmt or RENDER_FORMAT).lower()
+    quality = RENDER_QUALITY if quality is None else quality
+    png_compression = PNG_COMPRESSION if png_compression is None else png_compression
+    if fmt == "png":
+        ext, params = ".png", [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    elif fmt in ("jpeg", "jpg"):
+        ext, params = ".jpg", [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif fmt == "webp":
+        ext, params = ".webp", [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        raise ValueError(f"Unsupported image format: {fmt}")
+    ok, encoded = cv2.imencode(ext, cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise RuntimeError(f"Failed to encode image as {fmt}")
+    return encoded.tobytes()
+
+
+def render_report(panels: list, titles: list) -> bytes:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(1, len(panels), figsize=(18,6))
+    for axis, (data, cmap), title in zip(ax, panels, titles):
+        axis.imshow(data, cmap=cmap)
+        axis.set_title(title)
+        axis.axis("off")
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def render_panels(panels: list, titles: list, mode=None) -> bytes:
+    # panels: list of (array, cmap) where cmap only applies to 2D arrays
+    if (mode or RENDER_MODE) == "report":
+        return render_report(panels, titles)
+    return encode_image(compose_panels(panels, titles))
+
+
+def render_panels_base64(panels: list, titles: list, mode=None) -> str:
+    return base64.b64encode(render_panels(panels, titles, mode)).decode("utf-8")
+
+
+def output_format(mode=None) -> str:
+    # Report mode is always PNG; the fast path follows USPARK_RENDER_FORMAT
+    if (mode or RENDER_MODE) == "report":
+        return "png"
+    return "jpeg" if RENDER_FORMAT == "jpg" else RENDER_FORMAT
@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# -------------------------------
+# CONTENT-ADDRESSED RESULT CACHE
+# -------------------------------
+# Results are keyed by a hash of the decoded pixels, the checkpoint version and
+# inference backend of every model, the CAM mode and the output variant, so
+# re-uploads of the same study (or a client retry) skip inference entirely.
+# While those versions are unknown (pool workers still starting) the cache is
+# bypassed. A bounded in-memory LRU sits in front
+# of an optional on-disk tier that is evicted oldest-first by total size.
+# Lookups and stores that may touch the disk tier run off the event loop.
+#
+# USPARK_CACHE_SIZE         in-memory entries (0 disables the cache)
+# USPARK_CACHE_DIR          directory for the disk tier (unset disables it)
+# USPARK_CACHE_DISK_MAX_MB  disk tier size limit
+
+CACHE_SIZE = int(os.environ.get("USPARK_CACHE_SIZE", "256"))
+CACHE_DIR = os.environ.get("USPARK_CACHE_DIR")
+CACHE_DISK_MAX_MB = float(os.environ.get("USPARK_CACHE_DISK_MAX_MB", "1024"))
+
+
+def image_cache_key(image, model_versions: dict, variant="") -> str:
+    pixels = np.asarray(image)
+    digest = hashlib.sha256()
+    digest.update(str(pixels.shape).encode())
+    digest.update(pixels.tobytes())
+    for name in sorted(model_versions):
+        digest.update(f"|{name}={model_versions[name]}".encode())
+    digest.update(f"|{variant}".encode())
+    return digest.hexdigest()
+
+
+class DiskTier:
+    # One <key>.json per entry; top-level bytes fields (mask_bytes) are stored
+    # next to it as <key>.<field>.bin. No pickle, so entries from a shared
+    # directory are only ever parsed as data.
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total = sum(entry.stat().st_size for entry in os.scandir(directory) if is_entry_file(entry.name))
+
+    def _path(self, key, suffix=".json"):
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                stored = json.load(f)
+            value = stored["result"]
+            for field in stored.get("binary", []):
+                with open(self._path(key, f".{field}.bin"), "rb") as f:
+                    value[field] = f.read()
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        # Touch so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        binary = {field: data for field, data in value.items() if isinstance(data, (bytes, bytearray))}
+        document = json.dumps({"result": {field: data for field, data in value.items() if field not in binary},
+                               "binary": sorted(binary)}).encode("utf-8")
+        size = len(document) + sum(len(data) for data in binary.values())
+        if size > self.max_bytes:
+            return
+        # Sidecars first; the .json appearing is what makes the entry visible
+        files = [(self._path(key, f".{field}.bin"), data) for field, data in binary.items()]
+        files.append((self._path(key), document))
+        with self._lock:
+            previous = sum(os.path.getsize(path) for path, _ in files if os.path.exists(path))
+            for path, data in files:
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            self._total += size - previous
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = {}
+        for entry in os.scandir(self.directory):
+            if is_entry_file(entry.name):
+                stat = entry.stat()
+                key = entry.name.split(".", 1)[0]
+                mtime, size, paths = entries.get(key, (0.0, 0, []))
+                # An entry's age is that of its .json, which get() touches
+                if entry.name.endswith(".json"):
+                    mtime = stat.st_mtime
+                entries[key] = (mtime, size + stat.st_size, paths + [entry.path])
+        ordered = sorted(entries.values(), key=lambda item: item[0])
+        self._total = sum(size for _, size, _ in ordered)
+        for _, size, paths in ordered:
+            if self._total <= self.max_bytes:
+                break
+            # The .json goes first so a reader never sees an entry without its sidecars
+            for path in sorted(paths, key=lambda path: not path.endswith(".json")):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._total -= size
+
+    def size_bytes(self):
+        return self._total
+
+
+def is_entry_file(name):
+    return name.endswith(".json") or name.endswith(".bin")
+
+
+class ResultCache:
+    def __init__(self, max_entries=CACHE_SIZE, disk_dir=CACHE_DIR, disk_max_mb=CACHE_DISK_MAX_MB):
+        self.max_entries = max_entries
+        self.enabled = max_entries > 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.disk = DiskTier(disk_dir, int(disk_max_mb * 1024 * 1024)) if disk_dir and self.enabled else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+        value = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, value)
+        return value
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._remember(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "disk_bytes": self.disk.size_bytes() if self.disk is not None else None,
+        }
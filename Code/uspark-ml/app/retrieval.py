@@ -0,0 +1,92 @@
+import numpy as np
+import scipy.sparse as sp
+
+# -------------------------------
+# SPARSE INVERTED INDEX
+# -------------------------------
+# Term -> postings (doc ids, weights) stored as CSC-style flat arrays, so
+# memory grows with the number of (disease, symptom token) pairs rather than
+# diseases x vocabulary. Queries only touch the postings of their own terms.
+#
+# cosine: sklearn-compatible TF-IDF (smooth idf, l2-normalized documents),
+#         which ranks exactly like the previous L2 search over dense TF-IDF.
+# bm25:   Okapi BM25 with the usual k1/b parameters.
+
+SCORINGS = ("cosine", "bm25")
+
+
+class SparseIndex:
+    def __init__(self, indptr, doc_ids, weights, idf, n_docs, scoring="cosine"):
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.idf = idf
+        self.n_docs = n_docs
+        self.scoring = scoring
+
+    @classmethod
+    def build(cls, counts, scoring="cosine", k1=1.5, b=0.75):
+        # counts: docs x terms sparse term-frequency matrix
+        if scoring not in SCORINGS:
+            raise ValueError(f"Unsupported scoring: {scoring}")
+        counts = sp.csr_matrix(counts, dtype=np.float32)
+        n_docs = counts.shape[0]
+        df = np.bincount(counts.indices, minlength=counts.shape[1]).astype(np.float32)
+
+        weighted = counts.copy()
+        if scoring == "cosine":
+            idf = np.log((1 + n_docs) / (1 + df)) + 1
+            weighted.data *= idf[weighted.indices]
+            norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+            norms[norms == 0] = 1
+            weighted = sp.csr_matrix(sp.diags(1 / norms) @ weighted)
+        else:
+            idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            doc_len = np.asarray(counts.sum(axis=1)).ravel()
+            avg_len = doc_len.mean() if n_docs else 0.0
+            row_len = np.repeat(doc_len, np.diff(counts.indptr))
+            tf = weighted.data
+            norm = k1 * (1 - b + b * row_len / (avg_len or 1))
+            weighted.data = idf[weighted.indices] * tf * (k1 + 1) / (tf + norm)
+
+        postings = weighted.tocsc()
+        postings.sort_indices()
+        return cls(postings.indptr.astype(np.int64), postings.indices.astype(np.int32),
+                   postings.data.astype(np.float32), idf.astype(np.float32), n_docs, scoring)
+
+    def postings(self, term):
+        start, end = self.indptr[term], self.indptr[term + 1]
+        return self.doc_ids[start:end], self.weights[start:end]
+
+    def query_weights(self, terms, tfs):
+        terms = np.asarray(terms, dtype=np.int64)
+        tfs = np.asarray(tfs, dtype=np.float32)
+        if self.scoring == "bm25":
+            return terms, tfs
+        weights = tfs * self.idf[terms]
+        norm = np.sqrt(np.sum(weights * weights))
+        return terms, weights / norm if norm else weights
+
+    def search(self, terms, tfs, k=1):
+        # Returns up to k (doc id, score) pairs; docs sharing no term are never returned
+        terms, query = self.query_weights(terms, tfs)
+        if len(terms) == 0:
+            return []
+        doc_parts, weight_parts = [], []
+        for term, q in zip(terms, query):
+            docs, weights = self.postings(term)
+            doc_parts.append(docs)
+            weight_parts.append(weights * q)
+        docs = np.concatenate(doc_parts)
+        if len(docs) == 0:
+            return []
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weight_parts))
+        # Highest score first, lowest doc id on ties
+        order = np.lexsort((candidates, -scores))[:k]
+        return [(int(candidates[i]), float(scores[i])) for i in order]
+
+    def search_vector(self, vector, k=1):
+        # vector: 1 x terms sparse row, e.g. from CountVectorizer.transform
+        row = sp.csr_matrix(vector)
+        return self.search(row.indices, row.data, k)
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# -------------------------------
+# CHAT SESSION STORES
+# -------------------------------
+# Sessions expire after USPARK_SESSION_TTL seconds of inactivity and at most
+# USPARK_SESSION_MAX are kept (least recently used are dropped first).
+#
+# USPARK_SESSION_STORE  memory  per-process OrderedDict holding live session objects
+#                       sqlite  shared file (USPARK_SESSION_DB) storing each
+#                               session's compact to_state() JSON, so any uvicorn
+#                               worker can continue any conversation
+
+SESSION_STORE = os.environ.get("USPARK_SESSION_STORE", "memory").lower()
+SESSION_TTL = float(os.environ.get("USPARK_SESSION_TTL", "3600"))
+SESSION_MAX = int(os.environ.get("USPARK_SESSION_MAX", "10000"))
+SESSION_DB = os.environ.get("USPARK_SESSION_DB", "sessions.db")
+
+
+class MemorySessionStore:
+    def __init__(self, ttl=SESSION_TTL, max_size=SESSION_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def _purge_expired(self, now):
+        # Entries are in last-access order, so expired ones sit at the front
+        while self._sessions:
+            session_id, (_, expires) = next(iter(self._sessions.items()))
+            if expires > now:
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            item = self._sessions.get(session_id)
+            if item is None:
+                return None
+            self._sessions[session_id] = (item[0], now + self.ttl)
+            self._sessions.move_to_end(session_id)
+            return item[0]
+
+    def put(self, session_id, session):
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            self._sessions[session_id] = (session, now + self.ttl)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        return {"backend": "memory", "sessions": len(self._sessions),
+                "expired": self.expired, "evicted": self.evicted}
+
+
+class SQLiteSessionStore:
+    def __init__(self, session_cls, path=SESSION_DB, ttl=SESSION_TTL, max_size=SESSION_MAX, purge_every=100):
+        self.session_cls = session_cls
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                         "id TEXT PRIMARY KEY, state TEXT NOT NULL, expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+
+    def _connection(self):
+        # One connection per thread; WAL lets readers in other workers proceed during writes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        conn = self._connection()
+        row = conn.execute("SELECT state FROM sessions WHERE id = ? AND expires > ?",
+                           (session_id, time.time())).fetchone()
+        if row is None:
+            return None
+        return self.session_cls.from_state(json.loads(row[0]))
+
+    def put(self, session_id, session):
+        state = json.dumps(session.to_state(), separators=(",", ":"))
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (id, state, expires) VALUES (?, ?, ?)",
+                         (session_id, state, time.time() + self.ttl))
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            self.purge()
+
+    def delete(self, session_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def purge(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),))
+            # Sessions are stored with a sliding expiry, so the oldest expiry is the least recently used
+            conn.execute("DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY expires DESC "
+                         "LIMIT -1 OFFSET ?)", (self.max_size,))
+
+    def stats(self):
+        count = self._connection().execute("SELECT COUNT(*) FROM sessions WHERE expires > ?",
+                                            (time.time(),)).fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "sessions": count}
+
+
+def create_session_store(session_cls, backend=SESSION_STORE):
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore(session_cls)
+    raise ValueError(f"Unknown session store: {backend}")
@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import logging
+import threading
+import contextlib
+import subprocess
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# LAZY SUBSYSTEMS AND READINESS
+# -------------------------------
+# Importing app.main only pulls in FastAPI and light helpers. Each heavy
+# subsystem (chat, medseg, persistence, gradio) is initialized the first time a
+# request needs it, behind a lock and a readiness flag. Listing subsystems in
+# USPARK_WARMUP initializes (and warms) them in the background as soon as the
+# server starts; /readyz only reports ready once those are done, so a load
+# balancer can send traffic to a replica that already answers /healthz.
+# Subsystems added as required (persistence) are initialized at startup, so a
+# misconfiguration stops the server, and always count toward readiness.
+#
+# USPARK_WARMUP  comma-separated subsystems to warm at startup, or "all"
+#
+# python -m app.startup  prints an import-time profile of app.main by package
+
+WARMUP = [name.strip() for name in os.environ.get("USPARK_WARMUP", "").lower().split(",") if name.strip()]
+HEAVY_MODULES = ("torch", "torchvision", "monai", "transformers", "sklearn", "gradio",
+                 "matplotlib", "nibabel", "pydicom", "pymongo")
+
+
+class SubsystemUnavailable(RuntimeError):
+    pass
+
+
+class Subsystem:
+    def __init__(self, name, init, warm_up=None, required=False):
+        self.name = name
+        self.required = required
+        self._init = init
+        self._warm_up = warm_up
+        self._lock = threading.Lock()
+        self.value = None
+        self.ready = False
+        self.error = None
+        self.init_seconds = None
+        self.warm_seconds = None
+
+    def get(self):
+        if self.ready:
+            return self.value
+        with self._lock:
+            if not self.ready:
+                start = time.perf_counter()
+                try:
+                    self.value = self._init()
+                except Exception as exc:
+                    # Not cached: the next request tries again
+                    self.error = f"{type(exc).__name__}: {exc}"
+                    logger.exception("Initializing %s failed", self.name)
+                    raise SubsystemUnavailable(f"{self.name} is unavailable") from exc
+                self.init_seconds = time.perf_counter() - start
+                self.error = None
+                self.ready = True
+        return self.value
+
+    def warm_up(self):
+        value = self.get()
+        if self._warm_up is not None:
+            start = time.perf_counter()
+            self._warm_up(value)
+            self.warm_seconds = time.perf_counter() - start
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "init_seconds": self.init_seconds,
+            "warm_seconds": self.warm_seconds,
+        }
+
+
+class Subsystems:
+    def __init__(self, warmup=WARMUP):
+        self._items = {}
+        self.warmup = warmup
+        self.warming = False
+        self.import_seconds = None
+        self.started = time.time()
+
+    def add(self, name, init, warm_up=None, required=False):
+        # required: initialized at startup and always part of readiness
+        self._items[name] = Subsystem(name, init, warm_up, required)
+        return self._items[name]
+
+    def __getitem__(self, name):
+        return self._items[name]
+
+    def required(self):
+        if "all" in self.warmup:
+            return list(self._items)
+        unknown = [name for name in self.warmup if name not in self._items]
+        if unknown:
+            raise ValueError(f"Unknown subsystems in USPARK_WARMUP: {', '.join(unknown)}")
+        return [name for name, item in self._items.items() if item.required and name not in self.warmup] + \
+            list(self.warmup)
+
+    def warm_up(self, names=None):
+        self.warming = True
+        try:
+            for name in names if names is not None else self.required():
+                try:
+                    self._items[name].warm_up()
+                except Exception:
+                    logger.exception("Warm-up of %s failed", name)
+        finally:
+            self.warming = False
+
+    def start_warm_up(self):
+        names = self.required()
+        if names:
+            threading.Thread(target=self.warm_up, args=(names,), name="warm-up", daemon=True).start()
+
+    def readiness(self):
+        required = self.required()
+        ready = all(self._items[name].ready for name in required)
+        return ready, {
+            "ready": ready,
+            "required": required,
+            "warming": self.warming,
+            "subsystems": {name: item.status() for name, item in self._items.items()},
+            "import_seconds": self.import_seconds,
+            "uptime_seconds": time.time() - self.started,
+            "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+        }
+
+
+class LazyASGIApp:
+    # Mount point for a sub-application (the Gradio UI) that is only built, and
+    # its lifespan entered, when the first request for it arrives
+    def __init__(self, subsystem):
+        self.subsystem = subsystem
+        self._app = None
+        self._lock = None
+        self._stack = contextlib.AsyncExitStack()
+
+    async def _build(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._app is None:
+                app = await run_in_threadpool(self.subsystem.get)
+                await self._stack.enter_async_context(app.router.lifespan_context(app))
+                self._app = app
+        return self._app
+
+    async def __call__(self, scope, receive, send):
+        app = self._app or await self._build()
+        await app(scope, receive, send)
+
+    async def aclose(self):
+        await self._stack.aclose()
+
+
+# -------------------------------
+# Import-time profile
+# -------------------------------
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_profile(module="app.main"):
+    # Runs `python -X importtime -c "import <module>"` in a fresh interpreter and
+    # aggregates self time per top-level package
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               capture_output=True, text=True)
+    packages, modules = {}, []
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+        modules.append((name, cumulative_us, (len(indent) - 1) // 2))
+    return {
+        "module": module,
+        "ok": completed.returncode == 0,
+        "total_seconds": sum(packages.values()) / 1e6,
+        "packages": sorted(((name, us / 1e6) for name, us in packages.items()), key=lambda item: -item[1]),
+        "modules": [(name, us / 1e6, depth) for name, us, depth in modules],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time profile of the API module")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    profile = import_profile(args.module)
+    if not profile["ok"]:
+        print(f"importing {args.module} failed", file=sys.stderr)
+    print(f"import {args.module}: {profile['total_seconds']:.3f}s")
+    print(f"{'package':<30}{'self_s':>10}")
+    for name, seconds in profile["packages"][:args.top]:
+        print(f"{name:<30}{seconds:>10.3f}")
+    # -X importtime lists a module after its children, so the direct imports of
+    # the profiled module are the depth-1 lines just before its own line
+    children = []
+    for name, seconds, depth in profile["modules"]:
+        if depth == 1:
+            children.append((name, seconds))
+        elif depth == 0:
+            if name == args.module:
+                print(f"\n{'direct imports of ' + args.module:<50}{'cumulative_s':>14}")
+                for child, child_seconds in sorted(children, key=lambda item: -item[1]):
+                    print(f"{child:<50}{child_seconds:>14.3f}")
+            children = []
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import os
+import tempfile
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+# -------------------------------
+# TILED SEGMENTATION (full-resolution masks)
+# -------------------------------
+# Instead of squashing an upload to 256x256, the UNets can run over
+# overlapping TILE_SIZE tiles at the source resolution. Tiles are processed in
+# row-major batches and stitched as soon as each batch is ready: probabilities
+# are accumulated with a window that fades out over the overlap, so seams are
+# blended, into a band only one tile high. Rows the band has moved past are
+# final and written straight into the output mask. Working memory therefore
+# grows with image width, not area. Masks larger than the memory ceiling go to
+# a temporary memory-mapped file, and the tile batch is capped so the model
+# activations (about TILE_ACTIVATION_MB per tile) stay under the ceiling.
+#
+# Composites of tiled masks are rendered at most USPARK_TILE_RENDER_SIDE pixels
+# on the longer side; "mask"/"binary" outputs keep the full resolution.
+#
+# USPARK_TILED_SEGMENTATION  off | on | auto (tile images larger than USPARK_TILE_AUTO_SIDE)
+# USPARK_TILE_AUTO_SIDE      longer side above which auto mode tiles
+# USPARK_TILE_OVERLAP        pixels shared by neighbouring tiles
+# USPARK_TILE_BATCH          tiles per forward pass
+# USPARK_TILE_MEMORY_MB      memory ceiling for activations and the output mask
+# USPARK_TILE_SPILL_DIR      directory for memory-mapped masks (default: system temp)
+# USPARK_TILE_RENDER_SIDE    longest side of rendered composites of tiled masks
+
+TILED_SEGMENTATION = os.environ.get("USPARK_TILED_SEGMENTATION", "off").lower()
+TILE_AUTO_SIDE = int(os.environ.get("USPARK_TILE_AUTO_SIDE", "512"))
+TILE_OVERLAP = int(os.environ.get("USPARK_TILE_OVERLAP", "32"))
+TILE_BATCH = int(os.environ.get("USPARK_TILE_BATCH", "4"))
+TILE_MEMORY_MB = float(os.environ.get("USPARK_TILE_MEMORY_MB", "1024"))
+TILE_SPILL_DIR = os.environ.get("USPARK_TILE_SPILL_DIR") or None
+TILE_RENDER_SIDE = int(os.environ.get("USPARK_TILE_RENDER_SIDE", "1024"))
+
+TILE_SIZE = 256
+TILE_ACTIVATION_MB = 200
+
+
+def should_tile(image, mode=None) -> bool:
+    mode = mode or TILED_SEGMENTATION
+    if mode == "on":
+        return True
+    if mode == "auto":
+        return max(image.size) > TILE_AUTO_SIDE
+    return False
+
+
+def tile_origins(length, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    # Start offsets covering [0, length); the last tile is aligned to the end
+    if length <= tile:
+        return [0]
+    stride = tile - overlap
+    origins = list(range(0, length - tile, stride))
+    return origins + [length - tile]
+
+
+def blend_window(tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    ramp = np.minimum(1.0, np.minimum(np.arange(1, tile + 1), np.arange(tile, 0, -1)) / float(overlap + 1))
+    return np.outer(ramp, ramp).astype(np.float32)
+
+
+def output_mask(shape, memory_mb=TILE_MEMORY_MB):
+    # Output mask in memory, or memory-mapped from a temporary file above the ceiling
+    if shape[0] * shape[1] <= memory_mb * 2 ** 20 / 2:
+        return np.zeros(shape, dtype=np.uint8)
+    spill = tempfile.TemporaryFile(dir=TILE_SPILL_DIR)
+    return np.memmap(spill, dtype=np.uint8, mode="w+", shape=shape)
+
+
+def tile_batch_size(width, channels, batch_size=TILE_BATCH, memory_mb=TILE_MEMORY_MB, tile=TILE_SIZE):
+    band_mb = (channels + 1) * tile * max(width, tile) * 4 / 2 ** 20
+    return max(1, min(batch_size, int((memory_mb - band_mb) // TILE_ACTIVATION_MB)))
+
+
+def tiled_segmentation(image: Image.Image, predict, channels, tile=TILE_SIZE, overlap=TILE_OVERLAP,
+                       batch_size=TILE_BATCH, memory_mb=TILE_MEMORY_MB) -> np.ndarray:
+    # predict: (B, 3, tile, tile) float tensor in [0, 1] -> (B, channels, tile, tile) probabilities.
+    # Returns a uint8 (H, W) label mask (argmax) for channels > 1, a 0/1 mask otherwise.
+    width, height = image.size
+    band_width = max(width, tile)
+    window = blend_window(tile, overlap)
+    band = np.zeros((channels, tile, band_width), dtype=np.float32)
+    weight = np.zeros((tile, band_width), dtype=np.float32)
+    mask = output_mask((height, width), memory_mb)
+    top = 0
+
+    def finalize(rows):
+        # Rows [top, top + rows) are covered by every tile that touches them
+        nonlocal top
+        end = min(top + rows, height)
+        if end > top:
+            acc, w = band[:, :end - top, :width], weight[:end - top, :width]
+            if channels > 1:
+                mask[top:end] = acc.argmax(axis=0)
+            else:
+                mask[top:end] = acc[0] > 0.5 * w
+        band[:, :tile - rows] = band[:, rows:]
+        band[:, tile - rows:] = 0
+        weight[:tile - rows] = weight[rows:]
+        weight[tile - rows:] = 0
+        top += rows
+
+    tiles = [(y, x) for y in tile_origins(height, tile, overlap) for x in tile_origins(width, tile, overlap)]
+    step = tile_batch_size(width, channels, batch_size, memory_mb, tile)
+    for start in range(0, len(tiles), step):
+        batch = tiles[start:start + step]
+        # crop() pads with black past the edge of images smaller than a tile
+        crops = [np.asarray(image.crop((x, y, x + tile, y + tile)), dtype=np.float32) for y, x in batch]
+        inputs = torch.from_numpy(np.stack(crops)).permute(0, 3, 1, 2).div_(255.0)
+        with torch.no_grad():
+            probs = predict(inputs).float().cpu().numpy()
+        for (y, x), prob in zip(batch, probs):
+            if y > top:
+                finalize(y - top)
+            band[:, :, x:x + tile] += prob * window
+            weight[:, x:x + tile] += window
+    finalize(tile)
+    return mask
+
+
+def display_mask(mask: np.ndarray, max_side=TILE_RENDER_SIDE) -> np.ndarray:
+    # Nearest-neighbour downscale of a full-resolution mask for rendering
+    height, width = mask.shape[:2]
+    if max(height, width) <= max_side:
+        return mask
+    scale = max_side / float(max(height, width))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(np.asarray(mask, dtype=np.uint8), size, interpolation=cv2.INTER_NEAREST)
@@ -0,0 +1,164 @@
+import io
+import os
+import gzip
+import zipfile
+import tempfile
+import numpy as np
+import nibabel as nib
+import pydicom
+from PIL import Image
+
+from app.ingest import UploadRejected
+from app.bulk import zip_sources
+
+# -------------------------------
+# VOLUMETRIC INGESTION (NIfTI / DICOM series)
+# -------------------------------
+# Volumes are never loaded whole. NIfTI files are opened through nibabel's
+# memory-mapped array proxy and sliced one plane at a time; DICOM series are
+# ordered from headers read without pixel data, then each slice's pixels are
+# read on demand. Slices stream through the classifier and specialists in
+# batches of USPARK_VOLUME_BATCH_SIZE, via run_batch (the in-process pipeline or
+# the inference worker pool). A .nii.gz upload is decompressed once while it is
+# spooled to disk, since a gzip stream can only be read sequentially and every
+# plane read would otherwise decompress the file again from the start.
+#
+# USPARK_VOLUME_BATCH_SIZE   slices per inference batch
+# USPARK_VOLUME_MAX_MB       largest decompressed NIfTI volume
+
+VOLUME_BATCH_SIZE = int(os.environ.get("USPARK_VOLUME_BATCH_SIZE", "8"))
+VOLUME_MAX_MB = float(os.environ.get("USPARK_VOLUME_MAX_MB", "8192"))
+NIFTI_SUFFIXES = (".nii", ".nii.gz")
+
+
+def is_nifti(filename):
+    return (filename or "").lower().endswith(NIFTI_SUFFIXES)
+
+
+def slice_to_image(array: np.ndarray) -> Image.Image:
+    # Robust per-slice windowing (1st-99th percentile) to 8-bit RGB
+    array = np.asarray(array, dtype=np.float32)
+    low, high = np.percentile(array, (1, 99)) if array.size else (0.0, 0.0)
+    if high <= low:
+        scaled = np.zeros(array.shape, dtype=np.uint8)
+    else:
+        scaled = np.uint8(np.clip((array - low) / (high - low), 0, 1) * 255)
+    return Image.fromarray(scaled).convert("RGB")
+
+
+def count_nifti_slices(path, axis=2):
+    return nib.load(path, mmap=True).shape[axis]
+
+
+def iter_nifti_slices(path, axis=2):
+    image = nib.load(path, mmap=True)
+    proxy = image.dataobj
+    shape = image.shape
+    for i in range(shape[axis]):
+        index = [slice(None)] * 3 + [0] * (len(shape) - 3)
+        index[axis] = i
+        # Slicing the proxy reads only this plane from the mapped file
+        yield i, np.asarray(proxy[tuple(index)])
+
+
+def dicom_sort_key(header):
+    position = getattr(header, "ImagePositionPatient", None)
+    if position is not None and len(position) == 3:
+        return (0, float(position[2]))
+    return (1, float(getattr(header, "InstanceNumber", 0) or 0))
+
+
+def open_dicom_sources(files):
+    # files: list of (name, file object); zip archives are checked against the
+    # bulk zip limits up front and their members read (size-capped) on demand
+    sources = []
+    for name, fileobj in files:
+        if (name or "").lower().endswith(".zip"):
+            for _, read in zip_sources(zipfile.ZipFile(fileobj), name, accept=lambda member: True):
+                sources.append(lambda read=read: io.BytesIO(read()))
+        else:
+            sources.append(lambda fileobj=fileobj: (fileobj.seek(0), fileobj)[1])
+    return sources
+
+
+def order_dicom_series(sources):
+    ordered = []
+    for source in sources:
+        try:
+            header = pydicom.dcmread(source(), stop_before_pixels=True)
+        except UploadRejected:
+            raise
+        except Exception:
+            # Non-DICOM files in a series upload (DICOMDIR, readmes) are skipped
+            continue
+        ordered.append((dicom_sort_key(header), source))
+    ordered.sort(key=lambda item: item[0])
+    return [source for _, source in ordered]
+
+
+def iter_dicom_slices(sources):
+    index = 0
+    for source in sources:
+        dataset = pydicom.dcmread(source())
+        pixels = dataset.pixel_array.astype(np.float32)
+        slope = float(getattr(dataset, "RescaleSlope", 1) or 1)
+        intercept = float(getattr(dataset, "RescaleIntercept", 0) or 0)
+        # Multi-frame objects contribute one slice per frame
+        frames = pixels if pixels.ndim == 3 and pixels.shape[-1] not in (3, 4) else [pixels]
+        for frame in frames:
+            yield index, frame * slope + intercept
+            index += 1
+
+
+def iter_batches(slices, batch_size=VOLUME_BATCH_SIZE):
+    batch = []
+    for index, array in slices:
+        batch.append((index, slice_to_image(array)))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def next_batch_results(batches, output="mask", run_batch=None):
+    # Pulls (and decodes) the next batch and runs it; None when the volume is done
+    batch = next(batches, None)
+    if batch is None:
+        return None
+    return process_slice_batch(batch, output, run_batch)
+
+
+def process_slice_batch(batch, output="mask", run_batch=None):
+    if run_batch is None:
+        from app.mediseg import complete_pipeline_requests as run_batch
+    results = run_batch([(image, output) for _, image in batch])
+    for (index, _), result in zip(batch, results):
+        result["slice"] = index
+    return results
+
+
+def spool_to_disk(fileobj, suffix, chunk_size=1024 * 1024, max_mb=VOLUME_MAX_MB):
+    # nibabel needs a real path to memory-map; copy the upload in chunks,
+    # gunzipping .gz uploads into a plain file on the way
+    fileobj.seek(0)
+    if suffix.lower().endswith(".gz"):
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode="rb")
+        suffix = suffix[:-3]
+    limit = int(max_mb * 2 ** 20)
+    handle = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    try:
+        with handle:
+            written = 0
+            while True:
+                chunk = fileobj.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > limit:
+                    raise UploadRejected(f"Volume exceeds {limit} bytes", 413)
+                handle.write(chunk)
+    except BaseException:
+        os.remove(handle.name)
+        raise
+    return handle.name
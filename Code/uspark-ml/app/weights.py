@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import mmap
+import glob
+import struct
+import argparse
+import torch
+import torch.nn as nn
+
+from app.metrics import memory_report, matching_pids
+
+# -------------------------------
+# MEMORY-MAPPED WEIGHTS
+# -------------------------------
+# Checkpoints are converted once into flat safetensors-layout files (an 8-byte
+# header length, a JSON header of dtype/shape/offsets, then the raw tensor bytes)
+# next to the .pth file. Loading maps the file copy-on-write and swaps every
+# parameter and buffer of the freshly built model for a zero-copy view of the
+# mapping. Inference never writes to the weights, so all processes that map the
+# same file (uvicorn/gunicorn workers, inference worker processes) share one
+# physical copy through the page cache instead of each holding its own.
+#
+# The registry converts a checkpoint on first load, and again whenever the .pth
+# changes (its mtime is stored in the header). If the models directory is
+# read-only and no up-to-date flat file exists, it falls back to torch.load.
+# Optimized backends (TorchScript, ONNX, int8) make their own copy of the
+# weights, so sharing applies to eager models. The Medical-NER weights are
+# written to USPARK_NER_WEIGHTS the first time the pipeline is loaded, and again
+# whenever the model name or hub revision recorded in the header differs.
+#
+#   python -m app.weights convert                  # every models/*.pth
+#   python -m app.weights report --match uvicorn   # PSS/USS of running workers
+#
+# USPARK_WEIGHTS_FORMAT   mmap | pth
+# USPARK_NER_WEIGHTS      flat weight file for the Medical-NER model
+
+WEIGHTS_FORMAT = os.environ.get("USPARK_WEIGHTS_FORMAT", "mmap").lower()
+NER_WEIGHTS = os.environ.get("USPARK_NER_WEIGHTS", os.path.join("models", "medical-ner.safetensors"))
+
+DTYPES = {
+    torch.float64: "F64", torch.float32: "F32", torch.float16: "F16", torch.bfloat16: "BF16",
+    torch.int64: "I64", torch.int32: "I32", torch.int16: "I16", torch.int8: "I8",
+    torch.uint8: "U8", torch.bool: "BOOL",
+}
+DTYPE_NAMES = {name: dtype for dtype, name in DTYPES.items()}
+
+
+def flat_path(checkpoint_path):
+    return os.path.splitext(checkpoint_path)[0] + ".safetensors"
+
+
+def save_flat(tensors, path, metadata=None):
+    # Widest dtypes first, so every tensor stays aligned without padding between them
+    items = sorted(((name, tensor.detach().cpu().contiguous()) for name, tensor in tensors.items()),
+                   key=lambda item: (-item[1].element_size(), item[0]))
+    header = {"__metadata__": {key: str(value) for key, value in (metadata or {}).items()}}
+    offset = 0
+    for name, tensor in items:
+        nbytes = tensor.numel() * tensor.element_size()
+        header[name] = {"dtype": DTYPES[tensor.dtype], "shape": list(tensor.shape),
+                        "data_offsets": [offset, offset + nbytes]}
+        offset += nbytes
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    encoded += b" " * (-len(encoded) % 8)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        for _, tensor in items:
+            f.write(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        return json.loads(f.read(length)), 8 + length
+
+
+def load_flat(path):
+    # name -> tensor viewing a copy-on-write mapping of the file (no copy of the data)
+    header, data_start = read_header(path)
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = DTYPE_NAMES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensors[name] = torch.frombuffer(mapping, dtype=dtype, count=count,
+                                         offset=data_start + begin).view(info["shape"])
+    return tensors
+
+
+def assign_weights(model, tensors, strict=True):
+    # Like load_state_dict, but the model keeps the given tensors instead of copying them
+    expected = model.state_dict(keep_vars=True)
+    missing = [name for name in expected if name not in tensors]
+    unexpected = [name for name in tensors if name not in expected]
+    if strict and (missing or unexpected):
+        raise RuntimeError(f"Weight mismatch: missing {missing[:5]}, unexpected {unexpected[:5]}")
+    # Every shape is checked before anything is swapped, so a mismatch leaves the model untouched
+    for name, current in expected.items():
+        tensor = tensors.get(name)
+        if tensor is not None and tensor.shape != current.shape:
+            raise RuntimeError(f"Shape mismatch for {name}: {tuple(tensor.shape)} vs {tuple(current.shape)}")
+    for name, current in expected.items():
+        tensor = tensors.get(name)
+        if tensor is None:
+            continue
+        module_name, _, attr = name.rpartition(".")
+        module = model.get_submodule(module_name) if module_name else model
+        if attr in module._parameters:
+            module._parameters[attr] = nn.Parameter(tensor, requires_grad=False)
+        else:
+            module._buffers[attr] = tensor
+    return model
+
+
+def checkpoint_signature(checkpoint_path):
+    return str(os.path.getmtime(checkpoint_path))
+
+
+def ensure_flat(checkpoint_path):
+    # Path of an up-to-date flat file for the checkpoint, converting if needed; None if impossible
+    path = flat_path(checkpoint_path)
+    try:
+        if os.path.exists(path):
+            metadata = read_header(path)[0].get("__metadata__", {})
+            if not os.path.exists(checkpoint_path) or metadata.get("source_mtime") == checkpoint_signature(checkpoint_path):
+                return path
+        state_dict = torch.load(checkpoint_path, map_location="cpu")
+        save_flat(state_dict, path, {"source": os.path.basename(checkpoint_path),
+                                     "source_mtime": checkpoint_signature(checkpoint_path)})
+        return path
+    except OSError:
+        return None
+
+
+def module_signature(model):
+    # Which model the weights came from: hub name and resolved revision
+    config = getattr(model, "config", None)
+    return {"source": str(getattr(config, "_name_or_path", "") or type(model).__name__),
+            "revision": str(getattr(config, "_commit_hash", "") or "")}
+
+
+def map_module_weights(model, path=NER_WEIGHTS):
+    # Moves an already loaded model (e.g. the NER transformer) onto a shared mapping;
+    # the file is rewritten when it was made from another model or revision
+    signature = module_signature(model)
+    try:
+        if os.path.exists(path):
+            metadata = read_header(path)[0].get("__metadata__", {})
+            if all(metadata.get(key) == value for key, value in signature.items()):
+                try:
+                    return assign_weights(model, load_flat(path), strict=True)
+                except RuntimeError:
+                    pass
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        save_flat(model.state_dict(), path, signature)
+        return assign_weights(model, load_flat(path), strict=True)
+    except (OSError, ValueError, KeyError, RuntimeError):
+        # Keep the weights the model was loaded with
+        return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory-mapped model weights")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="convert .pth checkpoints to flat weight files")
+    convert.add_argument("checkpoints", nargs="*", help="default: models/*.pth")
+    report = commands.add_parser("report", help="per-process RSS/PSS/USS")
+    report.add_argument("--pids", type=int, nargs="*", default=[])
+    report.add_argument("--match", help="substring of the command line, e.g. uvicorn or app.workers")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        for checkpoint in args.checkpoints or sorted(glob.glob(os.path.join("models", "*.pth"))):
+            path = ensure_flat(checkpoint)
+            print(f"{checkpoint} -> {path or 'failed'}")
+        return 0
+
+    pids = list(args.pids) + (matching_pids(args.match) if args.match else [])
+    rows = [(pid, memory_report(pid)) for pid in pids or ["self"]]
+    print(f"{'pid':>8}{'rss_mb':>10}{'pss_mb':>10}{'uss_mb':>10}{'shared_mb':>11}")
+    for pid, report in rows:
+        if report:
+            print(f"{pid:>8}{report['rss_mb']:>10.1f}{report['pss_mb']:>10.1f}{report['uss_mb']:>10.1f}"
+                  f"{report['shared_mb']:>11.1f}")
+    reports = [report for _, report in rows if report]
+    if reports:
+        print(f"{'total':>8}{sum(r['rss_mb'] for r in reports):>10.1f}{sum(r['pss_mb'] for r in reports):>10.1f}"
+              f"{sum(r['uss_mb'] for r in reports):>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+import os
+import time
+import heapq
+import queue
+import logging
+import itertools
+import threading
+import multiprocessing as mp
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from PIL import Image
+
+from app.metrics import capture, replay, muted, memory_report
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------
+# INFERENCE WORKER POOL
+# -------------------------------
+# With USPARK_INFERENCE_WORKERS > 0 the API process never imports torch. Worker
+# processes (spawned, each with its own model registry) run batches handed to
+# them one at a time: the API keeps the backlog and gives the next batch to an
+# idle worker through that worker's own queue, so every batch has an owner from
+# the moment it leaves the backlog. The batch's pixels are written once into a
+# shared-memory segment and only its name and layout go through the queue;
+# results (base64 images / masks) come back on a result queue. The result reader
+# also waits on the workers' process sentinels, so a dead worker is noticed
+# right away: it is restarted and its batch fails instead of hanging. The
+# backlog is ordered by priority, so interactive /medseg micro-batches are handed
+# to the next free worker ahead of queued /medseg/batch and /medseg/volume work.
+#
+# USPARK_INFERENCE_WORKERS  number of worker processes (0 = run in the API process)
+# USPARK_WORKER_THREADS     torch intra-op threads per worker (default: its CPU share)
+# USPARK_WORKER_CPUS        "auto" splits the available CPUs evenly between workers,
+#                           or explicit sets per worker such as "0-3;4-7"
+# USPARK_API_CPUS           CPUs the API process itself is pinned to, e.g. "8-9"
+# USPARK_WORKER_TASK_TIMEOUT  seconds before a batch is abandoned
+
+INFERENCE_WORKERS = int(os.environ.get("USPARK_INFERENCE_WORKERS", "0"))
+WORKER_THREADS = int(os.environ.get("USPARK_WORKER_THREADS", "0"))
+WORKER_CPUS = os.environ.get("USPARK_WORKER_CPUS", "").strip()
+API_CPUS = os.environ.get("USPARK_API_CPUS", "").strip()
+TASK_TIMEOUT = float(os.environ.get("USPARK_WORKER_TASK_TIMEOUT", "300"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+def parse_cpu_list(spec):
+    cpus = []
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def worker_cpu_sets(workers, spec=WORKER_CPUS):
+    if not spec:
+        return [None] * workers
+    if spec == "auto":
+        cpus = available_cpus()
+        per_worker = max(1, len(cpus) // workers)
+        return [cpus[i * per_worker:(i + 1) * per_worker] or [cpus[i % len(cpus)]] for i in range(workers)]
+    groups = [parse_cpu_list(group) for group in spec.split(";")]
+    return [groups[i % len(groups)] for i in range(workers)]
+
+
+def warm_up_pipeline(mediseg):
+    # Loads every checkpoint and runs one image through the pipeline so the first
+    # real request does not pay for allocator and kernel warm-up. Metrics are muted so
+    # the synthetic image is not counted; the pipeline itself persists nothing.
+    mediseg.registry.load_all()
+    with muted():
+        mediseg.complete_pipeline_image(Image.new("RGB", (256, 256), (128, 128, 128)))
+
+
+# -------------------------------
+# Shared-memory image handoff
+# -------------------------------
+def pack_requests(requests):
+    # requests: list of (PIL image, output format); pixels go into one segment
+    arrays = [np.asarray(image if image.mode == "RGB" else image.convert("RGB")) for image, _ in requests]
+    shm = SharedMemory(create=True, size=max(1, sum(array.nbytes for array in arrays)))
+    layout, offset = [], 0
+    for (_, output), array in zip(requests, arrays):
+        np.ndarray(array.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)[...] = array
+        layout.append((offset, array.shape, output))
+        offset += array.nbytes
+    return shm, layout
+
+
+def unpack_requests(shm_name, layout):
+    shm = SharedMemory(name=shm_name)
+    try:
+        # Copied out so the segment can be released before inference starts
+        return [(Image.fromarray(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset).copy()), output)
+                for offset, shape, output in layout]
+    finally:
+        shm.close()
+
+
+# -------------------------------
+# Worker process
+# -------------------------------
+def worker_main(slot, tasks, results, cpus, threads):
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    if threads > 0:
+        # Read by torch / OpenMP and by app.backends.configure_threads at import
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+        os.environ["USPARK_INTRA_OP_THREADS"] = str(threads)
+        os.environ.setdefault("USPARK_INTER_OP_THREADS", "1")
+
+    import app.mediseg as mediseg
+
+    pid = os.getpid()
+
+    def meta():
+        return {"versions": mediseg.pipeline_versions(), "models": mediseg.registry.stats(),
+                "memory": memory_report()}
+
+    try:
+        warm_up_pipeline(mediseg)
+    except Exception:
+        # Missing checkpoints surface per request instead of crash-looping the worker
+        logger.exception("Warm-up of inference worker %d failed", slot)
+    results.put(("ready", None, pid, meta()))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, shm_name, layout = task
+        try:
+            # Stage timings are sent back with the results and replayed into the API's /metrics
+            with capture() as observations:
+                outputs = mediseg.complete_pipeline_requests(unpack_requests(shm_name, layout))
+            results.put(("done", task_id, pid, {"results": outputs, "metrics": observations, **meta()}))
+        except Exception as exc:
+            results.put(("error", task_id, pid, f"{type(exc).__name__}: {exc}"))
+
+
+# -------------------------------
+# API-side handles
+# -------------------------------
+class InProcessInference:
+    # Default: models live in the API process and batches run on its threads
+    def __init__(self):
+        import app.mediseg as mediseg
+        self.mediseg = mediseg
+        # Eager mode pays the checkpoint load once at initialization instead of on the first request
+        if mediseg.registry.mode == "eager":
+            mediseg.registry.load_all()
+
+    def run_batch(self, requests, priority=PRIORITY_INTERACTIVE):
+        return self.mediseg.complete_pipeline_requests(requests)
+
+    def versions(self):
+        return self.mediseg.pipeline_versions()
+
+    def models(self):
+        return self.mediseg.registry.stats()
+
+    def warm_up(self):
+        warm_up_pipeline(self.mediseg)
+
+    def stats(self):
+        return {"mode": "in-process", "workers": 0, "memory": {os.getpid(): memory_report()}}
+
+    def close(self):
+        pass
+
+
+class InferencePool:
+    def __init__(self, workers=INFERENCE_WORKERS, threads=WORKER_THREADS, cpus=WORKER_CPUS, task_timeout=TASK_TIMEOUT,
+                 target=worker_main):
+        self.workers = workers
+        self._target = target
+        self.task_timeout = task_timeout
+        self._ctx = mp.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._cpu_sets = worker_cpu_sets(workers, cpus)
+        cpu_count = os.cpu_count() or 1
+        self._threads = [threads or (len(cpu_set) if cpu_set else max(1, cpu_count // workers))
+                         for cpu_set in self._cpu_sets]
+        self._processes = {}
+        self._queues = {}
+        self._slots = {}      # pid -> slot
+        self._backlog = []    # heap of (priority, task id, shm name, layout)
+        self._idle = set()    # slots of ready workers without a batch
+        self._pending = {}
+        self._owners = {}     # task id -> slot running it
+        self._ready = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._closed = False
+        self._versions = {}
+        self._models = {}
+        self._memory = {}
+        self.batches = 0
+        self.restarts = 0
+        for slot in range(workers):
+            self._spawn(slot)
+        if API_CPUS and hasattr(os, "sched_setaffinity"):
+            # After spawning, so workers without explicit CPU sets keep the full machine
+            os.sched_setaffinity(0, parse_cpu_list(API_CPUS))
+        self._reader = threading.Thread(target=self._read_results, name="inference-results", daemon=True)
+        self._reader.start()
+
+    def _spawn(self, slot):
+        # A fresh queue per process, so a batch the dead worker never took is not run twice
+        self._queues[slot] = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=self._target, name=f"inference-{slot}", daemon=True,
+            args=(slot, self._queues[slot], self._results, self._cpu_sets[slot], self._threads[slot]),
+        )
+        process.start()
+        self._processes[slot] = process
+        self._slots[process.pid] = slot
+
+    def _dispatch(self):
+        # Called with the lock held; batches whose caller gave up are skipped
+        while self._idle and self._backlog:
+            _, task_id, shm_name, layout = heapq.heappop(self._backlog)
+            if task_id not in self._pending:
+                continue
+            slot = self._idle.pop()
+            self._owners[task_id] = slot
+            self._queues[slot].put((task_id, shm_name, layout))
+
+    def _check_workers(self):
+        for slot, process in list(self._processes.items()):
+            if process.is_alive() or self._closed:
+                continue
+            logger.error("Inference worker %s (pid %s) exited with %s; restarting",
+                         slot, process.pid, process.exitcode)
+            with self._lock:
+                self._ready.discard(process.pid)
+                self._memory.pop(process.pid, None)
+                self._slots.pop(process.pid, None)
+                self._idle.discard(slot)
+                lost = [task_id for task_id, owner in self._owners.items() if owner == slot]
+                for task_id in lost:
+                    self._owners.pop(task_id)
+                    future = self._pending.pop(task_id, None)
+                    if future is not None:
+                        future.set_exception(RuntimeError("Inference worker exited during the batch"))
+                self.restarts += 1
+                self._spawn(slot)
+
+    def _read_results(self):
+        last_check = time.monotonic()
+        while not self._closed:
+            sentinels = [process.sentinel for process in self._processes.values()]
+            try:
+                ready = wait([self._results._reader] + sentinels, timeout=1.0)
+            except OSError:
+                break
+            # Liveness is checked whenever a worker exits, and at least once a second
+            if any(handle in sentinels for handle in ready) or time.monotonic() - last_check >= 1.0:
+                last_check = time.monotonic()
+                self._check_workers()
+            if self._results._reader not in ready:
+                continue
+            try:
+                kind, task_id, pid, payload = self._results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            future = None
+            with self._lock:
+                slot = self._slots.get(pid)
+                if kind == "ready":
+                    self._ready.add(pid)
+                else:
+                    self._owners.pop(task_id, None)
+                    future = self._pending.pop(task_id, None)
+                if kind in ("ready", "done"):
+                    self._versions, self._models = payload["versions"], payload["models"]
+                    self._memory[pid] = payload["memory"]
+                if slot is not None:
+                    self._idle.add(slot)
+                    self._dispatch()
+            if kind == "done":
+                replay(payload["metrics"])
+            if kind == "done" and future is not None:
+                self.batches += 1
+                future.set_result(payload["results"])
+            elif kind == "error" and future is not None:
+                future.set_exception(RuntimeError(payload))
+
+    def run_batch(self, requests, priority=PRIORITY_INTERACTIVE):
+        # Blocking; called from the micro-batcher's executor threads
+        shm, layout = pack_requests(requests)
+        task_id = next(self._ids)
+        future = Future()
+        try:
+            with self._lock:
+                self._pending[task_id] = future
+                heapq.heappush(self._backlog, (priority, task_id, shm.name, layout))
+                self._dispatch()
+            return future.result(timeout=self.task_timeout)
+        finally:
+            with self._lock:
+                self._pending.pop(task_id, None)
+            shm.close()
+            shm.unlink()
+
+    def versions(self):
+        return self._versions
+
+    def models(self):
+        return self._models
+
+    def warm_up(self, timeout=600.0):
+        # Workers warm themselves up at start; wait until all of them report ready
+        deadline = time.monotonic() + timeout
+        while len(self._ready) < self.workers:
+            if time.monotonic() > deadline:
+                raise TimeoutError("Inference workers did not become ready")
+            time.sleep(0.1)
+
+    def stats(self):
+        return {
+            "mode": "processes",
+            "workers": self.workers,
+            "alive": sum(process.is_alive() for process in self._processes.values()),
+            "ready": len(self._ready),
+            "queued": len(self._backlog),
+            "in_flight": len(self._owners),
+            "batches": self.batches,
+            "restarts": self.restarts,
+            "cpu_sets": self._cpu_sets,
+            "threads": self._threads,
+            # As of each worker's last batch; weights mapped by several workers count as shared, not unique
+            "memory": {"api": memory_report(), "workers": dict(self._memory)},
+        }
+
+    def close(self, timeout=10.0):
+        self._closed = True
+        for slot in self._processes:
+            self._queues[slot].put(None)
+        for process in self._processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+def create_inference(workers=INFERENCE_WORKERS):
+    return InferencePool(workers) if workers > 0 else InProcessInference()
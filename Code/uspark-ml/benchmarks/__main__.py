@@ -0,0 +1,128 @@
+import os
+import sys
+import argparse
+import datetime
+
+from benchmarks.fixtures import prepare_environment
+from benchmarks.harness import (environment_info, save_results, load_results, compare_results,
+                                peak_rss_mb, children_peak_rss_mb)
+
+# -------------------------------
+# BENCHMARK CLI
+# -------------------------------
+# Run from Code/uspark-ml, fully offline:
+#   python -m benchmarks run --suite micro,chat,medseg --out before.json
+#   python -m benchmarks run --concurrency 16 --requests 128 --out after.json
+#   python -m benchmarks compare before.json after.json
+#
+# USPARK_* variables set in the environment (backends, workers, render mode, ...)
+# apply as usual and are recorded in the result file.
+
+SUITES = ("micro", "chat", "medseg", "mixed")
+
+
+def run(args):
+    out = os.path.abspath(args.out or os.path.join(
+        "benchmark-results", datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"))
+    suites = [suite.strip() for suite in args.suite.split(",") if suite.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        raise SystemExit(f"Unknown suites: {', '.join(sorted(unknown))}")
+
+    workdir = prepare_environment(args.workdir)
+    from benchmarks.fixtures import write_random_checkpoints, install_random_ner
+    from benchmarks.micro import run_chat_micro, run_medseg_micro
+    from benchmarks.load import run_chat_load, run_medseg_load, run_mixed_load
+
+    print(f"workdir: {workdir}", file=sys.stderr)
+    written = write_random_checkpoints(args.seed)
+    if args.ner != "hub":
+        install_random_ner(args.ner, args.seed)
+
+    benchmarks = {}
+    if "micro" in suites:
+        benchmarks.update({f"micro.{name}": result for name, result in run_chat_micro(args.iterations, args.seed).items()})
+        benchmarks.update({f"micro.{name}": result for name, result in
+                           run_medseg_micro(args.iterations, args.batch_size, args.image_size, args.seed).items()})
+    if {"chat", "medseg", "mixed"} & set(suites):
+        from fastapi.testclient import TestClient
+        import app.main
+
+        with TestClient(app.main.app) as client:
+            if "chat" in suites:
+                benchmarks["load.chat"] = run_chat_load(client, args.conversations, args.concurrency,
+                                                        args.followups, args.seed)
+            if "medseg" in suites:
+                benchmarks[f"load.medseg[{args.output}]"] = run_medseg_load(
+                    client, args.requests, args.concurrency, args.image_size, args.output, args.seed)
+            if "mixed" in suites:
+                mixed = run_mixed_load(client, args.conversations, args.requests, args.concurrency,
+                                       args.followups, args.image_size, args.seed)
+                benchmarks["load.mixed.chat"] = mixed["chat"]
+                benchmarks["load.mixed.medseg"] = mixed["medseg"]
+            from app.database import get_writer
+            get_writer().flush()
+            persisted = get_writer().stats()
+
+    results = {
+        "environment": environment_info(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("func", "out", "workdir")},
+        "random_checkpoints": written,
+        "benchmarks": benchmarks,
+        "peak_rss_mb": peak_rss_mb(),
+        "children_peak_rss_mb": children_peak_rss_mb(),
+    }
+    if {"chat", "medseg", "mixed"} & set(suites):
+        results["persistence"] = persisted
+    save_results(out, results)
+
+    print(f"{'benchmark':<48}{'p50_ms':>10}{'p95_ms':>10}{'p99_ms':>10}{'per_s':>10}{'errors':>8}")
+    for name, result in benchmarks.items():
+        print(f"{name:<48}{result.get('p50_ms', float('nan')):>10.2f}{result.get('p95_ms', float('nan')):>10.2f}"
+              f"{result.get('p99_ms', float('nan')):>10.2f}{result.get('throughput_per_s', 0.0):>10.2f}"
+              f"{result.get('errors', 0):>8}")
+    print(f"peak RSS {results['peak_rss_mb']:.0f} MB; results written to {out}")
+    return 0
+
+
+def compare(args):
+    rows = compare_results(load_results(args.before), load_results(args.after))
+    print(f"{'benchmark':<48}{'metric':<18}{'before':>12}{'after':>12}{'change':>9}")
+    for name, metric, old, new, change in rows:
+        change_text = f"{change * 100:+.1f}%" if change is not None else "n/a"
+        print(f"{name:<48}{metric:<18}{old:>12.2f}{new:>12.2f}{change_text:>9}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Uspark benchmark and load-test suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run benchmarks and store the results as JSON")
+    run_parser.add_argument("--suite", default=",".join(SUITES), help="comma-separated: micro, chat, medseg, mixed")
+    run_parser.add_argument("--out", help="result file (default benchmark-results/<timestamp>.json)")
+    run_parser.add_argument("--workdir", help="directory for random checkpoints and the knowledge base")
+    run_parser.add_argument("--iterations", type=int, default=20, help="calls per micro-benchmark")
+    run_parser.add_argument("--batch-size", type=int, default=8)
+    run_parser.add_argument("--image-size", type=int, default=256)
+    run_parser.add_argument("--concurrency", type=int, default=8, help="concurrent virtual users in load scenarios")
+    run_parser.add_argument("--conversations", type=int, default=32)
+    run_parser.add_argument("--followups", type=int, default=3)
+    run_parser.add_argument("--requests", type=int, default=64, help="/medseg uploads")
+    run_parser.add_argument("--output", default="composite", choices=("composite", "mask", "binary"))
+    run_parser.add_argument("--ner", default="base", choices=("base", "tiny", "hub"),
+                            help="random-weight NER size, or hub for the cached Medical-NER model")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
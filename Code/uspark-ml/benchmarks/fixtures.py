@@ -0,0 +1,127 @@
+import io
+import os
+import sys
+import tempfile
+import numpy as np
+from PIL import Image
+
+# -------------------------------
+# OFFLINE BENCHMARK FIXTURES
+# -------------------------------
+# Everything a benchmark run needs without network access or real data:
+# random-weight checkpoints for every registered model, a random-weight NER
+# transformer of the same size class as Medical-NER, synthetic scans and
+# symptom sentences built from the knowledge base, and the in-memory
+# persistence backend instead of Mongo.
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FILLER = ["I have been having", "lately I noticed", "my main problem is", "I also get", "there is some"]
+
+
+def prepare_environment(workdir=None):
+    # Must run before any app module is imported, since the app reads its
+    # settings at import time. Explicitly set variables are left alone.
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix="uspark-bench-"))
+    os.makedirs(os.path.join(workdir, "models"), exist_ok=True)
+    defaults = {
+        "USPARK_PERSISTENCE": "memory",
+        "USPARK_SESSION_STORE": "memory",
+        "USPARK_DISEASE_CSV": os.path.join(APP_ROOT, "disease_sympts_prec_full.csv"),
+        "USPARK_KB_PATH": os.path.join(workdir, "kb"),
+        # Every request runs the full pipeline unless a run opts into caching
+        "USPARK_CACHE_SIZE": "0",
+        "HF_HUB_OFFLINE": "1",
+        "TRANSFORMERS_OFFLINE": "1",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    if APP_ROOT not in sys.path:
+        sys.path.insert(0, APP_ROOT)
+    # Checkpoint paths in the registry are relative to the working directory
+    os.chdir(workdir)
+    return workdir
+
+
+def write_random_checkpoints(seed=0):
+    import torch
+    from app.mediseg import registry
+
+    torch.manual_seed(seed)
+    written = []
+    for name, entry in registry._entries.items():
+        if os.path.exists(entry.path):
+            continue
+        os.makedirs(os.path.dirname(entry.path) or ".", exist_ok=True)
+        torch.save(entry.builder().state_dict(), entry.path)
+        written.append(name)
+    return written
+
+
+def random_ner_pipeline(words, size="base", seed=0):
+    # BERT token classifier with random weights; "base" has the depth/width of
+    # the production model's size class, "tiny" is for quick smoke runs
+    import torch
+    from transformers import BertConfig, BertForTokenClassification, BertTokenizerFast, pipeline
+
+    vocab_dir = tempfile.mkdtemp(prefix="uspark-ner-")
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(set(words))
+    with open(os.path.join(vocab_dir, "vocab.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(vocab) + "\n")
+    tokenizer = BertTokenizerFast(vocab_file=os.path.join(vocab_dir, "vocab.txt"))
+
+    labels = ["O", "B-SIGN_SYMPTOM", "I-SIGN_SYMPTOM"]
+    dims = {"base": (768, 12, 12, 3072), "tiny": (128, 2, 2, 512)}[size]
+    config = BertConfig(
+        vocab_size=len(vocab), hidden_size=dims[0], num_hidden_layers=dims[1],
+        num_attention_heads=dims[2], intermediate_size=dims[3], num_labels=len(labels),
+        id2label=dict(enumerate(labels)), label2id={label: i for i, label in enumerate(labels)},
+    )
+    torch.manual_seed(seed)
+    model = BertForTokenClassification(config).eval()
+    return pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy="simple")
+
+
+def install_random_ner(size="base", seed=0):
+    from app import chatbot
+
+    words = [word for symptom in chatbot.known_symptoms for word in symptom.replace("_", " ").split()]
+    words += [word.lower() for phrase in FILLER for word in phrase.split()] + ["and", "my", "a", "bit", "of"]
+    chatbot.ner_service.pipeline_factory = lambda: random_ner_pipeline(words, size, seed)
+
+
+def symptom_sets(count, seed=0, min_size=1, max_size=5):
+    from app.chatbot import known_symptoms
+
+    rng = np.random.RandomState(seed)
+    symptoms = sorted(known_symptoms)
+    return [list(rng.choice(symptoms, rng.randint(min_size, max_size + 1), replace=False)) for _ in range(count)]
+
+
+def symptom_sentences(count, seed=0):
+    # Distinct sentences so the NER cache does not turn the benchmark into a cache benchmark
+    rng = np.random.RandomState(seed)
+    sentences = []
+    for i, symptoms in enumerate(symptom_sets(count, seed, 1, 3)):
+        phrases = [symptom.replace("_", " ") for symptom in symptoms]
+        sentences.append(f"{FILLER[rng.randint(len(FILLER))]} {' and '.join(phrases)} (visit {i})")
+    return sentences
+
+
+def synthetic_image(size=256, seed=0):
+    # Smooth anatomy-like intensity field plus bright blobs and noise
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:size, 0:size] / float(size)
+    field = np.sin(x * rng.uniform(2, 8) + rng.uniform(0, 3)) + np.cos(y * rng.uniform(2, 8))
+    for _ in range(rng.randint(1, 4)):
+        cx, cy, r = rng.uniform(0.2, 0.8), rng.uniform(0.2, 0.8), rng.uniform(0.05, 0.2)
+        field += 2.0 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * r * r))
+    field = (field - field.min()) / (field.max() - field.min() + 1e-8) * 255
+    gray = np.clip(field + rng.normal(0, 12, field.shape), 0, 255).astype(np.uint8)
+    return Image.fromarray(np.stack([gray] * 3, axis=-1))
+
+
+def synthetic_png(size=256, seed=0) -> bytes:
+    buf = io.BytesIO()
+    synthetic_image(size, seed).save(buf, format="PNG")
+    return buf.getvalue()
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# -------------------------------
+# MEASUREMENT AND RESULT FILES
+# -------------------------------
+# Every benchmark reports latency percentiles (ms), throughput and the peak
+# RSS seen so far. Result files are plain JSON so runs from before and after a
+# change can be compared with `python -m benchmarks compare`.
+
+COMPARE_METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s", "peak_rss_mb")
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def children_peak_rss_mb():
+    # Summed high-water marks of live child processes (inference workers); Linux only
+    total = 0.0
+    if not os.path.isdir("/proc"):
+        return None
+    parent = str(os.getpid())
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            continue
+        if fields.get("PPid", "").strip() == parent and "VmHWM" in fields:
+            total += int(fields["VmHWM"].split()[0]) / 1024
+    return total
+
+
+def summarize(latencies, wall_seconds, errors=0, items_per_call=1):
+    ms = np.asarray(latencies, dtype=np.float64) * 1000
+    summary = {"count": len(ms), "errors": errors, "wall_seconds": wall_seconds}
+    if len(ms):
+        summary.update({
+            "mean_ms": float(ms.mean()),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max()),
+        })
+    summary["throughput_per_s"] = len(ms) * items_per_call / wall_seconds if wall_seconds > 0 else 0.0
+    summary["peak_rss_mb"] = peak_rss_mb()
+    return summary
+
+
+def time_calls(fn, inputs, warmup=1, items_per_call=1):
+    # Sequential calls, one per input; failures are counted, not raised
+    last_error = None
+    for x in inputs[:warmup]:
+        try:
+            fn(x)
+        except Exception as exc:
+            last_error = f"{type(exc).__name__}: {exc}"
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for x in inputs:
+        t0 = time.perf_counter()
+        try:
+            fn(x)
+        except Exception as exc:
+            errors += 1
+            last_error = f"{type(exc).__name__}: {exc}"
+            continue
+        latencies.append(time.perf_counter() - t0)
+    summary = summarize(latencies, time.perf_counter() - start, errors, items_per_call)
+    if last_error:
+        summary["last_error"] = last_error
+    return summary
+
+
+def run_concurrent(task, count, concurrency):
+    # task(i) -> (list of request latencies in seconds, error count); a task can
+    # issue several requests (e.g. a whole chat conversation)
+    latencies, errors, last_error = [], 0, None
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(task, i) for i in range(count)]:
+            try:
+                task_latencies, task_errors = future.result()
+            except Exception as exc:
+                errors += 1
+                last_error = f"{type(exc).__name__}: {exc}"
+                continue
+            latencies.extend(task_latencies)
+            errors += task_errors
+    summary = summarize(latencies, time.perf_counter() - start, errors)
+    summary["concurrency"] = concurrency
+    if last_error:
+        summary["last_error"] = last_error
+    return summary
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    info = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {key: value for key, value in sorted(os.environ.items()) if key.startswith("USPARK_")},
+    }
+    if "torch" in sys.modules:
+        torch = sys.modules["torch"]
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    return info
+
+
+def save_results(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(before, after):
+    # Rows of (benchmark, metric, before, after, relative change)
+    rows = []
+    for name in sorted(set(before["benchmarks"]) & set(after["benchmarks"])):
+        old, new = before["benchmarks"][name], after["benchmarks"][name]
+        for metric in COMPARE_METRICS:
+            if old.get(metric) is None or new.get(metric) is None:
+                continue
+            change = (new[metric] - old[metric]) / old[metric] if old[metric] else None
+            rows.append((name, metric, old[metric], new[metric], change))
+    return rows
@@ -0,0 +1,81 @@
+import time
+import threading
+import numpy as np
+
+from benchmarks.fixtures import symptom_sentences, synthetic_png
+from benchmarks.harness import run_concurrent
+
+# -------------------------------
+# END-TO-END LOAD SCENARIOS
+# -------------------------------
+# Drive the FastAPI app in-process through the ASGI test client from a pool of
+# concurrent virtual users. Latencies are per HTTP request.
+#   chat    /chat/start, a symptom message, a few follow-up answers, then the
+#           pain and medication questions until the session is persisted
+#   medseg  /medseg uploads of distinct synthetic scans
+#   mixed   chat conversations while /medseg uploads saturate the server; chat
+#           latency is reported separately, and shed imaging requests (429/503
+#           from admission control) are counted rather than treated as errors
+
+
+def timed(call):
+    start = time.perf_counter()
+    response = call()
+    return response, time.perf_counter() - start
+
+
+def chat_conversation(client, opening, followups=3, seed=0):
+    rng = np.random.RandomState(seed)
+    latencies, errors = [], 0
+    response, latency = timed(lambda: client.post("/chat/start"))
+    latencies.append(latency)
+    if response.status_code != 200:
+        return latencies, errors + 1
+    session_id = response.json()["session_id"]
+    # "no" ends symptom collection, then pain level, then medications
+    messages = [opening] + [rng.choice(["yes", "not really"]) for _ in range(followups)] + ["no", "4", "no"]
+    for message in messages:
+        response, latency = timed(lambda: client.post("/chat/message",
+                                                      json={"session_id": session_id, "message": message}))
+        latencies.append(latency)
+        if response.status_code != 200:
+            errors += 1
+            break
+    return latencies, errors
+
+
+def run_chat_load(client, conversations=32, concurrency=8, followups=3, seed=0):
+    openings = symptom_sentences(conversations, seed)
+    return run_concurrent(lambda i: chat_conversation(client, openings[i], followups, seed + i),
+                          conversations, concurrency)
+
+
+def run_medseg_load(client, requests=64, concurrency=8, image_size=256, output="composite", seed=0):
+    uploads = [synthetic_png(image_size, seed + i) for i in range(requests)]
+
+    def upload(i):
+        response, latency = timed(lambda: client.post(
+            f"/medseg?output={output}", files={"file": (f"scan-{i}.png", uploads[i], "image/png")}))
+        return [latency], int(response.status_code != 200)
+
+    return run_concurrent(upload, requests, concurrency)
+
+
+def run_mixed_load(client, conversations=32, requests=64, concurrency=8, followups=3, image_size=256, seed=0):
+    uploads = [synthetic_png(image_size, seed + i) for i in range(requests)]
+    shed = []
+
+    def upload(i):
+        response, latency = timed(lambda: client.post(
+            "/medseg?output=mask", files={"file": (f"scan-{i}.png", uploads[i], "image/png")}))
+        if response.status_code in (429, 503):
+            shed.append(i)
+            return [], 0
+        return [latency], int(response.status_code != 200)
+
+    imaging = {}
+    background = threading.Thread(target=lambda: imaging.update(run_concurrent(upload, requests, concurrency)))
+    background.start()
+    chat = run_chat_load(client, conversations, max(1, concurrency // 2), followups, seed)
+    background.join()
+    return {"chat": chat, "medseg": dict(imaging, shed=len(shed))}
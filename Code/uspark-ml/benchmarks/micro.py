@@ -0,0 +1,61 @@
+from benchmarks.fixtures import symptom_sets, symptom_sentences, synthetic_image
+from benchmarks.harness import time_calls
+
+# -------------------------------
+# MICRO-BENCHMARKS
+# -------------------------------
+# Single functions, called sequentially in-process:
+#   chat    find_closest_disease, an incremental diagnosis turn (confirm the
+#           symptoms, pick the next follow-up), extract_symptoms_ner
+#   medseg  classification (single image and batched), each process_* specialist
+#           end to end, and the rendering step alone in each render mode
+
+
+def run_chat_micro(iterations=50, seed=0):
+    from app import chatbot
+    from app.diagnosis import DiseaseScores
+
+    def diagnosis_turn(symptoms):
+        scores = DiseaseScores()
+        for symptom in symptoms:
+            chatbot.diagnosis.confirm(scores, symptom)
+        return chatbot.diagnosis.next_question(scores, set(symptoms))
+
+    return {
+        "find_closest_disease": time_calls(chatbot.find_closest_disease, symptom_sets(iterations, seed)),
+        "diagnosis_turn": time_calls(diagnosis_turn, symptom_sets(iterations, seed)),
+        "extract_symptoms_ner": time_calls(chatbot.extract_symptoms_ner, symptom_sentences(iterations, seed)),
+    }
+
+
+def run_medseg_micro(iterations=20, batch_size=8, image_size=256, seed=0):
+    from app import mediseg
+
+    images = [synthetic_image(image_size, seed + i) for i in range(iterations)]
+    batches = [[synthetic_image(image_size, seed + i * batch_size + j) for j in range(batch_size)]
+               for i in range(max(1, iterations // batch_size))]
+    results = {
+        "classify_medical_image_pil": time_calls(mediseg.classify_medical_image_pil, images),
+        f"classify_medical_images_pil[batch={batch_size}]": time_calls(
+            mediseg.classify_medical_images_pil, batches, items_per_call=batch_size),
+    }
+    for name in ("process_brain_tumor", "process_endoscopy", "process_pneumonia"):
+        results[name] = time_calls(getattr(mediseg, name), images)
+
+    # Rendering alone, on model outputs computed once up front
+    image = images[0]
+    renderers = {
+        "render_brain_tumor": lambda: (mediseg.render_brain_tumor, mediseg.segment_brain_tumor([image])[0]),
+        "render_endoscopy": lambda: (mediseg.render_endoscopy, mediseg.segment_endoscopy([image])[0]),
+        "render_pneumonia": lambda: (mediseg.render_pneumonia, mediseg.detect_pneumonia([image])[0]),
+    }
+    for name, prepare in renderers.items():
+        try:
+            render, output = prepare()
+        except Exception as exc:
+            results[name] = {"errors": 1, "last_error": f"{type(exc).__name__}: {exc}"}
+            continue
+        args = output if isinstance(output, tuple) else (output,)
+        for mode in ("fast", "report"):
+            results[f"{name}[{mode}]"] = time_calls(lambda _: render(image, *args, mode=mode), range(iterations))
+    return results
@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# The chatbot builds its knowledge base on import; keep the artifact out of the tree
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("USPARK_KB_PATH", os.path.join(tempfile.mkdtemp(prefix="uspark-kb-"), "kb"))
+os.environ.setdefault("USPARK_DISEASE_CSV", os.path.join(ROOT, "disease_sympts_prec_full.csv"))
@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+
+from app.admission import AdmissionController, AdmissionRejected, Lane
+
+
+def controller(slots=1, enabled=True, **queue_sizes):
+    lanes = [Lane("chat", 0, 1, queue_sizes.get("chat", 4), 0),
+             Lane("medseg", 1, 1, queue_sizes.get("medseg", 4), 0),
+             Lane("bulk", 2, 1, queue_sizes.get("bulk", 4), 0)]
+    return AdmissionController(lanes, slots=slots, enabled=enabled)
+
+
+def test_waiting_lanes_start_in_priority_order():
+    async def scenario():
+        admission = controller()
+        first = await admission.admit("bulk")
+        started = []
+
+        async def request(lane):
+            with await admission.admit(lane):
+                started.append(lane)
+
+        tasks = [asyncio.ensure_future(request(lane)) for lane in ("bulk", "medseg", "chat")]
+        await asyncio.sleep(0)
+        first.release()
+        await asyncio.gather(*tasks)
+        return started
+
+    assert asyncio.run(scenario()) == ["chat", "medseg", "bulk"]
+
+
+def test_full_queue_is_rejected_with_429():
+    async def scenario():
+        admission = controller(medseg=1)
+        ticket = await admission.admit("medseg")
+        waiting = asyncio.ensure_future(admission.admit("medseg"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.admit("medseg")
+        ticket.release()
+        (await waiting).release()
+        return rejected.value, admission.stats()["lanes"]["medseg"]
+
+    error, stats = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert error.retry_after >= 1
+    assert stats["rejected"] == 1
+    assert stats["admitted"] == 2
+
+
+def test_hopeless_deadline_is_refused_up_front():
+    async def scenario():
+        admission = controller()
+        admission.lanes["medseg"].service = 1.0
+        ticket = await admission.admit("medseg")
+        try:
+            await admission.admit("medseg", budget_ms=100)
+        finally:
+            ticket.release()
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(scenario())
+    assert rejected.value.status_code == 503
+
+
+def test_queued_request_is_shed_when_its_deadline_passes():
+    async def scenario():
+        admission = controller()
+        ticket = await admission.admit("chat")
+        try:
+            with pytest.raises(AdmissionRejected) as rejected:
+                await admission.admit("chat", budget_ms=20)
+        finally:
+            ticket.release()
+        return rejected.value, admission.stats()["lanes"]["chat"]
+
+    error, stats = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert stats["expired"] == 1
+    assert stats["queued"] == 0
+    assert stats["running"] == 0
+
+
+def test_ticket_wait_enforces_the_deadline():
+    async def scenario():
+        admission = controller()
+        with await admission.admit("medseg", budget_ms=20) as ticket:
+            await ticket.wait(asyncio.sleep(1))
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(scenario())
+    assert rejected.value.status_code == 503
+
+
+def test_disabled_admission_only_measures():
+    async def scenario():
+        admission = controller(enabled=False, chat=0)
+        tickets = [await admission.admit("chat", budget_ms=1) for _ in range(3)]
+        result = await tickets[0].wait(asyncio.sleep(0.01, result="done"))
+        running = admission.running
+        for ticket in tickets:
+            ticket.release()
+        return result, running, admission.running
+
+    assert asyncio.run(scenario()) == ("done", 3, 0)
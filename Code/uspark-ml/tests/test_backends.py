@@ -0,0 +1,69 @@
+import torch
+import torch.nn as nn
+import pytest
+from PIL import Image
+
+from app.backends import backend_for, supports_backend, calibration_inputs, optimize_model, parity_check
+from app.model_registry import ModelRegistry
+
+
+def linear_model():
+    return nn.Sequential(nn.Linear(4, 8), nn.ReLU(), nn.Linear(8, 3)).eval()
+
+
+def conv_model():
+    return nn.Sequential(nn.Conv2d(3, 2, 3, padding=1)).eval()
+
+
+def test_backend_override_per_model(monkeypatch):
+    monkeypatch.setenv("USPARK_BACKEND_BRAIN_TUMOR", "ONNX")
+    assert backend_for("brain_tumor") == "onnx"
+    monkeypatch.setenv("USPARK_BACKEND_BRAIN_TUMOR", "tensorrt")
+    with pytest.raises(ValueError, match="brain_tumor"):
+        backend_for("brain_tumor")
+
+
+def test_dynamic_quantization_needs_linear_layers():
+    assert supports_backend(linear_model(), "int8-dynamic")
+    assert not supports_backend(conv_model(), "int8-dynamic")
+    assert supports_backend(conv_model(), "torchscript")
+    with pytest.raises(ValueError, match="Linear layers"):
+        optimize_model(conv_model(), "int8-dynamic", torch.rand(1, 3, 8, 8))
+
+
+def test_optimized_models_match_eager():
+    model, example = linear_model(), torch.rand(2, 4)
+    inputs = [torch.rand(2, 4) for _ in range(3)]
+    for backend in ("torchscript", "int8-dynamic"):
+        parity = parity_check(model, optimize_model(model, backend, example), inputs)
+        assert parity["max_abs_diff"] < 0.1
+        assert parity["argmax_agreement"] > 0.5
+    assert parity_check(model, model, inputs) == {"max_abs_diff": 0.0, "mean_abs_diff": 0.0,
+                                                  "argmax_agreement": 1.0}
+
+
+def test_calibration_uses_images_from_the_directory(tmp_path):
+    for i in range(3):
+        Image.new("RGB", (40, 30), (i * 50, 0, 0)).save(tmp_path / f"{i}.png")
+    (tmp_path / "notes.txt").write_text("not an image")
+    batches = calibration_inputs((2, 3, 16, 16), torch.device("cpu"), directory=str(tmp_path), batches=4)
+    assert [tuple(batch.shape) for batch in batches] == [(2, 3, 16, 16), (1, 3, 16, 16)]
+
+
+def test_calibration_falls_back_to_random_inputs(tmp_path):
+    batches = calibration_inputs((2, 3, 16, 16), torch.device("cpu"), directory=str(tmp_path), batches=3)
+    assert len(batches) == 3 and all(tuple(batch.shape) == (2, 3, 16, 16) for batch in batches)
+
+
+def test_registry_serves_unsupported_models_eager(tmp_path, monkeypatch):
+    monkeypatch.setenv("USPARK_BACKEND_CONV", "int8-dynamic")
+    monkeypatch.setenv("USPARK_BACKEND_LINEAR", "int8-dynamic")
+    registry = ModelRegistry(torch.device("cpu"), hot_reload=False)
+    for name, build, shape in (("conv", conv_model, (3, 8, 8)), ("linear", linear_model, (4,))):
+        path = str(tmp_path / f"{name}.pth")
+        torch.save(build().state_dict(), path)
+        registry.register(name, build, path, input_shape=shape)
+    registry.load_all()
+    stats = registry.stats()
+    assert stats["conv"]["backend"] == "eager"
+    assert stats["linear"]["backend"] == "int8-dynamic"
@@ -0,0 +1,92 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from app.batching import MicroBatcher
+
+
+def test_concurrent_requests_share_a_batch():
+    sizes = []
+
+    def process(items):
+        sizes.append(len(items))
+        return [item * 2 for item in items]
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_batch_size=8, max_wait_ms=50)
+        return batcher, await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+
+    batcher, results = asyncio.run(scenario())
+    assert results == [0, 2, 4, 6, 8]
+    assert sizes == [5]
+    assert batcher.stats()["mean_batch_size"] == 5.0
+
+
+def test_batches_are_capped_at_max_size():
+    sizes = []
+
+    def process(items):
+        sizes.append(len(items))
+        return items
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_batch_size=2, max_wait_ms=50)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+
+    assert asyncio.run(scenario()) == [0, 1, 2, 3, 4]
+    assert sizes == [2, 2, 1]
+
+
+def test_failure_reaches_every_caller_in_the_batch():
+    def process(items):
+        raise ValueError("model failed")
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_wait_ms=20)
+        return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_callers_are_dropped_before_inference():
+    processed = []
+
+    def process(items):
+        processed.extend(items)
+        return items
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_wait_ms=50)
+        gone = asyncio.ensure_future(batcher.submit("gone"))
+        kept = asyncio.ensure_future(batcher.submit("kept"))
+        await asyncio.sleep(0.01)
+        gone.cancel()
+        return await kept
+
+    assert asyncio.run(scenario()) == "kept"
+    assert processed == ["kept"]
+
+
+@pytest.mark.parametrize("concurrency, expected", [(1, 1), (2, 2)])
+def test_concurrency_limits_batches_in_flight(concurrency, expected):
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def process(items):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return items
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_batch_size=1, max_wait_ms=0, concurrency=concurrency)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(4)))
+
+    assert asyncio.run(scenario()) == [0, 1, 2, 3]
+    assert peak[0] == expected
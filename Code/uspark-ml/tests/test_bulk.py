@@ -0,0 +1,34 @@
+import json
+
+from app.bulk import BulkOutput
+
+
+def read_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_resume_skips_recorded_images_and_drops_a_torn_line(tmp_path):
+    out = BulkOutput(str(tmp_path))
+    out.write("a.png", {"predicted_modality": "HeadCT", "mask": None}, None)
+    out.write("b.png", None, "cannot decode")
+    out.close()
+    results = tmp_path / "results.jsonl"
+    with open(results, "ab") as f:
+        f.write(b'{"id": "c.png", "status": "o')
+
+    resumed = BulkOutput(str(tmp_path))
+    assert resumed.done == {"a.png", "b.png"}
+    resumed.write("c.png", {"predicted_modality": "ChestCT", "mask_bytes": b"\x01\x02"}, None)
+    resumed.close()
+
+    records = read_records(results)
+    assert [record["id"] for record in records] == ["a.png", "b.png", "c.png"]
+    assert records[1] == {"id": "b.png", "status": "error", "error": "cannot decode"}
+    assert (tmp_path / records[2]["mask_file"]).read_bytes() == b"\x01\x02"
+
+
+def test_a_fresh_directory_has_nothing_done(tmp_path):
+    out = BulkOutput(str(tmp_path / "new"))
+    assert out.done == set()
+    out.close()
@@ -0,0 +1,99 @@
+import threading
+import pytest
+
+from app.database import (WriteBehindWriter, MemoryBackend, PartialWriteError, PersistenceConfigError,
+                          create_backend, SQLiteBackend)
+
+
+class FlakyBackend(MemoryBackend):
+    # Fails whole batches, then stores only some documents of a batch, then succeeds
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = list(failures)
+        self.attempts = []
+
+    def insert_many(self, collection, documents):
+        self.attempts.append([doc["_id"] for doc in documents])
+        failure = self.failures.pop(0) if self.failures else None
+        if failure == "all":
+            raise ConnectionError("connection reset")
+        if failure == "partial":
+            super().insert_many(collection, documents[1:])
+            raise PartialWriteError([0])
+        super().insert_many(collection, documents)
+
+
+def writer_for(backend, **kwargs):
+    return WriteBehindWriter(backend, batch_size=10, flush_interval=0.01, **kwargs)
+
+
+def test_retries_store_each_document_and_blob_once(monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    backend = FlakyBackend(["all", "partial"])
+    writer = writer_for(backend)
+    for i in range(3):
+        writer.enqueue("medseg", {"n": i, "mask_bytes": bytes([i]) * 10})
+    writer.flush()
+    writer.close()
+
+    stored = backend.collections["medseg"]
+    assert sorted(doc["n"] for doc in stored) == [0, 1, 2]
+    assert len({doc["_id"] for doc in stored}) == 3
+    assert len(backend.blobs) == 3
+    # Same _ids on every attempt; only the document that failed is sent again
+    assert backend.attempts[0] == backend.attempts[1]
+    assert backend.attempts[2] == backend.attempts[1][:1]
+    assert writer.stats()["retries"] == 2 and writer.stats()["failed"] == 0
+
+
+def test_a_batch_is_given_up_after_the_last_retry(monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    backend = FlakyBackend(["all"] * 10)
+    writer = writer_for(backend, max_retries=2)
+    writer.enqueue("chatbot", {"session_id": "s"})
+    writer.flush()
+    writer.close()
+    assert len(backend.attempts) == 3
+    assert writer.stats()["failed"] == 1 and writer.stats()["written"] == 0
+
+
+def test_full_queue_drops_instead_of_blocking():
+    release = threading.Event()
+
+    class BlockedBackend(MemoryBackend):
+        def insert_many(self, collection, documents):
+            release.wait(5)
+            super().insert_many(collection, documents)
+
+    writer = WriteBehindWriter(BlockedBackend(), queue_size=1, batch_size=1, flush_interval=0.01,
+                               backpressure="drop")
+    accepted = [writer.enqueue("medseg", {"n": i}) for i in range(20)]
+    release.set()
+    writer.flush()
+    writer.close()
+    assert not all(accepted)
+    assert writer.stats()["dropped"] == accepted.count(False)
+
+
+def test_large_strings_become_blobs():
+    backend = MemoryBackend()
+    writer = writer_for(backend)
+    writer.enqueue("medseg", {"image": "QUJD" * 20000, "small": "abc"})
+    writer.flush()
+    writer.close()
+    doc = backend.collections["medseg"][0]
+    assert doc["small"] == "abc"
+    assert doc["image"]["blob_encoding"] == "base64"
+    assert backend.blobs[doc["image"]["blob_id"]][0] == b"ABC" * 20000
+
+
+def test_mongo_without_uri_fails_when_the_backend_is_created():
+    with pytest.raises(PersistenceConfigError):
+        create_backend("mongo", uri=None)
+
+
+def test_local_backends_need_no_configuration(tmp_path):
+    backend = create_backend("sqlite", str(tmp_path / "records.db"))
+    assert isinstance(backend, SQLiteBackend)
+    backend.insert_many("chatbot", [{"_id": "a"}])
+    assert backend.conn.execute("SELECT COUNT(*) FROM records").fetchone() == (1,)
@@ -0,0 +1,60 @@
+import pytest
+
+from app import chatbot
+
+
+SYMPTOM_SETS = [
+    ["itching", "skin_rash"],
+    ["high_fever", "cough", "fatigue"],
+    ["vomiting", "abdominal_pain", "yellowish_skin"],
+    ["headache", "chest_pain", "dizziness"],
+]
+
+
+def known(symptoms):
+    return [symptom for symptom in symptoms if symptom in chatbot.known_symptoms]
+
+
+@pytest.mark.parametrize("symptoms", SYMPTOM_SETS)
+def test_incremental_scores_rank_like_the_index(symptoms):
+    symptoms = known(symptoms)
+    assert symptoms
+    scores = chatbot.diagnosis.rebuild(set(symptoms), set())
+    expected = chatbot.find_closest_diseases(symptoms, k=5)
+    actual = [(chatbot.disease_list[doc], score) for doc, score in chatbot.diagnosis.top(scores, 5)]
+    assert [name for name, _ in actual] == [name for name, _ in expected]
+    assert chatbot.disease_list[chatbot.diagnosis.top(scores, 1)[0][0]] == chatbot.find_closest_disease(symptoms)
+
+
+def test_confirming_one_symptom_at_a_time_matches_a_rebuild():
+    symptoms = known(SYMPTOM_SETS[1])
+    scores = chatbot.diagnosis.rebuild(set(), set())
+    for symptom in symptoms:
+        chatbot.diagnosis.confirm(scores, symptom)
+    rebuilt = chatbot.diagnosis.rebuild(set(symptoms), set())
+    assert chatbot.diagnosis.top(scores, 5) == pytest.approx(chatbot.diagnosis.top(rebuilt, 5))
+
+
+def test_denied_symptoms_lower_the_diseases_listing_them():
+    symptoms = set(known(SYMPTOM_SETS[0]))
+    best = chatbot.diagnosis.top(chatbot.diagnosis.rebuild(symptoms, set()), 1)[0][0]
+    denied = next(symptom for symptom in chatbot.kb.symptoms_for(best) if symptom not in symptoms)
+    scores = chatbot.diagnosis.rebuild(symptoms, {denied})
+    ranked = dict(chatbot.diagnosis.top(scores, len(chatbot.disease_list)))
+    undenied = dict(chatbot.diagnosis.top(chatbot.diagnosis.rebuild(symptoms, set()), len(chatbot.disease_list)))
+    assert ranked[best] == pytest.approx(undenied[best] * chatbot.diagnosis.denied_weight)
+
+
+def test_no_symptoms_means_no_diagnosis():
+    scores = chatbot.diagnosis.rebuild(set(), set())
+    assert chatbot.diagnosis.top(scores, 1) == []
+    assert chatbot.find_closest_disease([]) is None
+    assert chatbot.diagnosis.next_question(scores, set()) is None
+
+
+def test_only_knowledge_base_symptoms_are_cached():
+    known_symptom = chatbot.kb.symptoms[0]
+    chatbot.diagnosis.symptom_terms(known_symptom)
+    chatbot.diagnosis.symptom_terms("a phrase nobody has typed before")
+    assert known_symptom in chatbot.diagnosis._terms
+    assert "a phrase nobody has typed before" not in chatbot.diagnosis._terms
@@ -0,0 +1,41 @@
+import gc
+import weakref
+import torch
+import torchvision.models as models
+
+from app import explain
+from app.explain import CAMEngine, get_cam_engine
+
+
+def small_resnet():
+    model = models.resnet18(num_classes=2)
+    model.eval()
+    return model
+
+
+def test_heatmaps_cover_the_input_in_both_modes():
+    model = small_resnet()
+    engine = CAMEngine(model)
+    inputs = torch.rand(2, 3, 64, 64)
+    for mode in ("gradcam", "cam"):
+        cams, logits = engine.generate(inputs, mode)
+        assert logits.shape == (2, 2)
+        assert len(cams) == 2 and cams[0].shape == (64, 64)
+        assert all(0.0 <= cam.min() and cam.max() <= 1.0 for cam in cams)
+
+
+def test_parameters_never_collect_gradients():
+    model = small_resnet()
+    CAMEngine(model).generate(torch.rand(1, 3, 64, 64), "gradcam")
+    assert all(parameter.grad is None and not parameter.requires_grad for parameter in model.parameters())
+
+
+def test_engines_are_shared_per_model_and_released_with_it():
+    model = small_resnet()
+    assert get_cam_engine(model) is get_cam_engine(model)
+    reference = weakref.ref(model)
+    engines = len(explain._engines)
+    del model
+    gc.collect()
+    assert reference() is None
+    assert len(explain._engines) == engines - 1
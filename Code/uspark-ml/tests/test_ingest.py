@@ -0,0 +1,91 @@
+import io
+
+import pytest
+from fastapi import FastAPI, UploadFile, File
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import app.ingest as ingest
+from app.ingest import UploadLimitMiddleware, UploadRejected, decode_image
+
+
+def encoded(image, fmt):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.fixture
+def client():
+    api = FastAPI()
+
+    @api.post("/medseg")
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    @api.post("/chat")
+    async def chat(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    api.add_middleware(UploadLimitMiddleware, limits={"/medseg": 1000})
+    return TestClient(api)
+
+
+def test_upload_under_the_limit_passes(client):
+    response = client.post("/medseg", files={"file": ("a.png", b"x" * 100)})
+    assert response.status_code == 200 and response.json() == {"size": 100}
+
+
+def test_declared_length_over_the_limit_is_rejected_before_reading(client):
+    response = client.post("/medseg", files={"file": ("a.png", b"x" * 2000)})
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Upload exceeds 1000 bytes"}
+
+
+def test_streamed_body_is_cut_off_at_the_limit(client):
+    def chunks():
+        # Multipart body sent without a Content-Length
+        yield b'--b\r\nContent-Disposition: form-data; name="file"; filename="a.png"\r\n\r\n'
+        for _ in range(10):
+            yield b"x" * 500
+        yield b"\r\n--b--\r\n"
+
+    response = client.post("/medseg", content=chunks(),
+                           headers={"content-type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+
+
+def test_routes_without_a_limit_are_untouched(client):
+    response = client.post("/chat", files={"file": ("a.png", b"x" * 2000)})
+    assert response.status_code == 200
+
+
+def test_unknown_bytes_are_rejected_with_415():
+    with pytest.raises(UploadRejected) as rejected:
+        decode_image(io.BytesIO(b"%PDF-1.4 not an image"))
+    assert rejected.value.status_code == 415
+
+
+def test_pixel_limit_is_checked_before_decoding(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_PIXELS", 64 * 64)
+    with pytest.raises(UploadRejected) as rejected:
+        decode_image(encoded(Image.new("RGB", (65, 64)), "PNG"))
+    assert rejected.value.status_code == 413
+
+
+def test_jpeg_is_decoded_at_a_reduced_scale():
+    image = decode_image(encoded(Image.new("RGB", (2048, 1024), (200, 10, 10)), "JPEG"), target=256)
+    assert image.mode == "RGB"
+    assert image.size == (512, 256)
+
+
+def test_other_formats_are_reduced_by_an_integer_factor():
+    image = decode_image(encoded(Image.new("L", (1000, 700), 90), "PNG"), target=256)
+    assert image.mode == "RGB" and image.size == (500, 350)
+    assert image.getpixel((0, 0)) == (90, 90, 90)
+
+
+def test_full_resolution_when_there_is_no_target():
+    image = decode_image(encoded(Image.new("RGB", (1000, 700)), "PNG"), target=0)
+    assert image.size == (1000, 700)
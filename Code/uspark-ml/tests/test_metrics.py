@@ -0,0 +1,70 @@
+import pytest
+
+from app.metrics import Counter, Gauge, Histogram, REGISTRY, render_metrics, capture, muted
+
+
+@pytest.fixture
+def metrics():
+    created = []
+
+    def make(kind, name, *args, **kwargs):
+        metric = kind(name, *args, **kwargs)
+        created.append(name)
+        return metric
+
+    yield make
+    for name in created:
+        REGISTRY.pop(name, None)
+
+
+def test_counter_text_format(metrics):
+    counter = metrics(Counter, "test_requests_total", "Requests", ("route",))
+    counter.inc(route="/chat")
+    counter.inc(2, route='/say "hi"\n')
+    assert counter.render() == [
+        "# HELP test_requests_total Requests",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{route="/chat"} 1',
+        'test_requests_total{route="/say \\"hi\\"\\n"} 2',
+    ]
+
+
+def test_gauge_keeps_the_last_value(metrics):
+    gauge = metrics(Gauge, "test_queued", "Queued")
+    gauge.set(5)
+    gauge.set(2)
+    assert gauge.render()[-1] == "test_queued 2"
+
+
+def test_histogram_buckets_are_cumulative(metrics):
+    histogram = metrics(Histogram, "test_seconds", "Latency", ("lane",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, lane="chat")
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{lane="chat",le="0.1"} 1',
+        'test_seconds_bucket{lane="chat",le="1"} 3',
+        'test_seconds_bucket{lane="chat",le="+Inf"} 4',
+        'test_seconds_sum{lane="chat"} 4.050000',
+        'test_seconds_count{lane="chat"} 4',
+    ]
+
+
+def test_exposition_includes_every_metric(metrics):
+    metrics(Counter, "test_exposed_total", "Exposed").inc()
+    text = render_metrics()
+    assert text.endswith("\n")
+    assert "# TYPE test_exposed_total counter\ntest_exposed_total 1\n" in text
+    assert "# TYPE uspark_admission_queued gauge" in text
+
+
+def test_muted_records_nothing(metrics):
+    counter = metrics(Counter, "test_muted_total", "Muted")
+    histogram = metrics(Histogram, "test_muted_seconds", "Muted", buckets=(1.0,))
+    with capture() as observations:
+        with muted():
+            counter.inc()
+            histogram.observe(0.5)
+        counter.inc()
+    assert counter.render()[-1] == "test_muted_total 1"
+    assert histogram.render()[2:] == []
+    assert len(observations) == 1
@@ -0,0 +1,86 @@
+import os
+
+import torch
+import torch.nn as nn
+
+from app.model_registry import ModelRegistry
+
+
+def build():
+    return nn.Linear(3, 2)
+
+
+def write_checkpoint(path, value, mtime):
+    model = build()
+    with torch.no_grad():
+        model.weight.fill_(value)
+        model.bias.zero_()
+    torch.save(model.state_dict(), path)
+    os.utime(path, (mtime, mtime))
+
+
+def make_registry(tmp_path, **kwargs):
+    path = str(tmp_path / "linear.pth")
+    write_checkpoint(path, 1.0, 1_000_000)
+    registry = ModelRegistry(torch.device("cpu"), **kwargs)
+    registry.register("linear", build, path, input_shape=(3,))
+    return registry, path
+
+
+def test_model_is_loaded_once_and_shared(tmp_path):
+    registry, _ = make_registry(tmp_path, hot_reload=False)
+    model = registry.get("linear")
+    assert registry.get("linear") is model
+    assert not model.training
+    assert float(model.weight[0, 0]) == 1.0
+    stats = registry.stats()["linear"]
+    assert stats["loaded"] and stats["loads"] == 1 and stats["weights"] == "mmap"
+
+
+def test_changed_checkpoint_is_reloaded(tmp_path):
+    registry, path = make_registry(tmp_path, hot_reload=True, reload_interval=0)
+    first = registry.get("linear")
+    write_checkpoint(path, 2.0, 2_000_000)
+    second = registry.get("linear")
+    assert second is not first
+    assert float(second.weight[0, 0]) == 2.0
+    assert registry.stats()["linear"]["loads"] == 2
+
+
+def test_reload_check_waits_for_the_interval(tmp_path):
+    registry, path = make_registry(tmp_path, hot_reload=True, reload_interval=3600)
+    first = registry.get("linear")
+    write_checkpoint(path, 2.0, 2_000_000)
+    assert registry.get("linear") is first
+
+
+def test_without_hot_reload_the_loaded_model_is_kept(tmp_path):
+    registry, path = make_registry(tmp_path, hot_reload=False, reload_interval=0)
+    first = registry.get("linear")
+    write_checkpoint(path, 2.0, 2_000_000)
+    assert registry.get("linear") is first
+
+
+def test_missing_checkpoint_keeps_serving_the_loaded_copy(tmp_path):
+    registry, path = make_registry(tmp_path, hot_reload=True, reload_interval=0)
+    first = registry.get("linear")
+    os.remove(path)
+    assert registry.get("linear") is first
+
+
+def test_versions_follow_the_checkpoint(tmp_path):
+    registry, path = make_registry(tmp_path, hot_reload=True, reload_interval=0)
+    before = registry.versions()["linear"]
+    assert before.endswith(":eager")
+    write_checkpoint(path, 2.0, 2_000_000)
+    assert registry.versions()["linear"] != before
+
+
+def test_other_checkpoint_gets_its_own_slot(tmp_path):
+    registry, _ = make_registry(tmp_path, hot_reload=False)
+    other = str(tmp_path / "other.pth")
+    write_checkpoint(other, 3.0, 1_000_000)
+    default, custom = registry.get("linear"), registry.get("linear", other)
+    assert custom is not default
+    assert float(custom.weight[0, 0]) == 3.0
+    assert f"linear@{other}" in registry.stats()
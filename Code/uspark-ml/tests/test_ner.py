@@ -0,0 +1,93 @@
+import time
+import concurrent.futures
+
+import pytest
+
+from app.ner import NERService, SymptomMatcher, normalize_text
+
+SYMPTOMS = ["headache", "skin_rash", "high_fever", "fever"]
+
+
+class FakePipeline:
+    # Mimics the transformers pipeline: one entity list per text, unwrapped for a single text
+    def __init__(self, delay=0.0, extra=False):
+        self.delay = delay
+        self.extra = extra
+        self.calls = []
+
+    def __call__(self, texts, batch_size=1):
+        self.calls.append(list(texts))
+        time.sleep(self.delay)
+        outputs = [[{"word": word, "entity_group": "SIGN_SYMPTOM"} for word in text.lower().split()
+                    if word.startswith("ache")] for text in texts]
+        if self.extra:
+            return outputs + [[]]
+        return outputs[0] if len(texts) == 1 else outputs
+
+
+def service(pipeline, **kwargs):
+    return NERService(lambda: pipeline, SYMPTOMS, **kwargs)
+
+
+def test_matcher_matches_whole_words():
+    matcher = SymptomMatcher(SYMPTOMS)
+    assert matcher.match("i have a skin rash and high fever") == ({"skin_rash", "high_fever", "fever"}, True)
+    assert matcher.match("feverish headaches") == (set(), False)
+    found, confident = matcher.match("headache and a sore knee")
+    assert found == {"headache"} and not confident
+
+
+def test_dictionary_fast_path_skips_the_model():
+    pipeline = FakePipeline()
+    ner = service(pipeline)
+    assert ner.extract("I have a  Headache") == ["headache"]
+    assert pipeline.calls == []
+    assert ner.stats()["dictionary_hits"] == 1
+
+
+def test_uncertain_messages_use_the_model():
+    pipeline = FakePipeline()
+    ner = service(pipeline, batch_window_ms=0)
+    assert ner.extract("headache and acheknee") == ["acheknee", "headache"]
+    assert pipeline.calls == [["headache and acheknee"]]
+
+
+def test_cache_is_keyed_on_normalized_text_and_bounded():
+    pipeline = FakePipeline()
+    ner = service(pipeline, cache_size=2, batch_window_ms=0)
+    ner.extract("acheone here")
+    ner.extract("  ACHEONE   here ")
+    assert len(pipeline.calls) == 1 and ner.stats()["cache_hits"] == 1
+    ner.extract("achetwo here")
+    ner.extract("achethree here")
+    assert ner.stats()["cache_entries"] == 2
+    ner.extract("acheone here")
+    assert len(pipeline.calls) == 4
+    assert normalize_text("acheone here") in ner._cache
+
+
+def test_concurrent_messages_share_a_model_call():
+    pipeline = FakePipeline(delay=0.05)
+    ner = service(pipeline, cache_size=0, batch_size=8, batch_window_ms=50)
+    texts = [f"acheitem{i} today maybe" for i in range(4)]
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(ner.extract, texts))
+    assert results == [[f"acheitem{i}"] for i in range(4)]
+    assert ner.stats()["model_calls"] == 4
+    assert ner.stats()["model_batches"] < 4
+
+
+def test_result_count_mismatch_fails_the_batch():
+    pipeline = FakePipeline(extra=True)
+    ner = service(pipeline, batch_window_ms=0)
+    with pytest.raises(RuntimeError, match="2 results for 1 texts"):
+        ner.extract("acheitem maybe")
+    # The batcher thread survives the failure
+    pipeline.extra = False
+    assert ner.extract("acheagain maybe") == ["acheagain"]
+
+
+def test_slow_model_times_out():
+    ner = service(FakePipeline(delay=0.5), batch_window_ms=0, timeout=0.05)
+    with pytest.raises(concurrent.futures.TimeoutError):
+        ner.extract("acheslow maybe")
@@ -0,0 +1,64 @@
+import json
+import numpy as np
+import pytest
+
+from app.payloads import (rle_encode, rle_decode, mask_bbox, binary_mask_payload, label_mask_payload, cam_payload,
+                          payload_to_json, payload_to_bytes, CAM_GRID, CAM_SCALE)
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (7, 13), (256, 256)])
+def test_rle_round_trip(shape):
+    mask = np.random.default_rng(0).integers(0, 4, size=shape, dtype=np.uint8)
+    mask[: shape[0] // 2] = 0
+    assert np.array_equal(rle_decode(rle_encode(mask), shape), mask)
+
+
+def test_rle_of_an_empty_mask():
+    assert rle_encode(np.zeros((0, 0), dtype=np.uint8)) == {"values": [], "counts": []}
+
+
+def test_label_mask_json_round_trip():
+    preds = np.zeros((64, 48), dtype=np.int64)
+    preds[10:20, 5:9] = 3
+    meta = payload_to_json(label_mask_payload(preds))
+    assert meta["encoding"] == "rle" and meta["dtype"] == "uint8"
+    assert meta["bbox"] == [5, 10, 4, 10]
+    assert np.array_equal(rle_decode(meta["rle"], meta["shape"]), preds.astype(np.uint8))
+
+
+@pytest.mark.parametrize("shape", [(8, 8), (5, 11), (256, 256)])
+def test_packbits_round_trip(shape):
+    mask = np.random.default_rng(1).random(shape) > 0.5
+    meta, data = payload_to_bytes(binary_mask_payload(mask))
+    assert meta["encoding"] == "packbits"
+    size = int(np.prod(meta["shape"]))
+    decoded = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=size).reshape(meta["shape"])
+    assert np.array_equal(decoded, mask.astype(np.uint8))
+
+
+def test_bbox_of_an_empty_mask():
+    assert mask_bbox(np.zeros((4, 4), dtype=np.uint8)) is None
+
+
+def test_json_cam_is_a_small_uint8_grid():
+    cam = np.random.default_rng(2).random((224, 224)).astype(np.float32)
+    meta = payload_to_json(cam_payload(cam, "Pneumonia", (1, 2, 3, 4)))
+    assert meta["shape"] == [CAM_GRID, CAM_GRID] and meta["dtype"] == "uint8"
+    assert meta["source_shape"] == [224, 224]
+    assert len(json.dumps(meta)) < 8 * CAM_GRID * CAM_GRID
+
+
+def test_downsampled_cam_states_its_scale():
+    cam = np.full((224, 224), 0.5, dtype=np.float32)
+    meta, data = payload_to_bytes(cam_payload(cam, "Normal", None), full_resolution=False)
+    assert meta["dtype"] == "uint8" and len(data) == CAM_GRID * CAM_GRID
+    assert data[0] * meta["scale"] == pytest.approx(0.5, abs=CAM_SCALE)
+
+
+def test_full_resolution_cam_is_binary_float16():
+    cam = np.random.default_rng(3).random((224, 224)).astype(np.float32)
+    meta, data = payload_to_bytes(cam_payload(cam, "Pneumonia", None), full_resolution=True)
+    assert meta["dtype"] == "float16" and meta["shape"] == [224, 224]
+    assert "scale" not in meta
+    decoded = np.frombuffer(data, dtype=np.float16).reshape(meta["shape"])
+    assert np.abs(decoded - cam).max() < 1e-3
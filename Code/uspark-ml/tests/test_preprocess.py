@@ -0,0 +1,54 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torchvision import transforms
+
+from app.preprocess import ImagePyramid, as_pyramid, batch_tensor
+
+
+def noisy_image(width=640, height=480, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def test_classifier_input_matches_the_original_tensor_resize():
+    image = noisy_image()
+    expected = transforms.Resize((224, 224), antialias=False)(transforms.ToTensor()(image))
+    actual = batch_tensor([image], 224, antialias=False)[0]
+    assert torch.allclose(actual, expected.clamp(0, 1), atol=1e-6)
+
+
+def smooth_image(width=640, height=480):
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1)
+    return Image.fromarray(pixels.astype(np.uint8))
+
+
+def test_antialiased_levels_match_a_direct_resize():
+    image = smooth_image()
+    pyramid = ImagePyramid(image)
+    base = torch.from_numpy(np.asarray(image).copy()).permute(2, 0, 1).float() / 255.0
+    for size in (256, 224):
+        expected = F.interpolate(base.unsqueeze(0), size=(size, size), mode="bilinear", align_corners=False,
+                                 antialias=True).squeeze(0).clamp(0, 1)
+        # 224 is resampled from the cached 256 level, which stays within an intensity level
+        assert (pyramid.tensor(size) - expected).abs().max() < 1.5 / 255
+
+
+def test_levels_and_arrays_are_cached_per_pyramid():
+    pyramid = ImagePyramid(noisy_image())
+    assert pyramid.tensor(256) is pyramid.tensor((256, 256))
+    assert pyramid.tensor(224, antialias=False) is not pyramid.tensor(224)
+    array = pyramid.array(256)
+    assert array is pyramid.array(256)
+    assert array.shape == (256, 256, 3) and array.dtype == np.uint8
+    assert as_pyramid(pyramid) is pyramid
+
+
+def test_non_rgb_and_huge_images_are_normalized():
+    gray = ImagePyramid(Image.new("L", (4000, 100), 200))
+    assert gray.image.mode == "RGB"
+    assert gray.size == (4000, 100)
+    assert max(gray.tensor((100, 100)).shape) == 100
+    assert torch.allclose(gray.tensor(32), torch.full((3, 32, 32), 200 / 255.0), atol=1e-5)
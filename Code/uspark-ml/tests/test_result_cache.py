@@ -0,0 +1,41 @@
+import os
+from PIL import Image
+
+from app.result_cache import ResultCache, image_cache_key
+
+
+def test_disk_tier_round_trips_bytes_without_pickle(tmp_path):
+    cache = ResultCache(max_entries=1, disk_dir=str(tmp_path), disk_max_mb=1)
+    result = {"predicted_modality": "Endoscopy", "mask": {"shape": [2, 2]}, "mask_bytes": b"\x00\xff"}
+    cache.put("key", result)
+    assert sorted(os.listdir(tmp_path)) == ["key.json", "key.mask_bytes.bin"]
+
+    reopened = ResultCache(max_entries=1, disk_dir=str(tmp_path), disk_max_mb=1)
+    assert reopened.get("key") == result
+
+
+def test_entry_without_its_sidecar_is_a_miss(tmp_path):
+    cache = ResultCache(max_entries=1, disk_dir=str(tmp_path), disk_max_mb=1)
+    cache.put("key", {"mask_bytes": b"data"})
+    os.remove(tmp_path / "key.mask_bytes.bin")
+    assert ResultCache(max_entries=1, disk_dir=str(tmp_path), disk_max_mb=1).get("key") is None
+
+
+def test_disk_tier_evicts_oldest_entries_first(tmp_path):
+    cache = ResultCache(max_entries=1, disk_dir=str(tmp_path), disk_max_mb=0.01)
+    for i in range(10):
+        cache.put(f"k{i}", {"mask_bytes": b"x" * 2000, "index": i})
+    remaining = {name.split(".")[0] for name in os.listdir(tmp_path)}
+    assert "k9" in remaining and "k0" not in remaining
+    assert cache.disk.size_bytes() <= 0.01 * 2 ** 20
+
+
+def test_key_changes_with_versions_and_variant():
+    image = Image.new("RGB", (8, 8), (10, 20, 30))
+    base = image_cache_key(image, {"classifier": "1.0:eager", "cam_mode": "gradcam"}, "mask")
+    assert base == image_cache_key(image.copy(), {"cam_mode": "gradcam", "classifier": "1.0:eager"}, "mask")
+    assert base != image_cache_key(image, {"classifier": "1.0:onnx", "cam_mode": "gradcam"}, "mask")
+    assert base != image_cache_key(image, {"classifier": "1.0:eager", "cam_mode": "cam"}, "mask")
+    assert base != image_cache_key(image, {"classifier": "1.0:eager", "cam_mode": "gradcam"}, "binary")
+    assert base != image_cache_key(Image.new("RGB", (8, 8), (10, 20, 31)),
+                                   {"classifier": "1.0:eager", "cam_mode": "gradcam"}, "mask")
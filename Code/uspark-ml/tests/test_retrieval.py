@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.metrics.pairwise import linear_kernel
+
+from app.retrieval import SparseIndex
+
+DOCUMENTS = [
+    "itching skin_rash nodal_skin_eruptions",
+    "skin_rash chills joint_pain vomiting",
+    "continuous_sneezing chills fatigue cough high_fever",
+    "cough high_fever breathlessness sweating",
+    "vomiting abdominal_pain yellowish_skin nausea",
+    "headache chest_pain dizziness",
+    "fatigue weight_loss restlessness lethargy",
+]
+
+QUERIES = ["skin_rash chills", "cough high_fever fatigue", "vomiting nausea nausea", "headache", "unknown_term"]
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    counter = CountVectorizer()
+    index = SparseIndex.build(counter.fit_transform(DOCUMENTS), scoring="cosine")
+    tfidf = TfidfVectorizer(vocabulary=counter.vocabulary_)
+    return counter, index, tfidf, tfidf.fit_transform(DOCUMENTS)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_cosine_scores_match_sklearn(fitted, query):
+    counter, index, tfidf, documents = fitted
+    expected = linear_kernel(tfidf.transform([query]), documents).ravel()
+    results = index.search_vector(counter.transform([query]), k=len(DOCUMENTS))
+    # Only documents sharing a term are returned, best first, lowest id on ties
+    matching = [doc for doc in np.lexsort((np.arange(len(DOCUMENTS)), -expected)) if expected[doc] > 0]
+    assert [doc for doc, _ in results] == matching
+    for doc, score in results:
+        assert score == pytest.approx(expected[doc], rel=1e-5)
+
+
+def test_bm25_prefers_documents_with_rarer_terms():
+    counter = CountVectorizer()
+    index = SparseIndex.build(counter.fit_transform(DOCUMENTS), scoring="bm25")
+    results = index.search_vector(counter.transform(["chills nodal_skin_eruptions"]), k=3)
+    assert results[0][0] == 0
+    assert {doc for doc, _ in results} == {0, 1, 2}
+
+
+def test_unknown_scoring_is_rejected():
+    with pytest.raises(ValueError):
+        SparseIndex.build(CountVectorizer().fit_transform(DOCUMENTS), scoring="dot")
@@ -0,0 +1,107 @@
+import types
+import threading
+
+import pytest
+
+import app.sessions as sessions
+from app.sessions import MemorySessionStore, SQLiteSessionStore, create_session_store
+
+
+class Note:
+    def __init__(self, text):
+        self.text = text
+
+    def to_state(self):
+        return {"text": self.text}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["text"])
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions, "time", types.SimpleNamespace(monotonic=lambda: now[0], time=lambda: now[0]))
+    return now
+
+
+def test_memory_store_keeps_live_objects(clock):
+    store = MemorySessionStore(ttl=10, max_size=10)
+    note = Note("a")
+    store.put("s1", note)
+    assert store.get("s1") is note
+    store.delete("s1")
+    assert store.get("s1") is None
+
+
+def test_memory_store_expiry_slides_on_access(clock):
+    store = MemorySessionStore(ttl=10, max_size=10)
+    store.put("s1", Note("a"))
+    store.put("s2", Note("b"))
+    clock[0] += 8
+    assert store.get("s1") is not None
+    clock[0] += 8
+    assert store.get("s2") is None
+    assert store.get("s1") is not None
+    assert store.stats()["expired"] == 1
+
+
+def test_memory_store_evicts_least_recently_used(clock):
+    store = MemorySessionStore(ttl=10, max_size=2)
+    for session_id in ("s1", "s2"):
+        store.put(session_id, Note(session_id))
+    store.get("s1")
+    store.put("s3", Note("s3"))
+    assert store.get("s2") is None
+    assert store.get("s1") is not None and store.get("s3") is not None
+    assert store.stats() == {"backend": "memory", "sessions": 2, "expired": 0, "evicted": 1}
+
+
+def test_sqlite_store_round_trips_state(tmp_path, clock):
+    store = SQLiteSessionStore(Note, path=str(tmp_path / "sessions.db"), ttl=10)
+    store.put("s1", Note("hello"))
+    # A second store on the same file stands in for another uvicorn worker
+    other = SQLiteSessionStore(Note, path=str(tmp_path / "sessions.db"), ttl=10)
+    assert other.get("s1").text == "hello"
+    other.delete("s1")
+    assert store.get("s1") is None
+
+
+def test_sqlite_store_is_usable_from_other_threads(tmp_path, clock):
+    store = SQLiteSessionStore(Note, path=str(tmp_path / "sessions.db"), ttl=10)
+    thread = threading.Thread(target=store.put, args=("s1", Note("from a thread")))
+    thread.start()
+    thread.join()
+    assert store.get("s1").text == "from a thread"
+
+
+def test_sqlite_store_expires_and_purges(tmp_path, clock):
+    store = SQLiteSessionStore(Note, path=str(tmp_path / "sessions.db"), ttl=10, max_size=1, purge_every=1000)
+    for i in range(4):
+        store.put(f"s{i}", Note(str(i)))
+        clock[0] += 1
+    clock[0] += 7
+    assert store.get("s0") is None and store.get("s3") is not None
+    store.purge()
+    rows = store._connection().execute("SELECT id FROM sessions ORDER BY id").fetchall()
+    assert [row[0] for row in rows] == ["s3"]
+    assert store.stats()["sessions"] == 1
+
+
+def test_chatbot_session_survives_the_sqlite_store(tmp_path):
+    from app.chatbot import ChatbotSession
+    session = ChatbotSession()
+    session.reported_symptoms.add("headache")
+    session.asked_missing.add("fever")
+    session.awaiting_followup = "nausea"
+    store = SQLiteSessionStore(ChatbotSession, path=str(tmp_path / "sessions.db"))
+    store.put("s1", session)
+    loaded = store.get("s1")
+    assert loaded.to_state() == session.to_state()
+    assert loaded.scores is not None
+
+
+def test_unknown_store_is_rejected():
+    with pytest.raises(ValueError, match="redis"):
+        create_session_store(Note, backend="redis")
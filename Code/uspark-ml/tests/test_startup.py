@@ -0,0 +1,79 @@
+import pytest
+
+from app.startup import Subsystems, SubsystemUnavailable
+
+
+def test_required_subsystems_always_count_toward_readiness():
+    subsystems = Subsystems(warmup=[])
+    subsystems.add("lazy", lambda: "value")
+    persistence = subsystems.add("persistence", lambda: "writer", required=True)
+    assert subsystems.readiness()[0] is False
+    assert subsystems.readiness()[1]["required"] == ["persistence"]
+    persistence.get()
+    assert subsystems.readiness()[0] is True
+
+
+def test_a_failing_required_subsystem_reports_its_error():
+    def misconfigured():
+        raise RuntimeError("MONGO_URI is not set")
+
+    subsystems = Subsystems(warmup=[])
+    persistence = subsystems.add("persistence", misconfigured, required=True)
+    with pytest.raises(SubsystemUnavailable):
+        persistence.get()
+    ready, report = subsystems.readiness()
+    assert not ready
+    assert "MONGO_URI" in report["subsystems"]["persistence"]["error"]
+
+
+def test_init_runs_once_and_is_retried_after_an_error():
+    calls = []
+
+    def init():
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError("model file missing")
+        return "model"
+
+    subsystem = Subsystems(warmup=[]).add("medseg", init)
+    with pytest.raises(SubsystemUnavailable):
+        subsystem.get()
+    assert subsystem.status()["error"] == "OSError: model file missing"
+    assert subsystem.get() == "model"
+    assert subsystem.get() == "model"
+    assert len(calls) == 2
+    assert subsystem.status()["error"] is None
+
+
+def test_warm_up_readiness_follows_the_configured_subsystems():
+    warmed = []
+    subsystems = Subsystems(warmup=["medseg"])
+    subsystems.add("chat", lambda: "chat")
+    subsystems.add("medseg", lambda: "medseg", warm_up=warmed.append)
+    assert subsystems.readiness()[0] is False
+    subsystems.warm_up()
+    ready, report = subsystems.readiness()
+    assert ready and report["required"] == ["medseg"]
+    assert warmed == ["medseg"]
+    assert report["subsystems"]["medseg"]["warm_seconds"] is not None
+    assert report["subsystems"]["chat"]["ready"] is False
+
+
+def test_warm_up_continues_past_a_failing_subsystem():
+    def broken():
+        raise RuntimeError("no checkpoint")
+
+    subsystems = Subsystems(warmup=["all"])
+    subsystems.add("medseg", broken)
+    subsystems.add("chat", lambda: "chat")
+    subsystems.warm_up()
+    ready, report = subsystems.readiness()
+    assert not ready and report["required"] == ["medseg", "chat"]
+    assert report["subsystems"]["chat"]["ready"] and not report["warming"]
+
+
+def test_unknown_warmup_names_are_rejected():
+    subsystems = Subsystems(warmup=["medsge"])
+    subsystems.add("medseg", lambda: None)
+    with pytest.raises(ValueError, match="medsge"):
+        subsystems.required()
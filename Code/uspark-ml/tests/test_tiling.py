@@ -0,0 +1,53 @@
+import numpy as np
+import torch
+from PIL import Image
+
+from app.tiling import tile_origins, tiled_segmentation
+
+
+def identity(inputs):
+    # Probability of the foreground is the pixel intensity
+    return inputs.mean(dim=1, keepdim=True)
+
+
+def two_class(inputs):
+    probability = inputs.mean(dim=1, keepdim=True)
+    return torch.cat([1 - probability, probability], dim=1)
+
+
+def pattern(width, height, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 2, size=(height, width), dtype=np.uint8) * 255
+    return Image.fromarray(pixels).convert("RGB"), pixels > 0
+
+
+def test_tile_origins_cover_the_whole_length():
+    assert tile_origins(100, tile=256, overlap=32) == [0]
+    origins = tile_origins(700, tile=256, overlap=32)
+    assert origins[0] == 0 and origins[-1] == 700 - 256
+    assert all(b - a <= 256 - 32 for a, b in zip(origins, origins[1:]))
+
+
+def test_identity_predictor_stitches_back_the_input():
+    image, expected = pattern(613, 389)
+    mask = tiled_segmentation(image, identity, channels=1, tile=128, overlap=16, batch_size=3)
+    assert mask.shape == expected.shape
+    assert np.array_equal(mask.astype(bool), expected)
+
+
+def test_multiclass_masks_take_the_argmax():
+    image, expected = pattern(300, 500, seed=1)
+    mask = tiled_segmentation(image, two_class, channels=2, tile=128, overlap=32)
+    assert np.array_equal(mask, expected.astype(np.uint8))
+
+
+def test_images_smaller_than_a_tile_are_padded():
+    image, expected = pattern(50, 70, seed=2)
+    mask = tiled_segmentation(image, identity, channels=1, tile=128, overlap=16)
+    assert np.array_equal(mask.astype(bool), expected)
+
+
+def test_large_masks_spill_to_a_memory_mapped_file():
+    image, expected = pattern(400, 300, seed=3)
+    mask = tiled_segmentation(image, identity, channels=1, tile=128, overlap=16, memory_mb=0.01)
+    assert isinstance(mask, np.memmap)
+    assert np.array_equal(np.asarray(mask).astype(bool), expected)
@@ -0,0 +1,92 @@
+import io
+import gzip
+import zipfile
+import numpy as np
+import nibabel as nib
+import pydicom
+import pytest
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from app import bulk
+from app.ingest import UploadRejected
+from app.volumes import (spool_to_disk, count_nifti_slices, iter_nifti_slices, open_dicom_sources,
+                         order_dicom_series, iter_dicom_slices, iter_batches)
+
+
+def nifti_bytes(data):
+    return nib.Nifti1Image(data, np.eye(4)).to_bytes()
+
+
+def dicom_bytes(z, value, size=8):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.2"
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    dataset = Dataset()
+    dataset.file_meta = meta
+    dataset.SOPClassUID = meta.MediaStorageSOPClassUID
+    dataset.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    dataset.ImagePositionPatient = [0, 0, z]
+    dataset.Rows = dataset.Columns = size
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = "MONOCHROME2"
+    dataset.BitsAllocated = dataset.BitsStored = 16
+    dataset.HighBit = 15
+    dataset.PixelRepresentation = 0
+    dataset.RescaleSlope = 2
+    dataset.RescaleIntercept = -1
+    dataset.PixelData = np.full((size, size), value, dtype=np.uint16).tobytes()
+    buffer = io.BytesIO()
+    dataset.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def zipped(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.parametrize("suffix", [".nii", ".nii.gz"])
+def test_nifti_slices_come_out_plane_by_plane(suffix, tmp_path, monkeypatch):
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    data = np.random.default_rng(0).random((12, 10, 6)).astype(np.float32)
+    raw = nifti_bytes(data)
+    path = spool_to_disk(io.BytesIO(gzip.compress(raw) if suffix.endswith(".gz") else raw), suffix)
+    assert path.endswith(".nii")
+    assert count_nifti_slices(path) == 6
+    slices = list(iter_nifti_slices(path))
+    assert [index for index, _ in slices] == list(range(6))
+    assert all(np.allclose(plane, data[:, :, index]) for index, plane in slices)
+
+
+def test_oversized_volume_is_rejected_and_cleaned_up(tmp_path, monkeypatch):
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    raw = gzip.compress(nifti_bytes(np.zeros((64, 64, 64), dtype=np.float32)))
+    with pytest.raises(UploadRejected) as rejected:
+        spool_to_disk(io.BytesIO(raw), ".nii.gz", max_mb=0.1)
+    assert rejected.value.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_zipped_series_is_ordered_by_position():
+    archive = zipped({"b.dcm": dicom_bytes(5.0, 30), "a.dcm": dicom_bytes(10.0, 20),
+                      "c.dcm": dicom_bytes(-2.5, 10), "README.txt": b"not dicom"})
+    sources = order_dicom_series(open_dicom_sources([("series.zip", archive)]))
+    slices = list(iter_dicom_slices(sources))
+    assert [float(plane[0, 0]) for _, plane in slices] == [19.0, 59.0, 39.0]
+    batches = list(iter_batches(slices, batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 1]
+
+
+def test_zip_bomb_in_a_series_is_rejected_before_it_is_inflated():
+    bomb = b"\0" * (int(bulk.MAX_UPLOAD_MB * 2 ** 20) + 1)
+    archive = zipped({"a.dcm": dicom_bytes(0.0, 1), "bomb.dcm": bomb})
+    sources = open_dicom_sources([("series.zip", archive)])
+    with pytest.raises(UploadRejected) as rejected:
+        order_dicom_series(sources)
+    assert rejected.value.status_code == 413
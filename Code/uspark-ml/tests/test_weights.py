@@ -0,0 +1,110 @@
+import os
+import types
+
+import torch
+import torch.nn as nn
+import pytest
+
+from app.weights import save_flat, load_flat, read_header, assign_weights, ensure_flat, flat_path, map_module_weights
+
+
+def small_model():
+    return nn.Sequential(nn.Conv2d(3, 4, 3), nn.BatchNorm2d(4))
+
+
+def test_flat_file_round_trip(tmp_path):
+    tensors = {"f32": torch.rand(3, 5), "f16": torch.rand(7).half(), "i64": torch.arange(3),
+               "u8": torch.tensor([1, 2, 3], dtype=torch.uint8), "empty": torch.zeros(0)}
+    path = str(tmp_path / "weights.safetensors")
+    save_flat(tensors, path, {"source": "test"})
+    header, data_start = read_header(path)
+    assert data_start % 8 == 0
+    assert header["__metadata__"] == {"source": "test"}
+    loaded = load_flat(path)
+    assert set(loaded) == set(tensors)
+    for name, tensor in tensors.items():
+        assert loaded[name].dtype == tensor.dtype and torch.equal(loaded[name], tensor)
+
+
+def test_assigned_weights_are_views_of_the_mapping(tmp_path):
+    source = small_model()
+    path = str(tmp_path / "model.safetensors")
+    save_flat(source.state_dict(), path)
+    tensors = load_flat(path)
+    model = assign_weights(small_model(), tensors)
+    assert model[0].weight.data_ptr() == tensors["0.weight"].data_ptr()
+    assert not model[0].weight.requires_grad
+    x = torch.rand(1, 3, 8, 8)
+    assert torch.equal(model.eval()(x), source.eval()(x))
+
+
+def test_shape_mismatch_leaves_the_model_untouched():
+    model = small_model()
+    before = {name: tensor.clone() for name, tensor in model.state_dict().items()}
+    tensors = {name: torch.ones_like(tensor) for name, tensor in model.state_dict().items()}
+    tensors["1.running_var"] = torch.ones(5)
+    with pytest.raises(RuntimeError, match="Shape mismatch"):
+        assign_weights(model, tensors)
+    assert all(torch.equal(model.state_dict()[name], tensor) for name, tensor in before.items())
+
+
+def test_strict_assignment_reports_missing_and_unexpected():
+    tensors = dict(small_model().state_dict())
+    tensors.pop("0.bias")
+    tensors["extra"] = torch.zeros(1)
+    with pytest.raises(RuntimeError, match="missing \\['0.bias'\\], unexpected \\['extra'\\]"):
+        assign_weights(small_model(), tensors)
+    model = assign_weights(small_model(), tensors, strict=False)
+    assert model[0].weight.data_ptr() == tensors["0.weight"].data_ptr()
+
+
+def test_checkpoint_is_converted_again_when_it_changes(tmp_path):
+    checkpoint = str(tmp_path / "model.pth")
+    torch.save(small_model().state_dict(), checkpoint)
+    os.utime(checkpoint, (1_000_000, 1_000_000))
+    path = ensure_flat(checkpoint)
+    assert path == flat_path(checkpoint)
+    first = os.path.getmtime(path)
+    os.utime(path, (first - 100, first - 100))
+    assert ensure_flat(checkpoint) == path
+    assert os.path.getmtime(path) == first - 100
+
+    replacement = small_model().state_dict()
+    torch.save(replacement, checkpoint)
+    os.utime(checkpoint, (2_000_000, 2_000_000))
+    ensure_flat(checkpoint)
+    assert read_header(path)[0]["__metadata__"]["source_mtime"] == str(2_000_000.0)
+    assert torch.equal(load_flat(path)["0.weight"], replacement["0.weight"])
+
+
+def with_config(model, name, revision):
+    model.config = types.SimpleNamespace(_name_or_path=name, _commit_hash=revision)
+    return model
+
+
+def test_module_weights_are_rewritten_for_another_revision(tmp_path):
+    path = str(tmp_path / "ner" / "weights.safetensors")
+    first = with_config(small_model(), "org/medical-ner", "rev1")
+    expected = first[0].weight.detach().clone()
+    mapped = map_module_weights(first, path)
+    assert torch.equal(mapped[0].weight, expected)
+    assert read_header(path)[0]["__metadata__"] == {"source": "org/medical-ner", "revision": "rev1"}
+
+    # Same model and revision: the existing file is used as is
+    same = map_module_weights(with_config(small_model(), "org/medical-ner", "rev1"), path)
+    assert torch.equal(same[0].weight, expected)
+
+    updated = with_config(small_model(), "org/medical-ner", "rev2")
+    new_weights = updated[0].weight.detach().clone()
+    mapped = map_module_weights(updated, path)
+    assert torch.equal(mapped[0].weight, new_weights)
+    assert read_header(path)[0]["__metadata__"]["revision"] == "rev2"
+
+
+def test_module_weights_fall_back_when_the_file_cannot_be_written(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    model = with_config(small_model(), "org/medical-ner", "rev1")
+    weight = model[0].weight
+    assert map_module_weights(model, str(blocker / "weights.safetensors")) is model
+    assert model[0].weight is weight
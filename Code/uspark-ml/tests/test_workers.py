@@ -0,0 +1,93 @@
+import os
+import types
+import threading
+
+import pytest
+from PIL import Image
+
+from app.metrics import IMAGES_TOTAL, stage, render_metrics
+from app.workers import InferencePool, pack_requests, unpack_requests, warm_up_pipeline
+
+
+def fake_worker(slot, tasks, results, cpus, threads):
+    # Stands in for worker_main: echoes image sizes, exits on a "crash" request
+    pid = os.getpid()
+    meta = {"versions": {"fake": "1"}, "models": {}, "memory": {}}
+    results.put(("ready", None, pid, meta))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, shm_name, layout = task
+        requests = unpack_requests(shm_name, layout)
+        if any(output == "crash" for _, output in requests):
+            os._exit(1)
+        outputs = [{"size": image.size, "output": output} for image, output in requests]
+        results.put(("done", task_id, pid, {"results": outputs, "metrics": [], **meta}))
+
+
+@pytest.fixture
+def pool():
+    pool = InferencePool(workers=1, threads=1, cpus="", task_timeout=30, target=fake_worker)
+    pool.warm_up(timeout=60)
+    yield pool
+    pool.close()
+
+
+def test_pack_round_trip():
+    images = [Image.new("RGB", (3, 2), (1, 2, 3)), Image.new("L", (4, 5), 7)]
+    shm, layout = pack_requests([(images[0], "png"), (images[1], "jpeg")])
+    try:
+        unpacked = unpack_requests(shm.name, layout)
+    finally:
+        shm.close()
+        shm.unlink()
+    assert [output for _, output in unpacked] == ["png", "jpeg"]
+    assert unpacked[0][0].tobytes() == images[0].tobytes()
+    assert unpacked[1][0].mode == "RGB" and unpacked[1][0].getpixel((0, 0)) == (7, 7, 7)
+
+
+def test_warm_up_leaves_metrics_untouched():
+    def complete_pipeline_image(image):
+        with stage("medseg", "warm-up-test"):
+            IMAGES_TOTAL.inc(modality="warm-up-test")
+        return {}
+
+    mediseg = types.SimpleNamespace(registry=types.SimpleNamespace(load_all=lambda: None),
+                                    complete_pipeline_image=complete_pipeline_image)
+    warm_up_pipeline(mediseg)
+    assert "warm-up-test" not in render_metrics()
+
+
+def test_pool_runs_batches(pool):
+    results = pool.run_batch([(Image.new("RGB", (8, 6)), "png")])
+    assert results == [{"size": (8, 6), "output": "png"}]
+    assert pool.versions() == {"fake": "1"}
+    assert pool.batches == 1
+
+
+def test_dead_worker_fails_its_batch_and_is_restarted(pool):
+    with pytest.raises(RuntimeError, match="exited during the batch"):
+        pool.run_batch([(Image.new("RGB", (4, 4)), "crash")])
+    assert pool.restarts == 1
+    pool.warm_up(timeout=60)
+    assert pool.run_batch([(Image.new("RGB", (4, 4)), "png")])[0]["size"] == (4, 4)
+
+
+def test_other_batches_survive_a_crash(pool):
+    outcomes = {}
+
+    def run(name, output):
+        try:
+            outcomes[name] = pool.run_batch([(Image.new("RGB", (2, 2)), output)])[0]["output"]
+        except RuntimeError as exc:
+            outcomes[name] = exc
+
+    threads = [threading.Thread(target=run, args=("crash", "crash")),
+               threading.Thread(target=run, args=("ok", "png"))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    assert isinstance(outcomes["crash"], RuntimeError)
+    assert outcomes["ok"] == "png"